@@ -1,15 +1,28 @@
+import json
 import ntpath
 import os
+import pickle
+import shutil
 import sys
+import threading
+import time
 import traceback
+from contextlib import contextmanager
+from functools import partial
 
-import requests
 from loguru import logger
 # from huey import SqliteHuey, RedisHuey
-from celery import Celery
+from celery import Celery, chord
+from kombu import Queue
+from typing import List
 from .model.slpk_model.slpk import SLPK
+from .model.slpk_model.sublayer import Sublayer
 from .reader import Reader
 from .my_parser.parser import Parser
+from .utils.checkpoint import Checkpoint
+from .utils.compact_node import compact_slpk, compacting_nodes
+from .utils.profiler import Profiler, merge_profiles
+from .utils.transport import get_transport
 from .utils.type_definition import ApiConfig, TaskStatus
 from .writer import Writer
 from timeit import default_timer as timer
@@ -24,12 +37,19 @@ from .config import config
 celery_app = Celery("convert_app",
                     broker=config["celery"]["broker"],
                     backend=config["celery"]["backend"])
+# worker 默认监听的队列(启动时未指定 -Q)：manager 的转换调度按任务大小发送到 convert_small、convert_large，
+# 分布式转换的子任务使用默认的 celery 队列；只处理一类任务的 worker 可在配置中只保留对应的队列
+celery_app.conf.task_queues = [
+    Queue(name) for name in config["celery"].get("queues", ["celery", "convert_small", "convert_large"])
+]
 
 
 def report_status(
-        project_id: int, model_file_id: int, status: TaskStatus, msg: str = ""
+        project_id: int, model_file_id: int, status: TaskStatus, msg: str = "", metrics: dict = None
 ):
-    base_url = config["model_manager"]["url"]
+    """
+    :param metrics: 各阶段的性能统计，随最终状态上报
+    """
     headers = {
         "accept": "application/json",
         # 'Content-Type': 'application/json',
@@ -39,9 +59,11 @@ def report_status(
         "status": status.value,
         "msg": msg,
     }
+    if metrics:
+        json_data["metrics"] = metrics
     try:
-        response = requests.post(
-            f"{base_url}/project/{project_id}/model-file/convert/{model_file_id}/status",
+        response = get_transport().post(
+            f"project/{project_id}/model-file/convert/{model_file_id}/status",
             headers=headers,
             json=json_data,
         )
@@ -58,35 +80,223 @@ def report_status(
         return False
 
 
+@contextmanager
+def heartbeat(project_id: int, model_file_id: int):
+    """
+    转换过程中定期上报 processing 状态，manager 据此判断转换任务是否仍在运行，长时间未上报的任务会被回收
+    """
+    interval = config["model_manager"].get("heartbeat_interval", 60)
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            report_status(project_id, model_file_id, TaskStatus.processing)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        # 等待进行中的上报结束，避免在最终状态之后到达
+        thread.join()
+
+
 @celery_app.task()
 def start_convert(uuid: str, project_id: int, model_file_id: int):
     input_file_path = f"{config['jrvt_file_root']}/{uuid}.jrvt"  # TODO: maybe rename to a more common suffix?
     config["input_file_path"] = input_file_path
     # config["model_manager"]["model_id"] = model_id
     tic = timer()
+    profiler = Profiler()
+    if config.get("profile", {}).get("callgrind"):
+        profiler.start_callgrind()
     try:
         report_status(project_id, model_file_id, TaskStatus.processing)
-        jrvt = Reader(config)
-        parser = Parser(jrvt)
-        slpkm = SLPK(parser.to_ubm(ntpath.basename(input_file_path)))
-        writer = Writer(slpkm)
-        writer.to_db(config["output_file_root"], project_id, model_file_id)
+        with heartbeat(project_id, model_file_id):
+            checkpoint = Checkpoint(checkpoint_path(uuid))
+            slpkm = load_or_parse(uuid, input_file_path, checkpoint, profiler)
+            writer = Writer(slpkm, checkpoint=checkpoint, profiler=profiler)
+            if config.get("distributed", {}).get("enable"):
+                dispatch_sublayers(writer, uuid, project_id, model_file_id, time.time() - (timer() - tic))
+                profiler.stop_callgrind(os.path.join(config["output_file_root"], f"{uuid}.callgrind"))
+                return
+            writer.to_db(config["output_file_root"], project_id, model_file_id,
+                         partial(report_status, project_id, model_file_id, TaskStatus.processing))
+        get_transport().log_stats()
+        remove_checkpoint(uuid, checkpoint)
         # if not config["server"]["is_server"]:
         #     writer.upload()
         toc = timer()
         report_status(
-            project_id, model_file_id, TaskStatus.success, f"{int(toc - tic)}"
+            project_id, model_file_id, TaskStatus.success, f"{int(toc - tic)}", finish_profile(uuid, profiler)
         )
     except Exception as e:
         print(e)
         traceback_str = "".join(traceback.format_tb(e.__traceback__))
         print("Traceback:\n", traceback_str)
         toc = timer()
-        report_status(project_id, model_file_id, TaskStatus.fail, f"{int(toc - tic)}")
+        report_status(
+            project_id, model_file_id, TaskStatus.fail, f"{int(toc - tic)}", finish_profile(uuid, profiler)
+        )
 
     logger.info(f"总用时: {toc - tic}")
 
 
+def finish_profile(uuid: str, profiler: Profiler) -> dict:
+    """
+    结束性能统计，导出 `{uuid}.profile.json`(开启时还有 `{uuid}.callgrind`)
+    :return: 统计结果
+    """
+    profiler.stop_callgrind(os.path.join(config["output_file_root"], f"{uuid}.callgrind"))
+    profiler.log()
+    metrics = profiler.to_dict()
+    try:
+        profiler.export(profile_path(uuid))
+    except OSError as e:
+        logger.warning(f"fail to export profile: {e}")
+    return metrics
+
+
+def profile_path(uuid: str, idx: int = None) -> str:
+    """
+    分布式转换时各子层任务的 profile 放在共享目录下，由回调合并
+    """
+    if idx is None:
+        return os.path.join(config["output_file_root"], f"{uuid}.profile.json")
+    shared_root = config.get("distributed", {}).get("shared_root", config["output_file_root"])
+    return os.path.join(shared_root, f"{uuid}.profile.{idx}.json")
+
+
+def checkpoint_path(uuid: str, idx: int = None) -> str:
+    """
+    主任务的断点放在输出目录下，子层任务的断点放在共享目录下
+    """
+    if idx is None:
+        return os.path.join(config["output_file_root"], f"{uuid}.checkpoint.json")
+    shared_root = config.get("distributed", {}).get("shared_root", config["output_file_root"])
+    return os.path.join(shared_root, f"{uuid}.checkpoint.{idx}.json")
+
+
+def parse_result_path(uuid: str) -> str:
+    return os.path.join(config["output_file_root"], f"{uuid}.ubm.pickle")
+
+
+def load_or_parse(uuid: str, input_file_path: str, checkpoint: Checkpoint, profiler: Profiler) -> SLPK:
+    """
+    重试时直接读取上次保存的解析结果，否则解析 jrvt 并保存结果
+    """
+    path = parse_result_path(uuid)
+    if checkpoint.is_done("parse") and os.path.isfile(path):
+        logger.info(f"reuse parse result `{path}`")
+        with profiler.stage("reader") as s, open(path, "rb") as fp:
+            s.add(os.path.getsize(path))
+            return pickle.load(fp)
+    with profiler.stage("reader") as s:
+        jrvt = Reader(config)
+        s.add(os.path.getsize(input_file_path))
+    with profiler.stage("parser"):
+        parser = Parser(jrvt)
+        ubm = parser.to_ubm(ntpath.basename(input_file_path))
+    with profiler.stage("slpk") as s:
+        if config.get("compact_nodes", True):
+            # 节点在生成时即压缩，不会同时保留所有子层的 MergedNode
+            with compacting_nodes(Sublayer):
+                slpkm = SLPK(ubm)
+            compact_slpk(slpkm)
+        else:
+            slpkm = SLPK(ubm)
+        s.add(nodes=sum(len(sublayer.merged_nodes) for sublayer in slpkm.sublayers))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(slpkm, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    checkpoint.mark("parse")
+    checkpoint.save()
+    return slpkm
+
+
+def remove_checkpoint(uuid: str, checkpoint: Checkpoint):
+    checkpoint.clear()
+    if os.path.isfile(parse_result_path(uuid)):
+        os.remove(parse_result_path(uuid))
+
+
+def dispatch_sublayers(writer: Writer, uuid: str, project_id: int, model_file_id: int, start_time: float):
+    """
+    分布式转换：主任务上传 layer 信息后，将每个子层拆分为一个子任务，
+    全部子任务完成后由 chord 回调上报转换结果
+    :param start_time: 转换开始的时间戳，用于在回调中计算总用时
+    """
+    writer.to_db_init(project_id, model_file_id)
+    # 子层需要放在所有 worker 都能访问的目录下
+    shared_root = config.get("distributed", {}).get("shared_root", config["output_file_root"])
+    paths = writer.dump_sublayers(os.path.join(shared_root, f"{uuid}.sublayers"))
+    logger.info(f"dispatch {len(paths)} sublayers, model_file_id: {model_file_id}")
+    chord(
+        upload_sublayer.s(uuid, project_id, model_file_id, idx, path) for idx, path in enumerate(paths)
+    )(
+        finish_convert.s(uuid, project_id, model_file_id, start_time, writer.profiler.to_dict()).on_error(
+            fail_convert.s(uuid, project_id, model_file_id, start_time)
+        )
+    )
+
+
+@celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=config.get("distributed", {}).get("max_retries", 3),
+)
+def upload_sublayer(uuid: str, project_id: int, model_file_id: int, idx: int, path: str):
+    with open(path, "rb") as fp:
+        sublayer = pickle.load(fp)
+    # 子任务重试时跳过已上传的节点
+    writer = Writer(name=f"{uuid}.jrvt", checkpoint=Checkpoint(checkpoint_path(uuid, idx)))
+    with heartbeat(project_id, model_file_id):
+        writer.to_db_sublayer(project_id, model_file_id, idx, sublayer)
+    writer.profiler.export(profile_path(uuid, idx))
+    logger.info(f"upload sublayer {idx} complete, model_file_id: {model_file_id}")
+    return idx
+
+
+@celery_app.task()
+def finish_convert(sublayer_indexes: List[int], uuid: str, project_id: int, model_file_id: int, start_time: float,
+                   metrics: dict = None):
+    """
+    :param metrics: 主任务(解析及上传 layer)的性能统计，与各子层任务的统计合并后上报
+    """
+    remove_sublayer_dump(uuid)
+    profiles = [metrics or {}]
+    for idx in sublayer_indexes:
+        Checkpoint(checkpoint_path(uuid, idx)).clear()
+        try:
+            with open(profile_path(uuid, idx), "r", encoding="utf-8") as f:
+                profiles.append(json.load(f))
+            os.remove(profile_path(uuid, idx))
+        except (OSError, ValueError) as e:
+            logger.warning(f"fail to load profile of sublayer {idx}: {e}")
+    remove_checkpoint(uuid, Checkpoint(checkpoint_path(uuid)))
+    duration = time.time() - start_time
+    metrics = merge_profiles(profiles)
+    metrics["total_time"] = round(duration, 3)
+    with open(profile_path(uuid), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    report_status(project_id, model_file_id, TaskStatus.success, f"{int(duration)}", metrics)
+    logger.info(f"总用时: {duration}, sublayers: {sublayer_indexes}")
+
+
+@celery_app.task()
+def fail_convert(request, exc, traceback_, uuid: str, project_id: int, model_file_id: int, start_time: float):
+    logger.error(f"upload sublayer failed, model_file_id: {model_file_id}, task: {request.id}, {exc}")
+    remove_sublayer_dump(uuid)
+    report_status(project_id, model_file_id, TaskStatus.fail, f"{int(time.time() - start_time)}")
+
+
+def remove_sublayer_dump(uuid: str):
+    shared_root = config.get("distributed", {}).get("shared_root", config["output_file_root"])
+    shutil.rmtree(os.path.join(shared_root, f"{uuid}.sublayers"), ignore_errors=True)
+
+
 if __name__ == "__main__":
     # report_status(1, 2, TaskStatus.processing)
     # import asyncio
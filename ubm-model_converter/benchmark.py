@@ -0,0 +1,325 @@
+"""
+converter 写出阶段的基准测试
+
+生成指定规模的合成模型(与 SLPK、Sublayer、MergedNode 接口一致)，对本地启动的模拟 model manager 执行
+Writer.to_db(或 Writer.to_file)，输出吞吐量(nodes/s、MB/s)、各接口耗时分位数、各阶段统计及峰值内存，
+并可与保存的基准结果比较，结果变差超过阈值时以非 0 状态退出，用于 CI。
+
+    python -m src.benchmark --nodes 2000 --vertices 500 --textures 20 --baseline benchmark_baseline.json
+    python -m src.benchmark --nodes 2000 --save-baseline benchmark_baseline.json
+
+未安装 DracoPy 及 draco_encoder 的环境可以加 `--no-draco`，geometry 不压缩直接上传。
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from loguru import logger
+
+from .config import config
+from .utils.compact_node import CompactingList
+from .utils.profiler import Profiler, peak_rss
+from .utils.transport import get_transport
+from .writer import Writer
+
+# 与基准比较的指标，True 表示越大越好
+COMPARED_METRICS = {
+    "nodes_per_second": True,
+    "mb_per_second": True,
+    "peak_rss": False,
+}
+
+
+class SyntheticMergedNode:
+    def __init__(self, rnd: random.Random, vertex_count: int, attribute_count: int, attribute_size: int,
+                 feature_count: int, texture: Optional[str]):
+        def data(size: int) -> bytes:
+            return rnd.randbytes(size)
+
+        self.polymesh_header_data = struct.pack("<II", vertex_count, feature_count)
+        self.polymesh_position_bytes = data(vertex_count * 12)
+        self.polymesh_normal_bytes = data(vertex_count * 12)
+        self.polymesh_uv_bytes = data(vertex_count * 8)
+        self.polymesh_color_bytes = data(vertex_count * 4)
+        self.polymesh_uvregion_bytes = data(vertex_count * 8)
+        self.feature_id_bytes = data(feature_count * 8)
+        self.face_range_bytes = data(feature_count * 8)
+        self.has_texture = texture is not None
+        self.diffuse_map = [texture]
+        # 字段 0 为构件 id，其余为字符串，字节数包含结尾的 \0
+        ids = [rnd.randrange(1 << 32) for _ in range(feature_count)]
+        values = [ids] + [["x" * attribute_size for _ in range(feature_count)] for _ in range(attribute_count - 1)]
+        self.attribute = {
+            "value": values,
+            "size_bytes": [[4] * feature_count] + [[attribute_size + 1] * feature_count] * (attribute_count - 1),
+        }
+
+
+class SyntheticInfo:
+    def __init__(self, idx: int):
+        self.meta = {"folderPattern": "basic", "ArchiveCompressionType": "Store"}
+        self.scene_layer = {"id": idx, "name": f"sublayer_{idx}", "layerType": "3DObject"}
+
+
+class SyntheticNodepage:
+    def __init__(self, node_count: int):
+        self.nodes = [{"index": i, "children": [], "mesh": {"geometry": {"resource": i}}} for i in range(node_count)]
+
+
+class SyntheticSublayer:
+    def __init__(self, idx: int, merged_nodes: List[SyntheticMergedNode], attribute_count: int):
+        self.info = SyntheticInfo(idx)
+        self.merged_nodes = merged_nodes
+        self.nodes = merged_nodes
+        self.nodepage = SyntheticNodepage(len(merged_nodes))
+        self.attrnamelist = [f"attr_{i}" for i in range(attribute_count)]
+
+
+class SyntheticLayer:
+    def __init__(self, sublayer_count: int):
+        self.meta = {"nodeCount": 0}
+        self.sublayer_count = sublayer_count
+
+    def to_dict(self) -> dict:
+        return {
+            "id": 0,
+            "layerType": "Building",
+            "sublayers": [{"id": i, "layerType": "3DObject"} for i in range(self.sublayer_count)],
+        }
+
+
+class SyntheticSLPK:
+    def __init__(self, name: str, sublayers: List[SyntheticSublayer]):
+        self.name = name
+        self.sublayers = sublayers
+        self.layer = SyntheticLayer(len(sublayers))
+
+
+def write_png(path: str, size: int, rnd: random.Random):
+    """
+    生成随机颜色的 RGB png
+    """
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    row = b"\x00" + bytes(rnd.randrange(256) for _ in range(3)) * size
+    with open(path, "wb") as fp:
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        fp.write(chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)))
+        fp.write(chunk(b"IDAT", zlib.compress(row * size)))
+        fp.write(chunk(b"IEND", b""))
+
+
+def build_model(args, texture_root: str) -> SyntheticSLPK:
+    rnd = random.Random(args.seed)
+    textures = []
+    for i in range(args.textures):
+        path = os.path.join(texture_root, f"texture_{i}.png")
+        write_png(path, args.texture_size, rnd)
+        textures.append(path)
+    sublayers = []
+    per_sublayer = max(args.nodes // args.sublayers, 1)
+    for idx in range(args.sublayers):
+        nodes = (
+            SyntheticMergedNode(rnd, args.vertices, args.attributes, args.attribute_size, args.features,
+                                textures[i % len(textures)] if textures else None)
+            for i in range(per_sublayer)
+        )
+        # 紧凑表示时节点在生成时即压缩，与转换时一致
+        nodes = CompactingList(nodes) if args.compact else list(nodes)
+        sublayers.append(SyntheticSublayer(idx, nodes, args.attributes))
+    return SyntheticSLPK(f"benchmark_{args.seed}.jrvt", sublayers)
+
+
+class PassthroughDraco:
+    """
+    不压缩 geometry，用于没有 DracoPy 及 draco_encoder 的环境
+    """
+    chunk_size = 64
+
+    @staticmethod
+    def encode_many(buffers, layout, t, use_deck=False) -> List[Optional[bytes]]:
+        return [bytes(buffer) for buffer in buffers]
+
+
+class StubManager(BaseHTTPRequestHandler):
+    """
+    模拟 model manager，接收所有请求并返回成功，只统计请求数与字节数
+    """
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    requests = 0
+    bytes_received = 0
+    latency = 0.0  # 模拟的服务端处理耗时，单位秒
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))) if "Content-Length" in self.headers \
+            else self.read_chunked()
+        with StubManager.lock:
+            StubManager.requests += 1
+            StubManager.bytes_received += len(body)
+        if StubManager.latency:
+            time.sleep(StubManager.latency)
+        res = {"code": 200}
+        if self.path.endswith("/blob/missing"):
+            res["data"] = json.loads(body).get("hashes", [])
+        elif self.path.endswith("/blob/link"):
+            res["missing"] = []
+        self.send_json(res)
+
+    def do_GET(self):
+        # 增量模式查询上一版本的指纹(fingerprints/previous)，没有上一版本时 data 为 null
+        with StubManager.lock:
+            StubManager.requests += 1
+        self.send_json({"code": 200, "data": None})
+
+    def send_json(self, res: dict):
+        data = json.dumps(res).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_chunked(self) -> bytes:
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return bytes(body)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_manager() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubManager)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(args) -> dict:
+    work_root = tempfile.mkdtemp(prefix="ubm_benchmark_")
+    texture_root = os.path.join(work_root, "textures")
+    os.makedirs(texture_root)
+    slpk = build_model(args, texture_root)
+    node_count = sum(len(sublayer.merged_nodes) for sublayer in slpk.sublayers)
+    logger.info(f"synthetic model: {len(slpk.sublayers)} sublayers, {node_count} nodes.")
+
+    config["output_file_root"] = work_root
+    config.setdefault("texture_cache", {})["root"] = os.path.join(work_root, "texture_cache")
+    server = None
+    if args.mode == "db":
+        server = start_stub_manager()
+        StubManager.latency = args.latency / 1000
+        config["model_manager"]["url"] = f"http://127.0.0.1:{server.server_address[1]}"
+        if args.shared_storage:
+            shared_root = os.path.join(work_root, "shared")
+            os.makedirs(shared_root)
+            config["model_manager"]["shared_storage"] = {"enable": True, "root": shared_root}
+
+    profiler = Profiler()
+    writer = Writer(slpk, profiler=profiler)
+    if args.no_draco:
+        writer.draco_engine = PassthroughDraco()
+    tic = time.perf_counter()
+    if args.mode == "db":
+        writer.to_db(work_root, 1, 1)
+    else:
+        writer.to_file(work_root)
+    elapsed = time.perf_counter() - tic
+    if server:
+        server.shutdown()
+
+    nbytes = StubManager.bytes_received if args.mode == "db" else writer.sink.bytes_written
+    if args.mode == "db" and args.shared_storage:
+        nbytes += sum(
+            os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(os.path.join(work_root, "shared"))
+            for f in files
+        )
+    result = {
+        "mode": args.mode,
+        "nodes": node_count,
+        "seconds": round(elapsed, 3),
+        "nodes_per_second": round(node_count / elapsed, 2),
+        "mb_per_second": round(nbytes / elapsed / (1 << 20), 2),
+        "bytes": nbytes,
+        "requests": StubManager.requests,
+        "peak_rss": peak_rss(),
+        "stages": profiler.to_dict()["stages"],
+        "latency": {
+            endpoint: {k: stat[k] for k in ("count", "avg_ms", "p50_ms", "p95_ms", "p99_ms")}
+            for endpoint, stat in get_transport().stats().items()
+        } if args.mode == "db" else {},
+    }
+    return result
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    :return: 超过阈值的退化项
+    """
+    regressions = []
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        current, base = result.get(metric), baseline.get(metric)
+        if not current or not base:
+            continue
+        change = (current - base) / base
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {base} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="converter writer benchmark")
+    parser.add_argument("--mode", choices=("db", "file"), default="db", help="上传至模拟 manager 或写出 slpk 文件")
+    parser.add_argument("--nodes", type=int, default=1000, help="合并节点总数")
+    parser.add_argument("--sublayers", type=int, default=4)
+    parser.add_argument("--vertices", type=int, default=500, help="每个节点的顶点数")
+    parser.add_argument("--features", type=int, default=8, help="每个节点的构件数")
+    parser.add_argument("--textures", type=int, default=0, help="不同纹理图片数，节点循环使用")
+    parser.add_argument("--texture-size", type=int, default=256)
+    parser.add_argument("--attributes", type=int, default=4, help="每个构件的属性数")
+    parser.add_argument("--attribute-size", type=int, default=32, help="每个属性值的字节数")
+    parser.add_argument("--latency", type=float, default=0, help="模拟 manager 的处理耗时，单位 ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compact", action="store_true", help="使用紧凑的节点表示")
+    parser.add_argument("--shared-storage", action="store_true", help="db 模式下通过共享存储传输二进制数据")
+    parser.add_argument("--no-draco", action="store_true", help="跳过 draco 压缩")
+    parser.add_argument("--output", help="结果输出路径")
+    parser.add_argument("--baseline", help="基准结果路径，与之比较")
+    parser.add_argument("--save-baseline", help="将本次结果保存为基准")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的退化比例")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            logger.error("benchmark regressed:\n" + "\n".join(regressions))
+            return 1
+        logger.info("benchmark within tolerance of baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+import os
+import sys
+import types
+
+# converter 部署为 `src` 包(celery 任务名为 src.api.start_convert)，模块之间使用相对导入；
+# 单独检出本目录运行测试时，将本目录注册为 `src` 包
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import src  # noqa: F401
+except ImportError:
+    package = types.ModuleType("src")
+    package.__path__ = [ROOT]
+    sys.modules["src"] = package
+
+# config.py 随部署环境下发，不在仓库中；缺失时注册一份测试用配置，只包含测试涉及的键
+try:
+    import src.config  # noqa: F401
+except ImportError:
+    module = types.ModuleType("src.config")
+    module.config = {
+        "output_file_root": os.path.join(ROOT, "tests", "output"),
+        "model_manager": {"url": "http://127.0.0.1:0"},
+        "max_worker": 2,
+        "use_deck": False,
+        "nodepage_size": 64,
+    }
+    sys.modules["src.config"] = module
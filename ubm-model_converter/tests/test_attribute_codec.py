@@ -0,0 +1,98 @@
+"""
+属性编码与逐个值编码的参考实现比较
+
+    pytest tests/test_attribute_codec.py
+    python -m src.tests.test_attribute_codec  # 在 src 的上级目录执行，比较两种实现的耗时
+
+耗时(5000 个值，各取 5 次中的最小值)：构件 id 列约快 10 倍，ASCII 字符串列约 4～5 倍，中文字符串列约 3 倍，
+字符串列未达到 10 倍的目标：整列编码后剩余的时间主要是 `str.encode` 本身(UTF-8 编码)，无法再减少。
+id 与字节数数组也试过 NumPy(`np.array(values, dtype="<u4").tobytes()`)，输入为 Python list 时
+转换为数组的开销比 `struct.pack` 更大(约 120us 对 70us)，因此没有使用。
+"""
+import timeit
+
+import pytest
+
+from src.utils.attribute_codec import encode_attribute, encode_attributes, decode_attribute
+
+
+# 与 model manager 的 tests/test_attribute_codec.py 相同，两边的实现必须得到相同的结果
+GOLDEN = [
+    (0, [1, 2, 4294967295], [4, 4, 4], "030000000100000002000000ffffffff"),
+    (1, ["Wall", None, "基本墙"], [5, 1, 10],
+     "030000001000000005000000010000000a00000057616c6c0000e59fbae69cace5a29900"),
+    (1, [], [], "0000000000000000"),
+]
+
+
+def encode_attribute_per_value(attribute_id: int, values: list, byte_counts: list) -> bytes:
+    """
+    原有的逐个值编码实现(逐个 `int.to_bytes` 与 `str.encode` 后拼接)，作为正确性与耗时的参照
+    """
+    parts = [len(byte_counts).to_bytes(4, "little", signed=False)]
+    if attribute_id == 0:
+        for value in values:
+            parts.append(value.to_bytes(4, "little", signed=False))
+        return b"".join(parts)
+    parts.append(sum(byte_counts).to_bytes(4, "little", signed=False))
+    for byte_count in byte_counts:
+        parts.append(byte_count.to_bytes(4, "little", signed=False))
+    for value in values:
+        if value is not None:
+            parts.append(value.encode())
+        parts.append(b"\0")
+    return b"".join(parts)
+
+
+def make_column(attribute_id: int, count: int, text: str = "Wall"):
+    if attribute_id == 0:
+        values = list(range(1, count + 1))
+        return values, [4] * count
+    values = [None if i % 7 == 0 else f"{text}-{i}" for i in range(count)]
+    return values, [len(("" if value is None else value).encode()) + 1 for value in values]
+
+
+@pytest.mark.parametrize("attribute_id,values,byte_counts,expected", GOLDEN)
+def test_encode_attribute_golden(attribute_id, values, byte_counts, expected):
+    assert encode_attribute(attribute_id, values, byte_counts).hex() == expected
+    assert encode_attribute_per_value(attribute_id, values, byte_counts).hex() == expected
+
+
+@pytest.mark.parametrize("attribute_id,text", [(0, ""), (1, "Wall"), (2, "基本墙:常规-200mm")])
+@pytest.mark.parametrize("count", [0, 1, 1000])
+def test_encode_attribute_matches_per_value(attribute_id, text, count):
+    values, byte_counts = make_column(attribute_id, count, text)
+    assert encode_attribute(attribute_id, values, byte_counts) == \
+        encode_attribute_per_value(attribute_id, values, byte_counts)
+
+
+@pytest.mark.parametrize("attribute_id,text", [(0, ""), (1, "Wall"), (2, "基本墙:常规-200mm")])
+def test_decode_attribute_round_trip(attribute_id, text):
+    values, byte_counts = make_column(attribute_id, 100, text)
+    decoded, decoded_counts = decode_attribute(attribute_id, encode_attribute(attribute_id, values, byte_counts))
+    if attribute_id == 0:
+        assert decoded == values and decoded_counts is None
+    else:
+        assert decoded == ["" if value is None else value for value in values]
+        assert decoded_counts == byte_counts
+
+
+def test_encode_attributes_keeps_field_order():
+    ids, id_counts = make_column(0, 10)
+    names, name_counts = make_column(1, 10)
+    attribute = {"value": [ids, names], "size_bytes": [id_counts, name_counts]}
+    assert encode_attributes(attribute) == [
+        encode_attribute_per_value(0, ids, id_counts),
+        encode_attribute_per_value(1, names, name_counts),
+    ]
+
+
+if __name__ == "__main__":
+    for name, attribute_id, text in (("ids", 0, ""), ("ascii", 1, "Wall"), ("cjk", 2, "基本墙:常规-200mm")):
+        values, byte_counts = make_column(attribute_id, 5000, text)
+        per_value = min(timeit.repeat(lambda: encode_attribute_per_value(attribute_id, values, byte_counts),
+                                      number=20, repeat=5))
+        column = min(timeit.repeat(lambda: encode_attribute(attribute_id, values, byte_counts),
+                                   number=20, repeat=5))
+        print(f"{name:6s} per value {per_value / 20 * 1e6:8.0f}us  column {column / 20 * 1e6:8.0f}us  "
+              f"{per_value / column:5.1f}x")
@@ -0,0 +1,73 @@
+import json
+import os
+import types
+
+import pytest
+
+from src.utils.checkpoint import Checkpoint
+
+
+def test_resume_skips_done_items(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, save_interval=0)
+    assert not checkpoint.resumed
+    checkpoint.mark("sublayer/0/geometry")
+    checkpoint.mark("sublayer/0/attribute")
+
+    resumed = Checkpoint(path)
+    assert resumed.resumed
+    assert resumed.is_done("sublayer/0/geometry")
+    assert resumed.is_done("sublayer/0/attribute")
+    assert not resumed.is_done("sublayer/1/geometry")
+
+
+def test_mark_throttles_saves(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, save_interval=3600)
+    checkpoint.mark("a")
+    checkpoint.mark("b")
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"done": ["a"]}
+
+    checkpoint.save()
+    assert Checkpoint(path).is_done("b")
+
+
+def test_save_replaces_atomically(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, save_interval=0)
+    for i in range(10):
+        checkpoint.mark(f"node/{i}")
+    assert os.listdir(tmp_path) == ["checkpoint.json"]
+
+
+def test_clear_removes_file(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, save_interval=0)
+    checkpoint.mark("a")
+    checkpoint.clear()
+    assert not os.path.exists(path)
+    assert not checkpoint.is_done("a")
+    assert not Checkpoint(path).resumed
+
+
+def test_draco_failure_is_not_checkpointed(tmp_path, monkeypatch):
+    writer_module = pytest.importorskip("src.writer")
+    writer = writer_module.Writer.__new__(writer_module.Writer)
+    writer.checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), save_interval=0)
+    writer.slpk_root = str(tmp_path)
+    uploaded = []
+    monkeypatch.setattr(writer, "put_bin", lambda *args: uploaded.append(args[2]) or True, raising=False)
+    node = types.SimpleNamespace(has_texture=False)
+    node_dir = str(tmp_path / "nodes" / "0")
+
+    res = writer.checkpointed("node/0/0", writer.upload_merged_nodes, 1, 2, node, None, node_dir, 0, 0)
+    assert res is False
+    assert not Checkpoint(str(tmp_path / "checkpoint.json")).is_done("node/0/0")
+
+    # 重试时该节点重新压缩并上传
+    writer.checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), save_interval=0)
+    assert not writer.is_done("node/0/0")
+    writer.checkpointed("node/0/0", writer.upload_merged_nodes, 1, 2, node, b"draco", node_dir, 0, 0)
+    assert len(uploaded) == 1 and uploaded[0].replace(os.sep, "/").endswith("geometries/1.bin")
+    assert Checkpoint(str(tmp_path / "checkpoint.json")).is_done("node/0/0")
@@ -0,0 +1,134 @@
+import pickle
+import struct
+import tracemalloc
+
+import pytest
+
+from src.utils import geometry_buffer
+from src.utils.compact_node import GEOMETRY_STREAMS, CompactMergedNode, CompactingList, compact_sublayer, \
+    compacting_nodes
+
+
+class ChunkedNode:
+    """
+    与 MergedNode 一致：顶点流为大量小 bytes 组成的 list
+    """
+
+    def __init__(self, vertex_count: int = 30, feature_count: int = 2, seed: int = 0):
+        def chunks(size: int, count: int) -> list:
+            return [bytes([(seed + i) % 256]) * size for i in range(count)]
+
+        self.polymesh_header_data = struct.pack("<II", vertex_count, feature_count)
+        self.polymesh_position_bytes = chunks(12, vertex_count)
+        self.polymesh_normal_bytes = chunks(12, vertex_count)
+        self.polymesh_uv_bytes = chunks(8, vertex_count)
+        self.polymesh_color_bytes = chunks(4, vertex_count)
+        self.polymesh_uvregion_bytes = None
+        self.feature_id_bytes = chunks(8, feature_count)
+        self.face_range_bytes = chunks(8, feature_count)
+        self.has_texture = False
+        self.diffuse_map = [None]
+        self.attribute = {"value": [[1, 2]], "size_bytes": [[4, 4]]}
+
+
+class Sublayer:
+    def __init__(self, nodes=()):
+        self.merged_nodes = []
+        for node in nodes:
+            self.merged_nodes.append(node)
+
+
+def joined(stream) -> bytes:
+    if stream is None:
+        return b""
+    if isinstance(stream, bytes):
+        return stream
+    return b"".join(bytes(chunk) for chunk in stream)
+
+
+def test_views_match_original_streams():
+    node = ChunkedNode()
+    compact = CompactMergedNode(node)
+    for name in GEOMETRY_STREAMS:
+        view = getattr(compact, name)
+        assert bytes(view.buffer) == joined(getattr(node, name))
+        assert view.nbytes == len(joined(getattr(node, name)))
+        assert b"".join(bytes(chunk) for chunk in view) == joined(getattr(node, name))
+    assert compact.attribute is node.attribute
+    with pytest.raises(AttributeError):
+        compact.polymesh_unknown_bytes
+
+
+def test_view_indexing():
+    view = CompactMergedNode(ChunkedNode()).polymesh_position_bytes
+    assert len(view) == 1
+    assert bytes(view[-1]) == bytes(view[0]) == bytes(view.buffer)
+    assert [bytes(chunk) for chunk in view[:]] == [bytes(view.buffer)]
+    with pytest.raises(IndexError):
+        view[1]
+    # 空的顶点流没有分块
+    assert len(CompactMergedNode(ChunkedNode()).polymesh_uvregion_bytes) == 0
+
+
+def test_geometry_buffer_unchanged():
+    node = ChunkedNode()
+    compact = CompactMergedNode(node)
+    layout = GEOMETRY_STREAMS[1:]
+    assert geometry_buffer.assemble(compact.polymesh_header_data, (getattr(compact, name) for name in layout)) == \
+        geometry_buffer.assemble(node.polymesh_header_data, (getattr(node, name) for name in layout))
+
+
+def test_compacting_list():
+    nodes = CompactingList([ChunkedNode(), None])
+    nodes.append(ChunkedNode())
+    nodes.extend([ChunkedNode()])
+    nodes.insert(0, ChunkedNode())
+    nodes += [ChunkedNode()]
+    nodes[1] = ChunkedNode()
+    nodes[2:3] = [ChunkedNode()]
+    assert all(isinstance(node, CompactMergedNode) for node in nodes)
+    nodes[0] = None
+    assert nodes[0] is None
+    # 序列化为普通 list
+    assert type(pickle.loads(pickle.dumps(nodes))) is list
+
+
+def test_compacting_nodes_on_append():
+    with compacting_nodes(Sublayer):
+        sublayer = Sublayer([ChunkedNode(), ChunkedNode()])
+    assert isinstance(sublayer.merged_nodes, CompactingList)
+    assert all(isinstance(node, CompactMergedNode) for node in sublayer.merged_nodes)
+    # 退出后恢复原有的类，不影响之后创建的实例
+    assert "merged_nodes" not in Sublayer.__dict__
+    assert isinstance(Sublayer([ChunkedNode()]).merged_nodes[0], ChunkedNode)
+    sublayer.merged_nodes[0] = None
+    compact_sublayer(sublayer)
+    assert sublayer.merged_nodes[0] is None
+
+
+def peak_memory(build) -> int:
+    tracemalloc.start()
+    try:
+        result = build()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def test_compacting_on_produce_lowers_peak_memory():
+    count = 200
+
+    def compact_after():
+        sublayer = Sublayer(ChunkedNode(seed=i) for i in range(count))
+        compact_sublayer(sublayer)
+        return sublayer
+
+    def compact_on_produce():
+        with compacting_nodes(Sublayer):
+            return Sublayer(ChunkedNode(seed=i) for i in range(count))
+
+    after, on_produce = peak_memory(compact_after), peak_memory(compact_on_produce)
+    # 生成后再压缩时所有小 bytes 同时存在；生成时压缩的峰值只有紧凑数据加一个节点
+    assert on_produce * 2 < after
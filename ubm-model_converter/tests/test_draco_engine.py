@@ -0,0 +1,119 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from src.utils import draco_engine, geometry_buffer
+from src.utils.draco_engine import DracoEngine, feature_index, parse_geometry
+
+DracoPy = pytest.importorskip("DracoPy")
+
+UPLOAD_LAYOUT = (
+    "polymesh_position_bytes",
+    "polymesh_uv_bytes",
+    "polymesh_normal_bytes",
+    "polymesh_color_bytes",
+    "feature_id_bytes",
+    "face_range_bytes",
+)
+FILE_LAYOUT = (
+    "polymesh_position_bytes",
+    "polymesh_normal_bytes",
+    "polymesh_uv_bytes",
+    "polymesh_color_bytes",
+    "polymesh_uvregion_bytes",
+    "feature_id_bytes",
+    "face_range_bytes",
+)
+
+
+def make_geometry(layout, faces=(4, 2), seed=0):
+    """
+    按 writer 的方式组装 0.bin，faces 为每个构件的三角形数
+    """
+    rng = np.random.default_rng(seed)
+    vertex_count = sum(faces) * 3
+    ranges, first = [], 0
+    for count in faces:
+        ranges.append((first, first + count - 1))
+        first += count
+    normals = rng.normal(size=(vertex_count, 3)).astype("<f4")
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    streams = {
+        "polymesh_position_bytes": (rng.random((vertex_count, 3)) * 100).astype("<f4"),
+        "polymesh_normal_bytes": normals,
+        "polymesh_uv_bytes": rng.random((vertex_count, 2)).astype("<f4"),
+        "polymesh_color_bytes": rng.integers(0, 256, (vertex_count, 4), dtype=np.uint8),
+        "polymesh_uvregion_bytes": rng.integers(0, 65536, (vertex_count, 4), dtype=np.uint16).astype("<u2"),
+        "feature_id_bytes": np.arange(10, 10 + len(faces), dtype="<u8"),
+        "face_range_bytes": np.array(ranges, dtype="<u4"),
+    }
+    header = struct.pack("<II", vertex_count, len(faces))
+    return geometry_buffer.assemble(header, (streams[name] for name in layout)), streams
+
+
+def test_parse_geometry_follows_layout():
+    for layout in (UPLOAD_LAYOUT, FILE_LAYOUT):
+        buffer, streams = make_geometry(layout)
+        parsed = parse_geometry(buffer, layout)
+        assert list(parsed) == list(layout)
+        for name in layout:
+            np.testing.assert_array_equal(parsed[name].reshape(streams[name].shape), streams[name])
+
+
+def test_parse_geometry_rejects_wrong_layout():
+    buffer, _ = make_geometry(FILE_LAYOUT)
+    with pytest.raises(ValueError):
+        parse_geometry(buffer, UPLOAD_LAYOUT)
+
+
+def test_feature_index_expands_face_ranges():
+    index = feature_index(np.array([[0, 1], [2, 2]]), 9)
+    assert index.ravel().tolist() == [0] * 6 + [1] * 3
+
+
+@pytest.mark.parametrize("layout", [UPLOAD_LAYOUT, FILE_LAYOUT])
+def test_encode_round_trip(layout):
+    buffer, streams = make_geometry(layout)
+    encoded = draco_engine._encode_dracopy(buffer, layout)
+    mesh = DracoPy.decode(encoded)
+    positions = streams["polymesh_position_bytes"]
+    # 非索引三角形，顶点顺序可能被重排，按三角形个数与坐标范围比较，误差不超过量化步长
+    assert len(mesh.faces) == len(positions) // 3
+    step = (positions.max() - positions.min()) / (2 ** 14 - 1)
+    decoded = np.asarray(mesh.points)[np.asarray(mesh.faces).ravel()]
+    order = np.lexsort(positions.T)
+    decoded_order = np.lexsort(decoded.T)
+    np.testing.assert_allclose(decoded[decoded_order], positions[order], atol=step * 2)
+    features = np.asarray(mesh.get_attribute_by_name("feature-index")["data"]).ravel()
+    assert sorted(features.tolist()) == [0] * 12 + [1] * 6
+    assert (mesh.get_attribute_by_name("uv-region") is not None) == ("polymesh_uvregion_bytes" in layout)
+
+
+def test_encode_failure_returns_none():
+    buffer, _ = make_geometry(FILE_LAYOUT)
+    assert draco_engine._encode_dracopy(buffer[:-1], FILE_LAYOUT) is None
+
+
+def test_engine_keeps_order_across_batches():
+    buffers = [make_geometry(UPLOAD_LAYOUT, faces=(i + 1,), seed=i)[0] for i in range(5)]
+    engine = DracoEngine(max_workers=2, batch_size=2, backend="dracopy")
+    try:
+        assert engine.chunk_size == 4
+        geometries = engine.encode_many(buffers, UPLOAD_LAYOUT, t=0)
+    finally:
+        engine.shutdown()
+    assert [len(DracoPy.decode(geometry).faces) for geometry in geometries] == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.skipif(not os.path.isfile(draco_engine.draco_encoder), reason="draco_encoder not installed")
+def test_parity_with_draco_encoder():
+    # 两种后端的输出不是逐字节相同的，比较解码后的几何
+    buffer, _ = make_geometry(FILE_LAYOUT)
+    expected = DracoPy.decode(draco_engine._encode_one(buffer, 1, False))
+    actual = DracoPy.decode(draco_engine._encode_dracopy(buffer, FILE_LAYOUT))
+    assert len(actual.faces) == len(expected.faces)
+    np.testing.assert_allclose(
+        np.sort(np.asarray(actual.points), axis=0), np.sort(np.asarray(expected.points), axis=0), atol=0.05
+    )
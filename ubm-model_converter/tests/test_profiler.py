@@ -0,0 +1,70 @@
+import json
+import threading
+
+from src.utils.profiler import Profiler, merge_profiles
+
+
+def test_stage_accumulates_counters():
+    profiler = Profiler()
+    for _ in range(3):
+        with profiler.stage("draco") as s:
+            s.add(nbytes=100, nodes=2)
+    profiler.record("draco", nbytes=50, count=0)
+
+    stats = profiler.to_dict()["stages"]["draco"]
+    assert (stats["count"], stats["bytes"], stats["nodes"]) == (3, 350, 6)
+    assert stats["wall_time"] >= 0 and stats["cpu_time"] >= 0
+
+
+def test_stage_recorded_on_error():
+    profiler = Profiler()
+    try:
+        with profiler.stage("upload") as s:
+            s.add(nodes=1)
+            raise ValueError
+    except ValueError:
+        pass
+    assert profiler.to_dict()["stages"]["upload"]["nodes"] == 1
+
+
+def test_concurrent_stages():
+    profiler = Profiler()
+
+    def work():
+        for _ in range(100):
+            with profiler.stage("texture") as s:
+                s.add(nbytes=1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = profiler.to_dict()["stages"]["texture"]
+    assert (stats["count"], stats["bytes"]) == (400, 400)
+
+
+def test_export(tmp_path):
+    profiler = Profiler()
+    with profiler.stage("reader"):
+        pass
+    path = str(tmp_path / "profile.json")
+    profiler.export(path)
+    with open(path, encoding="utf-8") as f:
+        assert "reader" in json.load(f)["stages"]
+
+
+def test_merge_profiles():
+    main = {"total_time": 10, "peak_rss": 100, "stages": {"slpk": {"count": 1, "wall_time": 2, "nodes": 5}}}
+    sublayer = {"total_time": 8, "peak_rss": 300, "stages": {
+        "slpk": {"count": 2, "wall_time": 3, "nodes": 7, "peak_rss": 300},
+        "draco": {"count": 1, "bytes": 64},
+    }}
+    merged = merge_profiles([main, sublayer])
+    assert merged["total_time"] == 10
+    assert merged["peak_rss"] == 300
+    assert merged["stages"]["slpk"]["count"] == 3
+    assert merged["stages"]["slpk"]["wall_time"] == 5
+    assert merged["stages"]["slpk"]["nodes"] == 12
+    assert merged["stages"]["slpk"]["peak_rss"] == 300
+    assert merged["stages"]["draco"]["bytes"] == 64
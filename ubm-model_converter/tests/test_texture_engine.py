@@ -0,0 +1,67 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("wand")
+
+from src.utils import texture_engine  # noqa: E402
+from src.utils.texture_engine import TextureEngine  # noqa: E402
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = TextureEngine(cache_root=str(tmp_path), max_size=100, max_workers=1)
+    # 等待启动时的统计完成
+    deadline = time.time() + 5
+    while engine.cache_size is None and time.time() < deadline:
+        time.sleep(0.01)
+    yield engine
+    engine.executor.shutdown(wait=True)
+
+
+def key(i: int) -> str:
+    return f"{i:02x}" * 32
+
+
+def test_write_does_not_walk_cache(engine, monkeypatch):
+    walked = []
+    monkeypatch.setattr(texture_engine.os, "walk", lambda *args: walked.append(args) or iter(()))
+    engine.sweep_interval = 3600
+    engine._write_cache(key(1), b"x" * 40)
+    engine._write_cache(key(2), b"x" * 40)
+    assert engine.cache_size == 80
+    assert not engine.sweep_event.is_set()
+    assert walked == []
+
+
+def test_evict_least_recently_used(engine):
+    engine.max_size = 1000
+    for i in range(4):
+        engine._write_cache(key(i), b"x" * 40)
+        os.utime(engine._cache_path(key(i)), (i, i))
+    assert engine._read_cache(key(0)) is not None  # 访问后成为最近使用的
+    engine.max_size = 100
+    engine.evict()
+    remaining = [i for i in range(4) if os.path.exists(engine._cache_path(key(i)))]
+    assert remaining == [0, 3]
+    assert engine.cache_size == 80
+
+
+def test_write_over_max_size_wakes_sweep(engine):
+    for i in range(3):
+        engine._write_cache(key(i), b"x" * 40)
+    deadline = time.time() + 5
+    while engine.cache_size > 100 and time.time() < deadline:
+        time.sleep(0.01)
+    assert engine.cache_size == 80
+    assert sum(os.path.exists(engine._cache_path(key(i))) for i in range(3)) == 2
+
+
+def test_size_counts_other_workers_after_sweep(engine, tmp_path):
+    # 其他 worker 写入的文件在下一次定时统计时计入
+    other = TextureEngine(cache_root=str(tmp_path), max_size=100, max_workers=1)
+    other.executor.shutdown(wait=True)
+    other._write_cache(key(5), b"x" * 30)
+    engine.evict()
+    assert engine.cache_size == 30
@@ -0,0 +1,134 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.upload_pipeline import UploadPipeline
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=8)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def test_blocks_when_tasks_exhausted(executor):
+    pipeline = UploadPipeline(executor, max_bytes=1 << 30, max_tasks=2)
+    gate = threading.Event()
+    for _ in range(2):
+        pipeline.submit(gate.wait, 5)
+
+    submitted = threading.Event()
+    submitter = threading.Thread(target=lambda: (pipeline.submit(lambda: True), submitted.set()))
+    submitter.start()
+    assert not submitted.wait(0.2)
+    assert pipeline.in_flight()["tasks"] == 2
+
+    gate.set()
+    assert submitted.wait(5)
+    submitter.join()
+    pipeline.wait()
+    assert pipeline.in_flight()["tasks"] == 0
+
+
+def test_bytes_in_flight_bounded(executor):
+    pipeline = UploadPipeline(executor, max_bytes=100, max_tasks=100)
+    released = []
+
+    def upload(i: int) -> bool:
+        time.sleep(0.01)
+        return True
+
+    for i in range(20):
+        pipeline.submit(upload, i, nbytes=30, nodes=1, release=lambda i=i: released.append(i))
+    pipeline.wait()
+
+    assert pipeline.in_flight()["peak_bytes"] <= 90
+    assert sorted(released) == list(range(20))
+    assert pipeline.progress()["nodes_uploaded"] == 20
+    assert pipeline.progress()["bytes_uploaded"] == 600
+
+
+def test_oversized_task_allowed_when_empty(executor):
+    pipeline = UploadPipeline(executor, max_bytes=10, max_tasks=1)
+    pipeline.submit(lambda: True, nbytes=50)
+    pipeline.wait()
+    assert pipeline.in_flight()["peak_bytes"] == 50
+
+
+def test_exception_raised_by_wait_and_submit(executor):
+    pipeline = UploadPipeline(executor, max_bytes=1 << 30, max_tasks=4)
+
+    def fail():
+        raise ValueError("manager unavailable")
+
+    pipeline.submit(fail, nodes=1)
+    with pytest.raises(ValueError, match="manager unavailable"):
+        pipeline.wait()
+    with pytest.raises(ValueError):
+        pipeline.submit(lambda: True)
+    assert pipeline.progress()["nodes_uploaded"] == 0
+
+
+def test_false_result_is_failure(executor):
+    pipeline = UploadPipeline(executor, max_bytes=1 << 30, max_tasks=4)
+
+    def upload_node_attributes():
+        return False
+
+    pipeline.submit(upload_node_attributes)
+    with pytest.raises(RuntimeError, match="upload_node_attributes"):
+        pipeline.wait()
+
+
+def test_first_error_kept_and_data_released(executor):
+    pipeline = UploadPipeline(executor, max_bytes=1 << 30, max_tasks=4)
+    released = []
+
+    def fail(message: str):
+        time.sleep(0.05 if message == "second" else 0)
+        raise ValueError(message)
+
+    pipeline.submit(fail, "first", nbytes=10, release=lambda: released.append("first"))
+    pipeline.submit(fail, "second", nbytes=10, release=lambda: released.append("second"))
+    with pytest.raises(ValueError, match="first"):
+        pipeline.wait()
+    assert sorted(released) == ["first", "second"]
+    assert pipeline.in_flight()["bytes"] == 0
+
+
+def test_reporter_reports_progress(executor):
+    pipeline = UploadPipeline(executor, max_bytes=1 << 30, max_tasks=4)
+    reports = []
+    pipeline.start_reporter(reports.append, total_nodes=2, interval=0.01)
+    pipeline.submit(lambda: True, nodes=2)
+    time.sleep(0.05)
+    pipeline.wait()
+    assert reports and '"total_nodes": 2' in reports[-1]
+    assert pipeline.reporter is None
+
+
+def test_skipped_nodes_count_towards_progress(executor):
+    pipeline = UploadPipeline(executor, max_bytes=1 << 30, max_tasks=4)
+    pipeline.total_nodes = 10
+    pipeline.skip(6)
+    pipeline.submit(lambda: True, nodes=2)
+    pipeline.wait()
+    progress = pipeline.progress()
+    assert progress["nodes_uploaded"] == 2
+    assert progress["nodes_skipped"] == 6
+    # 速率只按上传的节点计算，剩余 2 个节点
+    assert progress["eta"] == pytest.approx(2 / progress["nodes_per_second"], abs=0.1)
+
+
+def test_writer_payload_sizes():
+    writer_module = pytest.importorskip("src.writer")
+    from src.utils.attribute_codec import encode_attributes
+
+    attribute = {"value": [[1, 2, 3], ["Wall", None, "基本墙"]], "size_bytes": [[4, 4, 4], [5, 1, 10]]}
+    expected = sum(len(buffer) for buffer in encode_attributes(attribute))
+    assert writer_module.Writer.attribute_size(attribute) == expected
+    assert writer_module.Writer.attribute_size(None) == 0
+    assert writer_module.Writer.json_size({"name": "基本墙"}) == len('{"name": "基本墙"}'.encode())
@@ -0,0 +1,87 @@
+"""
+与 model manager 之间的批量接口(节点属性、增量转换的指纹与节点复用)
+"""
+import json
+from typing import Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from .transport import get_transport, check_response
+
+
+def upload_node_attributes(project_id: int, model_file_id: int, sublayer_idx: int,
+                           attributes: Iterable[Tuple[int, dict]]) -> bool:
+    """
+    以 NDJSON 流的形式一次性上传一个子层所有节点的属性
+    :param attributes: (node_index, attribute) 序列
+    :return: 是否上传成功
+    """
+    attributes = list(attributes)
+
+    def ndjson_lines():
+        for node_index, attribute in attributes:
+            yield json.dumps({"node_index": node_index, "attribute": attribute}, ensure_ascii=False).encode() + b"\n"
+
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_idx}/nodes/attribute",
+            headers={
+                "accept": "application/json",
+                "Content-Type": "application/x-ndjson",
+            },
+            data=ndjson_lines,  # 传入函数，重试时重新生成请求体
+        )
+        return check_response(response, f"model_file_id: {model_file_id}, sublayer: {sublayer_idx}")
+    except Exception as e:
+        logger.error(f"fail to upload node attributes, model_file_id: {model_file_id}, sublayer: {sublayer_idx}, {e}")
+        return False
+
+
+def get_previous_fingerprints(project_id: int, model_file_id: int, sublayer_idx: int) -> Optional[dict]:
+    """
+    获取同一模型上一个转换成功的模型文件中，该子层各节点的指纹
+    :return: {"model_file_id": 上一版本的模型文件 id, "fingerprints": 按节点顺序排列的指纹}，没有上一版本时返回 None
+    """
+    try:
+        response = get_transport().request(
+            "GET",
+            f"project/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_idx}/fingerprints/previous",
+            headers={"accept": "application/json"},
+        )
+        if not check_response(response, f"model_file_id: {model_file_id}, sublayer: {sublayer_idx}"):
+            return None
+        return response.json().get("data")
+    except Exception as e:
+        logger.error(f"fail to get previous fingerprints, model_file_id: {model_file_id}, sublayer: {sublayer_idx}, {e}")
+        return None
+
+
+def save_fingerprints(project_id: int, model_file_id: int, sublayer_idx: int, fingerprints: List[str]) -> bool:
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_idx}/fingerprints",
+            headers={"accept": "application/json"},
+            json={"fingerprints": fingerprints},
+        )
+        return check_response(response, f"model_file_id: {model_file_id}, sublayer: {sublayer_idx}")
+    except Exception as e:
+        logger.error(f"fail to save fingerprints, model_file_id: {model_file_id}, sublayer: {sublayer_idx}, {e}")
+        return False
+
+
+def remap_nodes(project_id: int, model_file_id: int, sublayer_idx: int, source_model_file_id: int,
+                remap: List[Tuple[int, int]]) -> bool:
+    """
+    由 model manager 将上一版本中未变化的节点(geometry、纹理文件及属性记录)链接到当前模型文件
+    :param remap: (当前节点下标, 上一版本节点下标) 序列
+    """
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_idx}/remap",
+            headers={"accept": "application/json"},
+            json={"source_model_file_id": source_model_file_id, "remap": remap},
+        )
+        return check_response(response, f"model_file_id: {model_file_id}, sublayer: {sublayer_idx}")
+    except Exception as e:
+        logger.error(f"fail to remap nodes, model_file_id: {model_file_id}, sublayer: {sublayer_idx}, {e}")
+        return False
@@ -0,0 +1,60 @@
+"""
+转换任务的断点记录
+
+记录已完成的阶段以及 model manager 已确认的上传(geometry、纹理、属性等)，
+任务重试时跳过这些工作。记录以 json 文件保存，写入时先写临时文件再原子替换。
+"""
+import json
+import os
+import threading
+import time
+from typing import Set
+
+from loguru import logger
+
+
+class Checkpoint:
+    def __init__(self, path: str, save_interval: float = 5):
+        """
+        :param path: 断点文件路径
+        :param save_interval: 两次落盘之间的最短间隔，单位秒
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.done: Set[str] = set()
+        self.last_save = 0
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.done = set(json.load(f).get("done", []))
+            logger.info(f"resume from checkpoint `{path}`, {len(self.done)} items done.")
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.done)
+
+    def is_done(self, key: str) -> bool:
+        with self.lock:
+            return key in self.done
+
+    def mark(self, key: str):
+        with self.lock:
+            self.done.add(key)
+            if time.time() - self.last_save < self.save_interval:
+                return
+        self.save()
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"done": sorted(self.done)})
+            self.last_save = time.time()
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self.lock:
+            self.done.clear()
+            if os.path.isfile(self.path):
+                os.remove(self.path)
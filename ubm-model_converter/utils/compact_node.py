@@ -0,0 +1,225 @@
+"""
+紧凑的合并节点表示
+
+MergedNode 中的顶点流与属性以大量小 bytes 对象组成的 list 保存，对象本身的开销远大于数据。
+CompactMergedNode 将一个节点的全部顶点流拼接到同一块 bytes 中，只额外保存一个偏移数组，
+通过 `__slots__` 去掉实例字典。
+
+原有的顶点流属性名(`polymesh_position_bytes` 等)以只读视图的形式保留：视图可以迭代、按下标访问，
+得到的是 memoryview 切片，不复制数据；`buffer` 属性返回整段连续数据，geometry 组装时直接整段拷贝。
+顶点流只会被整段使用，不保留原有的分块边界，视图中只有一块。
+
+属性只保留 `attribute` 字典：写出(`utils/attribute_codec.py`)、上传与指纹都直接使用它，
+MergedNode 中逐个值预先编码的属性 bytes 不再复制。
+
+    slpk = SLPK(ubm)
+    compact_slpk(slpk)  # 原地替换所有子层的 merged_nodes
+
+在 SLPK 构建完成后再压缩时，所有 MergedNode 会同时存在，峰值内存不变。`compacting_nodes` 在构建期间
+将 Sublayer 的 `merged_nodes` 换成 `CompactingList`，节点在放入列表时即被压缩，原有的 MergedNode 随之释放：
+
+    with compacting_nodes(Sublayer):
+        slpk = SLPK(ubm)
+    compact_slpk(slpk)  # 整体赋值等未经过 CompactingList 的节点
+"""
+from array import array
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Sequence
+
+# 节点中保存的顶点流，顺序即在数据块中的排列顺序
+GEOMETRY_STREAMS = (
+    "polymesh_header_data",
+    "polymesh_position_bytes",
+    "polymesh_normal_bytes",
+    "polymesh_uv_bytes",
+    "polymesh_color_bytes",
+    "polymesh_uvregion_bytes",
+    "feature_id_bytes",
+    "face_range_bytes",
+)
+
+
+def _chunks(stream) -> Iterable:
+    """
+    顶点流可以是单个 bytes，也可以是 bytes 的序列
+    """
+    if stream is None:
+        return ()
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        return (stream,)
+    return stream
+
+
+class ChunkView(Sequence):
+    """
+    数据块中一段连续数据的只读视图，按原有的分块边界迭代
+    """
+    __slots__ = ("data", "bounds", "start", "end")
+
+    def __init__(self, data: bytes, bounds: array, start: int, end: int):
+        """
+        :param bounds: 各分块在数据块中的边界
+        :param start: 第一个分块边界的下标
+        :param end: 最后一个分块结束边界的下标
+        """
+        self.data = data
+        self.bounds = bounds
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return memoryview(self.data)[self.bounds[self.start + i]: self.bounds[self.start + i + 1]]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        view = memoryview(self.data)
+        for i in range(self.start, self.end):
+            yield view[self.bounds[i]: self.bounds[i + 1]]
+
+    @property
+    def buffer(self) -> memoryview:
+        """
+        整段连续数据
+        """
+        return memoryview(self.data)[self.bounds[self.start]: self.bounds[self.end]]
+
+    @property
+    def nbytes(self) -> int:
+        return self.bounds[self.end] - self.bounds[self.start]
+
+
+class CompactMergedNode:
+    __slots__ = ("data", "bounds", "streams", "has_texture", "diffuse_map", "attribute")
+
+    def __init__(self, node):
+        """
+        :param node: 原有的 MergedNode
+        """
+        data = bytearray()
+        bounds = array("I", [0])
+
+        def append(stream) -> int:
+            """
+            整段写入，只记录一个边界
+            :return: 写入后最后一个边界的下标
+            """
+            for chunk in _chunks(stream):
+                data.extend(chunk)
+            if len(data) != bounds[-1]:
+                bounds.append(len(data))
+            return len(bounds) - 1
+
+        # streams[i] 为第 i 个顶点流的起止边界下标
+        streams = array("I", [0])
+        for name in GEOMETRY_STREAMS:
+            streams.append(append(getattr(node, name, None)))
+
+        self.data = bytes(data)
+        self.bounds = bounds
+        self.streams = streams
+        self.has_texture = node.has_texture
+        self.diffuse_map = node.diffuse_map
+        self.attribute = node.attribute
+
+    def stream(self, name: str) -> ChunkView:
+        i = GEOMETRY_STREAMS.index(name)
+        return ChunkView(self.data, self.bounds, self.streams[i], self.streams[i + 1])
+
+    def __getattr__(self, name: str):
+        # 兼容原有的顶点流属性名
+        if name in GEOMETRY_STREAMS:
+            return self.stream(name)
+        raise AttributeError(name)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.bounds.itemsize * len(self.bounds)
+
+
+def compact(node):
+    """
+    :return: 节点的紧凑表示，None 与已压缩的节点原样返回
+    """
+    if node is None or isinstance(node, CompactMergedNode):
+        return node
+    return CompactMergedNode(node)
+
+
+class CompactingList(list):
+    """
+    放入时即压缩节点的列表
+    """
+
+    def __init__(self, nodes: Iterable = ()):
+        super().__init__(map(compact, nodes))
+
+    def append(self, node):
+        super().append(compact(node))
+
+    def extend(self, nodes: Iterable):
+        super().extend(map(compact, nodes))
+
+    def insert(self, index: int, node):
+        super().insert(index, compact(node))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = map(compact, value)
+        else:
+            value = compact(value)
+        super().__setitem__(index, value)
+
+    def __iadd__(self, nodes: Iterable):
+        self.extend(nodes)
+        return self
+
+    def __reduce_ex__(self, protocol):
+        # 反序列化后为普通 list，加载解析结果时不依赖本类
+        return list, (list(self),)
+
+
+@contextmanager
+def compacting_nodes(sublayer_class):
+    """
+    在 with 块内，赋给 sublayer_class 实例 `merged_nodes` 的列表都替换为 CompactingList
+    """
+    def get_nodes(sublayer):
+        try:
+            return sublayer.__dict__["merged_nodes"]
+        except KeyError:
+            raise AttributeError("merged_nodes") from None
+
+    def set_nodes(sublayer, nodes):
+        sublayer.__dict__["merged_nodes"] = CompactingList(nodes)
+
+    original = sublayer_class.__dict__.get("merged_nodes")
+    sublayer_class.merged_nodes = property(get_nodes, set_nodes)
+    try:
+        yield
+    finally:
+        if original is None:
+            del sublayer_class.merged_nodes
+        else:
+            sublayer_class.merged_nodes = original
+
+
+def compact_sublayer(sublayer):
+    """
+    将子层的 merged_nodes 原地替换为紧凑表示
+    """
+    for index, node in enumerate(sublayer.merged_nodes):
+        if node is not None and not isinstance(node, CompactMergedNode):
+            sublayer.merged_nodes[index] = compact(node)
+
+
+def compact_slpk(slpk):
+    for sublayer in slpk.sublayers:
+        compact_sublayer(sublayer)
@@ -0,0 +1,208 @@
+"""
+Draco 批量压缩引擎
+
+merged node 的 geometry 缓冲区直接以 bytes 形式交给引擎，按批分发到与 CPU 核数一致的进程池中压缩，
+压缩结果以 bytes 返回，输出目录中不再落地 0.bin/1.bin 中间文件。
+
+编码在工作进程内通过 DracoPy 完成，不再为每个节点启动一次 draco_encoder、也不写临时文件：
+按 layout 解析 0.bin 中的各顶点流，非索引三角形直接作为面，构件的 face range 展开为逐顶点的
+`feature-index` 属性，`uv-region` 作为通用属性写入。DracoPy 编码时持有 GIL，因此使用进程池。
+
+未安装 DracoPy 时退化为逐个节点调用 thirdparty 中的 draco_encoder(`--t`、`--use-deck` 只对它有效)，
+也可以通过 `backend: encoder` 显式使用，两者的输出不是逐字节相同的。
+
+相关配置(`config["draco"]`)：
+
+- `backend`: `dracopy` 或 `encoder`，默认安装了 DracoPy 时为 `dracopy`
+- `worker`: 并发数，默认为 CPU 核数
+- `batch_size`: 每批的节点数，默认 16
+- `quantization_bits`、`uv_quantization_bits`、`normal_quantization_bits`: 量化位数，默认 14、12、10
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from ..config import config
+
+try:
+    import DracoPy
+except ImportError:
+    DracoPy = None
+
+if getattr(sys, "frozen", False):
+    work_path = os.path.dirname(sys.executable)
+else:
+    work_path = os.path.dirname(os.path.dirname(__file__))
+
+draco_encoder = os.path.join(work_path, "../thirdparty/draco_encoder.exe")
+
+# 0.bin 中各顶点流的格式：(dtype, 分量数, 是否逐顶点)，逐构件的流按构件数计
+GEOMETRY_FORMATS = {
+    "polymesh_position_bytes": ("<f4", 3, True),
+    "polymesh_normal_bytes": ("<f4", 3, True),
+    "polymesh_uv_bytes": ("<f4", 2, True),
+    "polymesh_color_bytes": ("u1", 4, True),
+    "polymesh_uvregion_bytes": ("<u2", 4, True),
+    "feature_id_bytes": ("<u8", 1, False),
+    "face_range_bytes": ("<u4", 2, False),
+}
+# 0.bin 头部：顶点数、构件数
+HEADER_FORMAT = np.dtype("<u4")
+HEADER_SIZE = 2 * HEADER_FORMAT.itemsize
+
+# 每个工作进程独立的临时目录，进程内复用，仅在使用 draco_encoder 时使用
+_scratch_dir = None
+
+
+def parse_geometry(buffer: bytes, layout: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    按 layout 解析 0.bin，返回的数组引用 buffer 的内存，不复制
+    :return: {顶点流名: (数量, 分量数) 的数组}
+    """
+    vertex_count, feature_count = np.frombuffer(buffer, HEADER_FORMAT, 2)
+    offset = HEADER_SIZE
+    streams = {}
+    for name in layout:
+        dtype, components, per_vertex = GEOMETRY_FORMATS[name]
+        count = int(vertex_count if per_vertex else feature_count) * components
+        array = np.frombuffer(buffer, dtype, count, offset)
+        streams[name] = array.reshape(-1, components)
+        offset += array.nbytes
+    if offset != len(buffer):
+        raise ValueError(f"geometry size mismatch, expect {offset} bytes, got {len(buffer)}")
+    return streams
+
+
+def feature_index(face_ranges: np.ndarray, vertex_count: int) -> np.ndarray:
+    """
+    将各构件的 face range(首、尾三角形下标，含尾)展开为逐顶点的构件下标
+    """
+    index = np.zeros((vertex_count, 1), dtype=np.uint32)
+    for feature, (first, last) in enumerate(face_ranges):
+        index[first * 3: (last + 1) * 3] = feature
+    return index
+
+
+def _encode_dracopy(buffer: bytes, layout: Sequence[str]) -> Optional[bytes]:
+    draco_config = config.get("draco", {})
+    try:
+        streams = parse_geometry(buffer, layout)
+        positions = streams["polymesh_position_bytes"]
+        if len(positions) == 0 or len(positions) % 3:
+            return None
+        generic_attributes = {}
+        if "face_range_bytes" in streams:
+            generic_attributes["feature-index"] = feature_index(streams["face_range_bytes"], len(positions))
+        if "polymesh_uvregion_bytes" in streams:
+            generic_attributes["uv-region"] = streams["polymesh_uvregion_bytes"]
+        normals = streams.get("polymesh_normal_bytes")
+        uvs = streams.get("polymesh_uv_bytes")
+        return DracoPy.encode(
+            positions,
+            np.arange(len(positions), dtype=np.uint32).reshape(-1, 3),
+            quantization_bits=draco_config.get("quantization_bits", 14),
+            normals=None if normals is None else normals.astype(np.float64),
+            normal_quantization_bits=draco_config.get("normal_quantization_bits", 10),
+            tex_coord=None if uvs is None else uvs.astype(np.float64),
+            tex_coord_quantization_bits=draco_config.get("uv_quantization_bits", 12),
+            colors=streams.get("polymesh_color_bytes"),
+            generic_attributes=generic_attributes or None,
+        )
+    except Exception as e:
+        logger.warning(f"draco encode failed: {e}")
+        return None
+
+
+def _encode_one(buffer: bytes, t: int, use_deck: bool) -> Optional[bytes]:
+    global _scratch_dir
+    if _scratch_dir is None:
+        _scratch_dir = tempfile.mkdtemp(prefix="draco_")
+    fd, input_path = tempfile.mkstemp(suffix=".bin", dir=_scratch_dir)
+    output_path = f"{input_path}.drc"
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(buffer)
+        cmd = [draco_encoder, "-i", input_path, "-o", output_path, "--t", f"{t}"]
+        if use_deck:
+            cmd.append("--use-deck")
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if "Failed" in res.stdout or not os.path.isfile(output_path):
+            return None
+        with open(output_path, "rb") as fp:
+            return fp.read()
+    finally:
+        for path in (input_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _encode_batch(buffers: List[bytes], layout: Sequence[str], t: int, use_deck: bool,
+                  backend: str) -> List[Optional[bytes]]:
+    if backend == "dracopy":
+        return [_encode_dracopy(buffer, layout) for buffer in buffers]
+    return [_encode_one(buffer, t, use_deck) for buffer in buffers]
+
+
+class DracoEngine:
+    def __init__(self, max_workers: int = None, batch_size: int = None, backend: str = None):
+        draco_config = config.get("draco", {})
+        self.max_workers = max_workers or draco_config.get("worker") or os.cpu_count() or 1
+        self.batch_size = batch_size or draco_config.get("batch_size", 16)
+        self.backend = backend or draco_config.get("backend") or ("dracopy" if DracoPy is not None else "encoder")
+        if self.backend == "dracopy" and DracoPy is None:
+            raise ImportError("draco backend `dracopy` requires DracoPy, `pip install DracoPy`")
+        if self.backend == "encoder":
+            logger.warning("encode draco with draco_encoder executable, one process per node.")
+        if multiprocessing.current_process().daemon:
+            # celery prefork 的 worker 为守护进程，不能再创建子进程，退化为线程池
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    @property
+    def chunk_size(self) -> int:
+        """
+        一次提交给引擎的 node 数量，刚好让所有 worker 都分到一批
+        """
+        return self.max_workers * self.batch_size
+
+    def encode_many(self, buffers: Sequence[bytes], layout: Sequence[str], t: int,
+                    use_deck: bool = False) -> List[Optional[bytes]]:
+        """
+        批量压缩 geometry 缓冲区
+        :param buffers: 未压缩的 geometry(0.bin) 数据
+        :param layout: 0.bin 中顶点流的排列
+        :param t: draco_encoder 的 `--t` 参数
+        :param use_deck: 是否添加 `--use-deck` 参数
+        :return: 与 buffers 一一对应的压缩结果，压缩失败的位置为 None
+        """
+        batches = [list(buffers[i: i + self.batch_size]) for i in range(0, len(buffers), self.batch_size)]
+        res = []
+        encode = partial(_encode_batch, layout=tuple(layout), t=t, use_deck=use_deck, backend=self.backend)
+        for batch_res in self.executor.map(encode, batches):
+            res.extend(batch_res)
+        return res
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_engine = None
+
+
+def get_draco_engine() -> DracoEngine:
+    """
+    进程内共享同一个引擎，避免每个转换任务重复创建进程池
+    """
+    global _engine
+    if _engine is None:
+        _engine = DracoEngine()
+    return _engine
@@ -0,0 +1,27 @@
+"""
+节点内容指纹
+
+由 geometry(未压缩的 0.bin)、纹理源图片内容及属性计算，指纹相同的节点在两个版本之间内容一致，
+增量转换时可以直接复用上一版本的数据。
+"""
+import hashlib
+import json
+from typing import Iterable, Optional
+
+from . import geometry_buffer
+
+
+def node_fingerprint(node, layout: Iterable[str], texture_key: Optional[str]) -> str:
+    """
+    :param node: 合并节点
+    :param layout: geometry 顶点流的排列
+    :param texture_key: 纹理源图片内容的 sha256，没有纹理时为 None
+    :return: 十六进制的 sha256
+    """
+    h = hashlib.sha256()
+    h.update(geometry_buffer.assemble(node.polymesh_header_data, (getattr(node, name) for name in layout)))
+    h.update(b"\0texture:")
+    h.update((texture_key or "").encode())
+    h.update(b"\0attribute:")
+    h.update(json.dumps(node.attribute, sort_keys=True, ensure_ascii=False).encode())
+    return h.hexdigest()
@@ -0,0 +1,51 @@
+"""
+geometry 0.bin 的内存组装
+
+每个顶点流既可以是连续的缓冲区(bytes/bytearray/memoryview/numpy 数组等支持 buffer protocol 的对象)，
+也可以是由小块 bytes 组成的序列；先计算总长度预分配一块 bytearray，再通过 memoryview 依次拷贝，
+不产生中间 bytes 对象和临时文件。
+"""
+from typing import Iterable, List, Sequence
+
+
+def stream_chunks(stream) -> Sequence:
+    """
+    将顶点流统一为若干个按字节寻址的块
+    """
+    if stream is None:
+        return ()
+    buffer = getattr(stream, "buffer", None)  # 紧凑节点的视图提供整段连续数据
+    if buffer is not None:
+        return (memoryview(buffer).cast("B"),)
+    try:
+        return (memoryview(stream).cast("B"),)
+    except TypeError:  # 非连续缓冲区，视为 bytes 块的序列
+        return stream
+
+
+def _byte_view(chunk):
+    if isinstance(chunk, (bytes, bytearray)):
+        return chunk
+    return memoryview(chunk).cast("B")
+
+
+def assemble(header, streams: Iterable) -> bytearray:
+    """
+    按顺序拼接 header 与各顶点流
+    :param header: geometry 头数据
+    :param streams: 按 I3S geometry 布局排列的顶点流
+    :return: 组装好的 geometry 缓冲区
+    """
+    parts: List[Sequence] = [stream_chunks(header)]
+    parts.extend(stream_chunks(stream) for stream in streams)
+    size = sum(len(_byte_view(chunk)) for chunks in parts for chunk in chunks)
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    offset = 0
+    for chunks in parts:
+        for chunk in chunks:
+            chunk = _byte_view(chunk)
+            view[offset: offset + len(chunk)] = chunk
+            offset += len(chunk)
+    view.release()
+    return buffer
@@ -0,0 +1,171 @@
+"""
+转换各阶段的性能统计
+
+按阶段(reader, parser, slpk, texture, draco, upload, finalise 等)累计墙钟时间、CPU 时间、字节数、节点数，
+并记录阶段结束时进程的峰值内存(RSS)。同一阶段可以在多个线程中并发进入，此时墙钟时间为各线程耗时之和，
+CPU 时间为进入阶段的线程自身的 CPU 时间(不含进程池中子进程的耗时)。
+
+开启 `config["profile"]["callgrind"]` 后，额外使用 yappi 记录整个转换过程并输出 callgrind 文件。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """
+    :return: 进程峰值内存，单位 bytes，不支持的平台返回 None
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # linux 单位为 KB
+
+
+class StageStats:
+    __slots__ = ("count", "wall", "cpu", "bytes", "nodes", "peak_rss")
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes = 0
+        self.nodes = 0
+        self.peak_rss = None
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "wall_time": round(self.wall, 3),
+            "cpu_time": round(self.cpu, 3),
+            "bytes": self.bytes,
+            "nodes": self.nodes,
+            "peak_rss": self.peak_rss,
+        }
+
+
+class StageCounter:
+    """
+    阶段内累计字节数与节点数
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.nodes = 0
+
+    def add(self, nbytes: int = 0, nodes: int = 0):
+        self.bytes += nbytes
+        self.nodes += nodes
+
+
+class Profiler:
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.yappi = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        统计一个阶段，`with profiler.stage("draco") as s: ...; s.add(nbytes, nodes)`
+        """
+        counter = StageCounter()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield counter
+        finally:
+            self.record(name, time.perf_counter() - wall, time.thread_time() - cpu, counter.bytes, counter.nodes)
+
+    def record(self, name: str, wall: float = 0, cpu: float = 0, nbytes: int = 0, nodes: int = 0, count: int = 1):
+        """
+        :param count: 计入的阶段次数，只补充字节数、节点数时传入 0
+        """
+        rss = peak_rss()
+        with self.lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.count += count
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.bytes += nbytes
+            stats.nodes += nodes
+            if rss is not None:
+                stats.peak_rss = max(stats.peak_rss or 0, rss)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            stages = {name: stats.to_dict() for name, stats in self.stages.items()}
+        return {
+            "total_time": round(time.perf_counter() - self.start_time, 3),
+            "peak_rss": peak_rss(),
+            "stages": stages,
+        }
+
+    def log(self):
+        for name, stats in self.to_dict()["stages"].items():
+            logger.info(
+                f"stage {name}: wall={stats['wall_time']}s, cpu={stats['cpu_time']}s, bytes={stats['bytes']}, "
+                f"nodes={stats['nodes']}, peak_rss={stats['peak_rss']}"
+            )
+
+    def export(self, path: str):
+        """
+        导出 json 格式的 profile
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"profile exported to `{path}`")
+
+    def start_callgrind(self):
+        """
+        开始记录调用信息，需要安装 yappi
+        """
+        try:
+            import yappi
+        except ImportError:
+            logger.warning("yappi not installed, callgrind profile disabled.")
+            return
+        yappi.clear_stats()
+        yappi.set_clock_type("cpu")
+        yappi.start(builtins=True)
+        self.yappi = yappi
+
+    def stop_callgrind(self, path: str):
+        if self.yappi is None:
+            return
+        self.yappi.stop()
+        self.yappi.get_func_stats().save(path, type="callgrind")
+        self.yappi.clear_stats()
+        self.yappi = None
+        logger.info(f"callgrind profile saved to `{path}`")
+
+
+def merge_profiles(profiles: List[dict]) -> dict:
+    """
+    合并多个 profile(分布式转换中主任务与各子层任务)，同名阶段的统计值相加，峰值内存取最大值
+    """
+    merged = {"total_time": 0, "peak_rss": None, "stages": {}}
+    for profile in profiles:
+        merged["total_time"] = max(merged["total_time"], profile.get("total_time", 0))
+        merged["peak_rss"] = max(merged["peak_rss"] or 0, profile.get("peak_rss") or 0) or None
+        for name, stats in profile.get("stages", {}).items():
+            target = merged["stages"].setdefault(name, StageStats().to_dict())
+            for key in ("count", "wall_time", "cpu_time", "bytes", "nodes"):
+                target[key] += stats.get(key, 0)
+            target["peak_rss"] = max(target["peak_rss"] or 0, stats.get("peak_rss") or 0) or None
+    return merged
@@ -0,0 +1,154 @@
+"""
+与 model manager 共享存储时的二进制传输
+
+converter 与 model manager 挂载同一文件系统时(`config["model_manager"]["shared_storage"]`)，
+二进制数据不再经过 multipart 上传：
+
+- geometry 按 sha256 直接写入 model manager 的 blob 存储，已存在的 blob 不再写入
+- 纹理写入暂存区 `<root>/staging/<name>/files/<path>`
+- 每次写入在暂存区的 `manifest.jsonl` 中追加一条记录，断点续传时之前写入的数据同样会被提交
+- 全部写完后调用一次提交接口，由 model manager 原子地移动到模型目录
+
+所有文件先写临时文件再 `os.replace`，不会留下写了一半的文件。写入失败时调用方退回 HTTP 上传。
+
+目录布局需与 model manager 的 `utils/staging.py`、`utils/blob_store.py` 保持一致。
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional
+
+from loguru import logger
+
+from ..config import config
+from .transport import get_transport, check_response
+
+STAGING_DIR = "staging"
+BLOB_DIR = "blobs"
+MANIFEST = "manifest.jsonl"
+
+
+class SharedStorage:
+    def __init__(self, root: str, project_id: int, model_file_id: int, name: str, resume: bool = False):
+        """
+        :param root: model manager 的 slpk_root 在本机的挂载路径
+        :param name: 暂存区名称，同一模型文件的并发任务(如分布式转换的各子层)需使用不同的名称
+        :param resume: 是否保留之前写入的暂存数据
+        """
+        self.root = root
+        self.project_id = project_id
+        self.model_file_id = model_file_id
+        self.name = f"{model_file_id}_{name}"
+        self.staging_dir = os.path.join(root, STAGING_DIR, self.name)
+        self.files_root = os.path.join(self.staging_dir, "files")
+        self.manifest_path = os.path.join(self.staging_dir, MANIFEST)
+        self.lock = threading.Lock()
+        if not resume and os.path.exists(self.staging_dir):
+            shutil.rmtree(self.staging_dir)
+        os.makedirs(self.files_root, exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, BLOB_DIR, sha256[:2], sha256)
+
+    def put(self, path: str, data: bytes, sha256: str = None) -> bool:
+        """
+        写入二进制数据，geometry 传入 sha256 时写入 blob 存储，否则写入暂存区
+        :param path: 相对 slpk 根目录的路径，如 `sublayers/0/nodes/1/geometries/1.bin`
+        :return: 是否写入成功，失败时调用方应退回 HTTP 上传
+        """
+        path = path.replace("\\", "/")
+        try:
+            if sha256:
+                target = self.blob_path(sha256)
+                if not os.path.isfile(target):
+                    self.write(target, data)
+            else:
+                self.write(os.path.join(self.files_root, path), data)
+            self.append({"path": path, "sha256": sha256})
+            return True
+        except OSError as e:
+            logger.warning(f"fail to write shared storage, path: {path}, {e}")
+            return False
+
+    @staticmethod
+    def write(target: str, data: bytes):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def append(self, entry: dict):
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def entries(self) -> List[dict]:
+        """
+        :return: 清单中的记录，同一路径只保留最后一条；中断时可能残留的不完整行被忽略
+        """
+        entries = {}
+        if not os.path.isfile(self.manifest_path):
+            return []
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["path"]] = entry
+        return list(entries.values())
+
+    def commit(self) -> bool:
+        """
+        提交暂存区，一次请求传入完整清单
+        :return: 是否全部提交成功
+        """
+        entries = self.entries()
+        if not entries:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            return True
+        try:
+            response = get_transport().post(
+                f"project/{self.project_id}/model-file/{self.model_file_id}/staging/{self.name}/commit",
+                headers={"accept": "application/json"},
+                json={"entries": entries},
+            )
+            if not check_response(response, f"model_file_id: {self.model_file_id}, commit {len(entries)} files"):
+                return False
+            missing = response.json().get("missing")
+            if missing:
+                logger.error(f"fail to commit staging `{self.name}`, missing: {missing[:10]}")
+                return False
+            logger.info(f"staging `{self.name}` committed, {len(entries)} files.")
+            return True
+        except Exception as e:
+            logger.error(f"fail to commit staging `{self.name}`, {e}")
+            return False
+
+
+def open_shared_storage(project_id: int, model_file_id: int, name: str, resume: bool = False) \
+        -> Optional[SharedStorage]:
+    """
+    :return: 未开启共享存储或挂载路径不可用时返回 None，使用 HTTP 上传
+    """
+    storage_config = config["model_manager"].get("shared_storage", {})
+    if not storage_config.get("enable", False):
+        return None
+    root = storage_config.get("root")
+    if not root or not os.path.isdir(root) or not os.access(root, os.W_OK):
+        logger.warning(f"shared storage `{root}` not available, fallback to http upload.")
+        return None
+    try:
+        return SharedStorage(root, project_id, model_file_id, name, resume)
+    except OSError as e:
+        logger.warning(f"fail to create staging dir in `{root}`, fallback to http upload: {e}")
+        return None
@@ -0,0 +1,144 @@
+"""
+流式 SLPK 输出
+
+json 文档与二进制数据在生成时直接交给 sink：在进程池中 gzip 压缩后按提交顺序写出，
+不再先写出目录树、原地压缩、再重新读取打包。
+
+- `SlpkArchive` 直接追加到 .slpk(zip) 文件中，gzip 过的条目以 `.gz` 结尾并以 STORED 方式存储，
+  未压缩的条目使用 DEFLATED
+- `SlpkDirectory` 写出与原先相同的 `.gz` 目录树，供服务端模式使用
+
+在途的压缩任务数有上限，超过时提交方等待最早的任务写出，内存占用与模型大小无关。
+"""
+import abc
+import gzip
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Tuple
+
+from loguru import logger
+
+# zip 条目使用固定时间，相同输入得到相同的 slpk
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+class SlpkSink(abc.ABC):
+    def __init__(self, max_workers: int = None, max_pending: int = None):
+        max_workers = max_workers or os.cpu_count() or 1
+        if multiprocessing.current_process().daemon:
+            logger.warning("running in daemon process, slpk sink fallback to thread pool.")
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_pending or max_workers * 4
+        self.pending: Deque[Tuple[str, bool, Future]] = deque()
+        self.lock = threading.Lock()
+        self.entries = 0
+        self.bytes_written = 0
+
+    def add_json(self, path: str, data, compress: bool = True):
+        """
+        :param path: 相对 slpk 根目录的路径，如 `sublayers/0/3dSceneLayer.json`
+        """
+        self.add_bytes(path, json.dumps(data, ensure_ascii=False).encode("utf-8"), compress)
+
+    def add_bytes(self, path: str, data: bytes, compress: bool = True):
+        """
+        :param compress: 是否 gzip 压缩，压缩后的条目名追加 `.gz`
+        """
+        path = path.replace("\\", "/").lstrip("/")
+        with self.lock:
+            while len(self.pending) >= self.max_pending:
+                self._write_oldest()
+            if compress:
+                future = self.executor.submit(_gzip, bytes(data))
+            else:
+                future = Future()
+                future.set_result(data)
+            self.pending.append((path, compress, future))
+
+    def _write_oldest(self):
+        path, compressed, future = self.pending.popleft()
+        data = future.result()
+        self._write(f"{path}.gz" if compressed else path, data, compressed)
+        self.entries += 1
+        self.bytes_written += len(data)
+
+    @abc.abstractmethod
+    def _write(self, path: str, data: bytes, compressed: bool):
+        """
+        按提交顺序写出一个条目
+        :param path: 条目名，gzip 过的条目已追加 `.gz`
+        """
+
+    def close(self):
+        """
+        写出所有在途的条目并释放资源
+        """
+        with self.lock:
+            while self.pending:
+                self._write_oldest()
+        self.executor.shutdown(wait=True)
+        logger.info(f"slpk sink closed, {self.entries} entries, {self.bytes_written} bytes.")
+
+    def abort(self):
+        """
+        放弃在途的条目，用于输出失败时
+        """
+        with self.lock:
+            self.pending.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SlpkArchive(SlpkSink):
+    def __init__(self, slpk_path: str, max_workers: int = None, max_pending: int = None):
+        super().__init__(max_workers, max_pending)
+        self.slpk_path = slpk_path
+        self.tmp_path = f"{slpk_path}.tmp"
+        self.zip = zipfile.ZipFile(self.tmp_path, "w", allowZip64=True)
+
+    def _write(self, path: str, data: bytes, compressed: bool):
+        info = zipfile.ZipInfo(path, date_time=ZIP_DATE_TIME)
+        # gzip 过的数据不再压缩，客户端可以直接按偏移读取
+        info.compress_type = zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED
+        self.zip.writestr(info, data)
+
+    def close(self):
+        super().close()
+        self.zip.close()
+        os.replace(self.tmp_path, self.slpk_path)
+
+    def abort(self):
+        super().abort()
+        self.zip.close()
+        os.remove(self.tmp_path)
+
+
+class SlpkDirectory(SlpkSink):
+    def __init__(self, root: str, max_workers: int = None, max_pending: int = None):
+        super().__init__(max_workers, max_pending)
+        self.root = root
+
+    def _write(self, path: str, data: bytes, compressed: bool):
+        file_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as fp:
+            fp.write(data)
@@ -0,0 +1,227 @@
+"""
+纹理转码引擎
+
+纹理按源图片内容的 sha256 寻址，转码(dds/dxt3)在进程池中执行，结果写入本机共享的磁盘 LRU 缓存，
+同一台机器上的所有 celery worker 共用一份缓存；重复转换或共用材质库的模型不再重复转码。
+
+写入缓存时只累加本进程估算的缓存大小，遍历目录淘汰由后台线程完成：估算值超过 `max_size` 时立即触发，
+另外每隔 `sweep_interval` 秒执行一次，以计入其他 worker 的写入。
+"""
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from wand import image
+
+from ..config import config
+
+
+def _transcode(data: bytes) -> bytes:
+    with image.Image(blob=data) as img:  # 转换为dds
+        img_size = img.size
+        logger.debug(f"origin size: {img_size}")
+        if img_size[0] != img_size[1]:
+            new_size = min(img_size)
+            img.transform(f"{new_size}x{new_size}", "100%")
+            for i in range(1, 20):
+                if (1 << i) < new_size < (1 << (i + 1)):  # TODO: here maybe cause some problems.
+                    new_size = 1 << i if abs((1 << i) - new_size) < abs(
+                        (1 << (i + 1)) - new_size) else 1 << (i + 1)
+                    logger.debug(f"new size: {new_size}")
+                    break
+            img.resize(new_size, new_size)
+        img.compression = "dxt3"
+        return img.make_blob(format='dds')
+
+
+class TextureEngine:
+    def __init__(self, cache_root: str = None, max_size: int = None, max_workers: int = None):
+        cache_config = config.get("texture_cache", {})
+        self.cache_root = cache_root or cache_config.get(
+            "root", os.path.join(tempfile.gettempdir(), "ubm_texture_cache")
+        )
+        self.max_size = max_size or cache_config.get("max_size", 2 << 30)  # 单位 bytes
+        max_workers = max_workers or cache_config.get("worker") or os.cpu_count() or 1
+        os.makedirs(self.cache_root, exist_ok=True)
+        if multiprocessing.current_process().daemon:
+            logger.warning("running in daemon process, texture engine fallback to thread pool.")
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        # (path, mtime, size) -> 内容hash，避免同一张图片重复读取计算；按 LRU 保留最近的条目
+        self.path_keys: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self.max_path_keys = cache_config.get("max_path_keys", 100000)
+        # 最近一次淘汰后的缓存大小加上本进程此后写入的大小，None 表示尚未统计
+        self.cache_size: Optional[int] = None
+        self.sweep_interval = cache_config.get("sweep_interval", 300)  # 单位秒
+        self.sweep_event = threading.Event()
+        self.sweep_event.set()  # 启动时统计一次缓存大小
+        threading.Thread(target=self._sweep, name="texture-cache-sweep", daemon=True).start()
+
+    def get(self, path: str) -> Optional[bytes]:
+        """
+        获取源图片对应的 dds 数据，源图片不存在时返回 None
+        """
+        if not os.path.isfile(path):
+            logger.warning("图片不存在")
+            return None
+        key, data = self._source_key(path)
+        if key is None:
+            return None
+
+        blob = self._read_cache(key)
+        if blob is not None:
+            logger.debug(f"use cache：{path}")
+            return blob
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                logger.debug(f"图片纹理原路径：{path}")
+                if data is None:  # 内容hash来自 path_keys，源图片尚未读取
+                    with open(path, "rb") as fp:
+                        data = fp.read()
+                future = self.executor.submit(_transcode, data)
+                self.in_flight[key] = future
+        try:
+            blob = future.result()
+        finally:
+            if owner:
+                with self.lock:
+                    self.in_flight.pop(key, None)
+        if owner:
+            self._write_cache(key, blob)
+        return blob
+
+    def content_key(self, path: str) -> Optional[str]:
+        """
+        源图片内容的 sha256，图片不存在时返回 None
+        """
+        return self._source_key(path)[0]
+
+    def size_hint(self, path: str) -> int:
+        """
+        上传前估算纹理占用的内存：已转码且命中缓存时为 dds 的大小，否则为源图片的大小；不读取图片
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 0
+        with self.lock:
+            key = self.path_keys.get((path, stat.st_mtime_ns, stat.st_size))
+        if key is not None:
+            try:
+                return os.stat(self._cache_path(key)).st_size
+            except OSError:
+                pass
+        return stat.st_size
+
+    def _source_key(self, path: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        :return: (内容hash, 源图片内容)，内容hash命中 path_keys 时不读取图片，内容为 None；图片不存在时均为 None
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, None
+        path_key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            key = self.path_keys.get(path_key)
+            if key is not None:
+                self.path_keys.move_to_end(path_key)
+                return key, None
+        with open(path, "rb") as fp:
+            data = fp.read()
+        key = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.path_keys[path_key] = key
+            while len(self.path_keys) > self.max_path_keys:
+                self.path_keys.popitem(last=False)
+        return key, data
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_root, key[:2], f"{key}.dds")
+
+    def _read_cache(self, key: str) -> Optional[bytes]:
+        cache_path = self._cache_path(key)
+        try:
+            with open(cache_path, "rb") as fp:
+                blob = fp.read()
+            os.utime(cache_path)  # 更新访问时间，用于 LRU 淘汰
+            return blob
+        except FileNotFoundError:  # 未命中，或刚被其他 worker 淘汰
+            return None
+
+    def _write_cache(self, key: str, blob: bytes):
+        cache_path = self._cache_path(key)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # 先写临时文件再原子替换，多个 worker 同时写入同一 key 也是安全的
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(blob)
+        os.replace(tmp_path, cache_path)
+        with self.lock:
+            if self.cache_size is not None:
+                self.cache_size += len(blob)
+                if self.cache_size > self.max_size:
+                    self.sweep_event.set()
+
+    def _sweep(self):
+        while True:
+            self.sweep_event.wait(self.sweep_interval)
+            self.sweep_event.clear()
+            try:
+                self.evict()
+            except Exception as e:
+                logger.warning(f"fail to evict texture cache: {e}")
+
+    def evict(self):
+        """
+        按最近访问时间淘汰缓存，直到总大小不超过 max_size；由后台线程调用
+        """
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_root):
+            for f in files:
+                if not f.endswith(".dds"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, f))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, f)))
+                total += stat.st_size
+        if total > self.max_size:
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_size:
+                    break
+            logger.debug(f"texture cache evicted, current size: {total}")
+        with self.lock:
+            self.cache_size = total
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_texture_engine() -> TextureEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TextureEngine()
+    return _engine
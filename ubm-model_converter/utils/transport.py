@@ -0,0 +1,243 @@
+"""
+converter 与 model manager 之间的 HTTP 传输层
+
+- 共享 requests.Session，keep-alive 连接池复用 TCP 连接
+- 限制同时在途的请求数
+- 连接错误、超时及 5xx 时按指数退避(全抖动)重试
+- 按接口记录耗时直方图
+"""
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Set
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from ..config import config
+from .path_handler import absolute_to_relative_path
+
+# 耗时直方图的桶上界，单位 ms
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, ms: float):
+        with self.lock:
+            self.counts[bisect_left(LATENCY_BUCKETS, ms)] += 1
+            self.total += 1
+            self.sum += ms
+
+    def percentile(self, p: float) -> float:
+        """
+        根据桶估算分位数，返回所在桶的上界
+        """
+        with self.lock:
+            if not self.total:
+                return 0
+            rank = self.total * p
+            acc = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+                acc += count
+                if acc >= rank:
+                    return bound
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.total,
+            "avg_ms": self.sum / self.total if self.total else 0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip(list(map(str, LATENCY_BUCKETS)) + ["inf"], self.counts)),
+        }
+
+
+class Transport:
+    def __init__(self, base_url: str, max_connections: int = 32, max_in_flight: int = 32, retries: int = 3,
+                 backoff: float = 0.2, timeout: float = 60):
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.lock = threading.Lock()
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        发送请求，`data` 可以传入返回可迭代对象的函数，用于在重试时重新生成流式请求体
+        :param method: HTTP 方法
+        :param path: 相对 base_url 的路径，如 `project/1/model-file/2/attribute`
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        endpoint = f"{method.upper()} {re.sub(r'/[0-9]+', '/{id}', '/' + path.lstrip('/'))}"
+        kwargs.setdefault("timeout", self.timeout)
+        data = kwargs.pop("data", None)
+        for attempt in range(self.retries + 1):
+            tic = time.perf_counter()
+            try:
+                with self.in_flight:
+                    response = self.session.request(method, url, data=data() if callable(data) else data, **kwargs)
+                if response.status_code < 500 or attempt == self.retries:
+                    return response
+                logger.warning(f"{endpoint} response {response.status_code}, retry {attempt + 1}/{self.retries}")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"{endpoint} failed: {e}, retry {attempt + 1}/{self.retries}")
+            finally:
+                self.histogram(endpoint).observe((time.perf_counter() - tic) * 1000)
+            time.sleep(random.uniform(0, self.backoff * (1 << attempt)))
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def histogram(self, endpoint: str) -> LatencyHistogram:
+        with self.lock:
+            if endpoint not in self.histograms:
+                self.histograms[endpoint] = LatencyHistogram()
+            return self.histograms[endpoint]
+
+    def stats(self) -> Dict[str, dict]:
+        with self.lock:
+            histograms = dict(self.histograms)
+        return {endpoint: h.to_dict() for endpoint, h in histograms.items()}
+
+    def log_stats(self):
+        for endpoint, stat in self.stats().items():
+            logger.info(
+                f"{endpoint}: count={stat['count']}, avg={stat['avg_ms']:.1f}ms, "
+                f"p50<={stat['p50_ms']}ms, p95<={stat['p95_ms']}ms, p99<={stat['p99_ms']}ms"
+            )
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """
+    进程内共享同一个 Transport，连接池在多个转换任务之间复用
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            manager_config = config["model_manager"]
+            _transport = Transport(
+                manager_config["url"],
+                max_connections=manager_config.get("max_connections", 32),
+                max_in_flight=manager_config.get("max_in_flight", 32),
+                retries=manager_config.get("retry", 3),
+                backoff=manager_config.get("retry_backoff", 0.2),
+                timeout=manager_config.get("timeout", 60),
+            )
+    return _transport
+
+
+def check_response(response: requests.Response, msg: str) -> bool:
+    status_code = response.json().get("code")
+    if status_code != 200:
+        logger.error(f"fail to upload data, status code: {status_code}, {msg}")
+        return False
+    return True
+
+
+def upload_json_data(project_id: int, model_file_id: int, path: str, data) -> bool:
+    """
+    上传 json 数据(layer, metadata, nodepage 等)
+    :param path: 资源路径，如 `project/1/model_file/2/layers/0`
+    """
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/attribute",
+            headers={"accept": "application/json"},
+            json={"path": path, "data": data},
+        )
+        return check_response(response, f"model_file_id: {model_file_id}, path: {path}")
+    except Exception as e:
+        logger.error(f"fail to upload json data, model_file_id: {model_file_id}, path: {path}, {e}")
+        return False
+
+
+def upload_bin(project_id: int, model_file_id: int, path: str, data: bytes, sha256: str = None) -> bool:
+    """
+    上传二进制数据(geometry, texture)
+    :param path: 相对 slpk 根目录的路径，如 `sublayers/0/nodes/1/geometries/1.bin`
+    :param sha256: 数据的 sha256，geometry 按 hash 存储时由 model manager 校验
+    """
+    path = path.replace("\\", "/")
+    form = {"path": path}
+    if sha256:
+        form["sha256"] = sha256
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/bin",
+            headers={"accept": "application/json"},
+            data=form,
+            files={"bin_data": (os.path.basename(path), data)},
+        )
+        return check_response(response, f"model_file_id: {model_file_id}, path: {path}")
+    except Exception as e:
+        logger.error(f"fail to upload bin, model_file_id: {model_file_id}, path: {path}, {e}")
+        return False
+
+
+def upload_bin_by_file(project_id: int, model_file_id: int, slpk_root: str, file_path: str) -> bool:
+    with open(file_path, "rb") as fp:
+        data = fp.read()
+    return upload_bin(project_id, model_file_id, absolute_to_relative_path(file_path, slpk_root), data)
+
+
+def find_missing_blobs(project_id: int, model_file_id: int, hashes: List[str]) -> Optional[Set[str]]:
+    """
+    查询 model manager 尚未保存的 blob
+    :return: 缺少的 hash，请求失败时返回 None
+    """
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/blob/missing",
+            headers={"accept": "application/json"},
+            json={"hashes": hashes},
+        )
+        if not check_response(response, f"model_file_id: {model_file_id}, check {len(hashes)} blobs"):
+            return None
+        return set(response.json().get("data", []))
+    except Exception as e:
+        logger.error(f"fail to check blobs, model_file_id: {model_file_id}, {e}")
+        return None
+
+
+def link_blob(project_id: int, model_file_id: int, path: str, sha256: str) -> bool:
+    """
+    将路径链接到 model manager 中已保存的 blob，不传输数据
+    :return: 是否链接成功，blob 不存在时返回 False
+    """
+    path = path.replace("\\", "/")
+    try:
+        response = get_transport().post(
+            f"project/{project_id}/model-file/{model_file_id}/blob/link",
+            headers={"accept": "application/json"},
+            json={"links": [{"path": path, "sha256": sha256}]},
+        )
+        if not check_response(response, f"model_file_id: {model_file_id}, path: {path}"):
+            return False
+        return not response.json().get("missing")
+    except Exception as e:
+        logger.error(f"fail to link blob, model_file_id: {model_file_id}, path: {path}, {e}")
+        return False
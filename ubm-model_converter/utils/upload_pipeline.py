@@ -0,0 +1,149 @@
+"""
+上传阶段的有界流水线
+
+向线程池提交任务前先占用额度，在途的任务数或字节数达到上限时阻塞提交方，任务完成后归还额度并释放对应的数据，
+使上传阶段的内存占用与模型大小无关。
+
+流水线同时跟踪所有任务的完成情况：任务抛出异常或返回 False 均视为失败，`wait` 等待全部任务结束并抛出第一个错误；
+`start_reporter` 定期汇报已上传的节点数、字节数、速率及预计剩余时间；断点中已完成或增量复用的节点通过 `skip`
+计入进度，但不计入速率。
+"""
+import json
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Callable, Optional
+
+from loguru import logger
+
+
+class UploadPipeline:
+    def __init__(self, executor: Executor, max_bytes: int, max_tasks: int):
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.max_tasks = max_tasks
+        self.cond = threading.Condition()
+        self.bytes_in_flight = 0
+        self.tasks_in_flight = 0
+        self.peak_bytes = 0
+        self.error: Optional[BaseException] = None
+        self.nodes_done = 0
+        self.nodes_skipped = 0
+        self.bytes_done = 0
+        self.total_nodes = 0
+        self.start_time = time.perf_counter()
+        self.reporter: Optional[threading.Thread] = None
+        self.reporter_stop = threading.Event()
+
+    def submit(self, fn: Callable, *args, nbytes: int = 0, nodes: int = 0, release: Optional[Callable] = None,
+               **kwargs) -> Future:
+        """
+        提交任务，额度不足时阻塞；已有任务失败时直接抛出该错误
+        :param nbytes: 任务持有的数据大小
+        :param nodes: 任务完成后计入进度的节点数
+        :param release: 任务完成后调用，用于释放任务对应的数据
+        """
+        with self.cond:
+            if self.error:
+                raise self.error
+            # 流水线为空时，超过上限的单个任务也允许进入，避免死锁
+            while self.tasks_in_flight and (
+                    self.tasks_in_flight >= self.max_tasks or self.bytes_in_flight + nbytes > self.max_bytes):
+                self.cond.wait()
+            self.tasks_in_flight += 1
+            self.bytes_in_flight += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.bytes_in_flight)
+
+        def done(f: Future):
+            if release:
+                release()
+            error = f.exception()
+            if error is None and f.result() is False:
+                error = RuntimeError(f"upload task `{fn.__name__}` failed.")
+            with self.cond:
+                self.tasks_in_flight -= 1
+                self.bytes_in_flight -= nbytes
+                if error is None:
+                    self.nodes_done += nodes
+                    self.bytes_done += nbytes
+                elif self.error is None:
+                    logger.error(f"upload task `{fn.__name__}` failed: {error}")
+                    self.error = error
+                self.cond.notify_all()
+
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(done)
+        return future
+
+    def skip(self, nodes: int):
+        """
+        记录无需上传的节点(断点中已完成、增量复用)
+        """
+        with self.cond:
+            self.nodes_skipped += nodes
+
+    def wait(self):
+        """
+        等待所有已提交的任务结束，有任务失败时抛出第一个错误
+        """
+        with self.cond:
+            while self.tasks_in_flight:
+                self.cond.wait()
+        self.stop_reporter()
+        if self.error:
+            raise self.error
+
+    def progress(self) -> dict:
+        with self.cond:
+            nodes_done, bytes_done, total_nodes = self.nodes_done, self.bytes_done, self.total_nodes
+            nodes_skipped = self.nodes_skipped
+        elapsed = time.perf_counter() - self.start_time
+        rate = nodes_done / elapsed if elapsed > 0 else 0
+        return {
+            "nodes_uploaded": nodes_done,
+            "nodes_skipped": nodes_skipped,
+            "total_nodes": total_nodes,
+            "bytes_uploaded": bytes_done,
+            "nodes_per_second": round(rate, 2),
+            "bytes_per_second": round(bytes_done / elapsed if elapsed > 0 else 0, 2),
+            "eta": round(max(total_nodes - nodes_skipped - nodes_done, 0) / rate, 1) if rate > 0 else None,
+        }
+
+    def start_reporter(self, callback: Callable[[str], None], total_nodes: int, interval: float = 10):
+        """
+        启动后台线程，每隔 interval 秒以 json 字符串调用一次 callback 汇报进度
+        """
+        self.total_nodes = total_nodes
+        self.start_time = time.perf_counter()
+
+        def report():
+            while not self.reporter_stop.wait(interval):
+                progress = self.progress()
+                logger.info(f"upload progress: {progress}")
+                try:
+                    callback(json.dumps(progress))
+                except Exception as e:
+                    logger.warning(f"fail to report progress: {e}")
+
+        self.reporter = threading.Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self):
+        if self.reporter:
+            self.reporter_stop.set()
+            self.reporter.join()
+            self.reporter = None
+
+    def in_flight(self) -> dict:
+        with self.cond:
+            return {
+                "tasks": self.tasks_in_flight,
+                "bytes": self.bytes_in_flight,
+                "peak_bytes": self.peak_bytes,
+            }
+
+    def log_in_flight(self):
+        stat = self.in_flight()
+        logger.debug(
+            f"upload in flight: {stat['tasks']} tasks, {stat['bytes']} bytes, peak {stat['peak_bytes']} bytes"
+        )
@@ -1,27 +1,32 @@
+import hashlib
 import json
 import os
+import pickle
 import shutil
-import struct
 import sys
 import threading
-import time
-from typing import List
-from wand import image
+from typing import Callable, List, Optional, Set
 from .config import config
 from .model.slpk_model.merged_node import MergedNode
-from .model.slpk_model.node import Node
-from .model.slpk_model.node_info import NodeInfo
 from .model.slpk_model.slpk import SLPK
 from loguru import logger
 from .model.slpk_model.sublayer import Sublayer
-from .model.ubm_model.attribute import Attribute
-from .model.ubm_model.material import Material
-from .utils.api_handler import upload_json_data, upload_bin, upload_bin_by_file
+from .utils.transport import upload_json_data, upload_bin, find_missing_blobs, link_blob
+from .utils.attribute_codec import encode_attributes
+from .utils.bulk_handler import upload_node_attributes, get_previous_fingerprints, save_fingerprints, remap_nodes
+from .utils.checkpoint import Checkpoint
 from .utils.path_handler import absolute_to_relative_path
-from .utils.compress_file import build_slpk, compress_to_gz
+from .utils import geometry_buffer
+from .utils.draco_engine import get_draco_engine
+from .utils.fingerprint import node_fingerprint
+from .utils.texture_engine import get_texture_engine
 from .utils.upload_file import upload, delete_file
-from timeit import default_timer as timer
+from .utils.profiler import Profiler
+from .utils.shared_storage import SharedStorage, open_shared_storage
+from .utils.slpk_stream import SlpkArchive, SlpkDirectory, SlpkSink
+from .utils.upload_pipeline import UploadPipeline
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 
 if getattr(sys, "frozen", False):
     work_path = os.path.dirname(sys.executable)
@@ -29,37 +34,177 @@ else:
     work_path = os.path.dirname(__file__)
 
 
+# 上传与离线写出的 0.bin 布局不同，需与各自的 draco 参数保持一致
+UPLOAD_GEOMETRY_LAYOUT = (
+    "polymesh_position_bytes",
+    "polymesh_uv_bytes",
+    "polymesh_normal_bytes",
+    "polymesh_color_bytes",
+    "feature_id_bytes",
+    "face_range_bytes",
+)
+FILE_GEOMETRY_LAYOUT = (
+    "polymesh_position_bytes",
+    "polymesh_normal_bytes",
+    "polymesh_uv_bytes",
+    "polymesh_color_bytes",
+    "polymesh_uvregion_bytes",
+    "feature_id_bytes",
+    "face_range_bytes",
+)
+
+
 class Writer:
-    def __init__(self, slpk: SLPK):
-        self.slpk_root = None
+    def __init__(self, slpk: SLPK = None, name: str = None, checkpoint: Checkpoint = None,
+                 profiler: Profiler = None):
+        """
+        :param slpk: 待输出的 slpk
+        :param name: slpk 名称，分布式转换的子任务只处理单个子层，不传入 slpk 时使用
+        :param checkpoint: 断点记录，重试时跳过已确认的上传
+        :param profiler: 各阶段的性能统计
+        """
         self.slpk = slpk
+        self.checkpoint = checkpoint
+        self.profiler = profiler or Profiler()
+        self.incremental = config.get("incremental", {}).get("enable", False)
+        self.name = name or slpk.name
+        self.slpk_root = os.path.join(config["output_file_root"], os.path.splitext(self.name)[0])
         self.thread_pool = ThreadPoolExecutor(
             max_workers=config["model_manager"]["upload_worker"]
         )
-        self.task_list = []
-        self.image_cache = {}
+        self.draco_engine = get_draco_engine()
+        self.texture_engine = get_texture_engine()
+        # 限制上传阶段在途的任务数与字节数
+        self.pipeline = UploadPipeline(
+            self.thread_pool,
+            max_bytes=config["model_manager"].get("max_bytes_in_flight", 256 << 20),
+            max_tasks=config["model_manager"].get("max_tasks_in_flight", config["model_manager"]["upload_worker"] * 4),
+        )
+        self.sink: Optional[SlpkSink] = None
+        # 与 model manager 共享存储时，二进制数据写入暂存区，不再通过 HTTP 上传
+        self.storage: Optional[SharedStorage] = None
         self.lock = threading.Lock()
 
     def to_file(self, fp: str):
         logger.debug(f"out put path: {fp}")
-        self.create_dir()
-        self.write_init_info()
-        self.write_sublayers()
-        self.finish()
+        self.sink = self.create_sink()
+        try:
+            with self.profiler.stage("write"):
+                self.write_init_info()
+                self.write_sublayers()
+        except Exception:
+            self.sink.abort()
+            raise
+        with self.profiler.stage("finalise") as s:
+            self.finish()
+            s.add(self.sink.bytes_written)
 
-    def to_db(self, fp: str, project_id: int, model_file_id: int):
+    def to_db(self, fp: str, project_id: int, model_file_id: int, progress_callback: Callable[[str], None] = None):
+        """
+        上传至 model manager，等待所有上传任务完成，任一任务失败时抛出异常
+        :param progress_callback: 定期以 json 字符串汇报上传进度
+        """
         logger.debug(f"out put path: {fp}")
         self.create_dir()
+        if progress_callback:
+            self.pipeline.start_reporter(
+                progress_callback,
+                sum(len(sublayer.merged_nodes) for sublayer in self.slpk.sublayers),
+                config["model_manager"].get("progress_interval", 10),
+            )
+        self.storage = self.open_storage(project_id, model_file_id, "all")
+        try:
+            self.upload_stage(self.upload_all, project_id, model_file_id)
+            self.commit_storage()
+        finally:
+            self.pipeline.stop_reporter()
+            self.thread_pool.shutdown(wait=True)
+            if self.checkpoint:
+                self.checkpoint.save()
+
+    def to_db_init(self, project_id: int, model_file_id: int):
+        """
+        分布式转换时由主任务调用，只上传 layer 信息，子层由各子任务上传
+        """
+        self.create_dir()
+        try:
+            self.upload_stage(self.upload_init_info, project_id, model_file_id)
+        finally:
+            self.thread_pool.shutdown(wait=True)
+            if self.checkpoint:
+                self.checkpoint.save()
+
+    def to_db_sublayer(self, project_id: int, model_file_id: int, idx: int, sublayer: Sublayer):
+        """
+        分布式转换时由子任务调用，上传单个子层
+        """
+        self.storage = self.open_storage(project_id, model_file_id, f"sublayer_{idx}")
+        try:
+            self.upload_stage(self.upload_sublayer, project_id, model_file_id, idx, sublayer)
+            self.commit_storage()
+        finally:
+            self.thread_pool.shutdown(wait=True)
+            if self.checkpoint:
+                self.checkpoint.save()
+
+    def upload_all(self, project_id: int, model_file_id: int):
         self.upload_init_info(project_id, model_file_id)
-        as_completed(self.task_list)
         self.upload_sublayers(project_id, model_file_id)
-        self.thread_pool.shutdown(wait=True)
+
+    def upload_stage(self, fn: Callable, *args):
+        """
+        提交上传任务并等待全部完成；提交阶段(含 draco 压缩)计入 upload，等待剩余任务计入 finalise
+        """
+        nodes, nbytes = self.pipeline.nodes_done, self.pipeline.bytes_done
+        with self.profiler.stage("upload"):
+            fn(*args)
+        with self.profiler.stage("finalise"):
+            self.pipeline.wait()
+        self.profiler.record(
+            "upload", nbytes=self.pipeline.bytes_done - nbytes, nodes=self.pipeline.nodes_done - nodes, count=0
+        )
+
+    def open_storage(self, project_id: int, model_file_id: int, name: str) -> Optional[SharedStorage]:
+        resume = self.checkpoint is not None and self.checkpoint.resumed
+        return open_shared_storage(project_id, model_file_id, name, resume)
+
+    def commit_storage(self):
+        """
+        所有上传任务完成后提交暂存区，失败时抛出异常
+        """
+        if self.storage is None:
+            return
+        with self.profiler.stage("commit"):
+            if not self.storage.commit():
+                raise RuntimeError(f"fail to commit shared storage `{self.storage.name}`")
+
+    def put_bin(self, project_id: int, model_file_id: int, path: str, data: bytes, sha256: str = None) -> bool:
+        """
+        共享存储可用时写入暂存区，否则(或写入失败时)通过 HTTP 上传
+        """
+        if self.storage and self.storage.put(path, data, sha256):
+            return True
+        return upload_bin(project_id, model_file_id, path, data, sha256)
+
+    def dump_sublayers(self, root: str) -> List[str]:
+        """
+        将各子层序列化到 root 下，供其他 worker 上的子任务读取
+        :return: 各子层文件路径
+        """
+        os.makedirs(root, exist_ok=True)
+        paths = []
+        for idx, sublayer in enumerate(self.slpk.sublayers):
+            path = os.path.join(root, f"{idx}.pickle")
+            with open(path, "wb") as fp:
+                pickle.dump(sublayer, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            paths.append(path)
+        return paths
 
     def create_dir(self):
-        filename = os.path.splitext(self.slpk.name)[0]
-        self.slpk_root = os.path.join(config["output_file_root"], filename)
         # create dir structure
-        if not os.path.exists(self.slpk_root):
+        if self.checkpoint and self.checkpoint.resumed and os.path.exists(self.slpk_root):
+            logger.info(f"目录 {self.slpk_root} 已存在, 从断点继续")
+        elif not os.path.exists(self.slpk_root):
             os.makedirs(self.slpk_root)
             os.makedirs(os.path.join(self.slpk_root, "statistics"))
             os.makedirs(os.path.join(self.slpk_root, "sublayers"))
@@ -72,176 +217,230 @@ class Writer:
             # raise FileExistsError
 
     def upload_init_info(self, project_id: int, model_file_id):
-        self.task_list.append(
-            self.thread_pool.submit(
-                upload_json_data,
-                project_id,
-                model_file_id,
-                f"project/{project_id}/model_file/{model_file_id}/layers/metadata",
-                self.slpk.layer.meta,
-            )
-        )
-        upload_json_data(
+        self.submit_once(
+            "metadata",
+            upload_json_data,
             project_id,
             model_file_id,
-            f"project/{project_id}/model_file/{model_file_id}/layers/0",
-            self.slpk.layer.to_dict())
+            f"project/{project_id}/model_file/{model_file_id}/layers/metadata",
+            self.slpk.layer.meta,
+            nbytes=Writer.json_size(self.slpk.layer.meta),
+        )
+        # 子层及节点表在上传 layer 时创建，必须同步完成
+        if not self.is_done("layer"):
+            if not self.checkpointed(
+                    "layer",
+                    upload_json_data,
+                    project_id,
+                    model_file_id,
+                    f"project/{project_id}/model_file/{model_file_id}/layers/0",
+                    self.slpk.layer.to_dict()):
+                raise RuntimeError(f"fail to upload layer, model_file_id: {model_file_id}")
 
     def upload_sublayers(self, project_id: int, model_file_id):
-        # task_list = []
-        # with ThreadPoolExecutor(max_workers=config["max_worker"]) as t:
         for idx, sublayer in enumerate(self.slpk.sublayers):
-            sublayer_dir = os.path.join(self.slpk_root, f"sublayers", f"{idx}")
-            res_sublayer_dir = f"project/{project_id}/model_file/{model_file_id}/sublayers/{idx}/"
-            os.makedirs(sublayer_dir)
-            # nodepages_dir = os.path.join(sublayer_dir, "nodepages")
-            # os.makedirs(nodepages_dir)
-            nodes_dir = os.path.join(sublayer_dir, "nodes")
-            os.makedirs(nodes_dir)
-            # 创建每层的metadata以及3dSceneLayer
-            # task_list.append(
-            self.thread_pool.submit(
-                upload_json_data,
-                project_id,
-                model_file_id,
-                os.path.join(res_sublayer_dir, "metadata"),
-                sublayer.info.meta,
-            )
-            # )
-            # task_list.append(
-            self.thread_pool.submit(
-                upload_json_data,
-                project_id,
-                model_file_id,
-                os.path.join(res_sublayer_dir, "3dSceneLayer"),
-                sublayer.info.scene_layer,
-            )
+            self.upload_sublayer(project_id, model_file_id, idx, sublayer)
+        logger.info("upload sublayers complete.")
 
-            self.upload_nodepage(project_id, model_file_id, idx, sublayer)
-            # )
-            # 创建每个node的文件夹
-            # 处理属性
-            logger.debug(
-                f"upload sublayer: {sublayer.info.scene_layer.get('name')}, node count: {len(sublayer.nodes)}"
-            )
-            for index, node in enumerate(sublayer.merged_nodes):
+    def upload_sublayer(self, project_id: int, model_file_id, idx: int, sublayer: Sublayer):
+        sublayer_dir = os.path.join(self.slpk_root, f"sublayers", f"{idx}")
+        res_sublayer_dir = f"project/{project_id}/model_file/{model_file_id}/sublayers/{idx}/"
+        os.makedirs(sublayer_dir, exist_ok=True)
+        # nodepages_dir = os.path.join(sublayer_dir, "nodepages")
+        # os.makedirs(nodepages_dir)
+        nodes_dir = os.path.join(sublayer_dir, "nodes")
+        os.makedirs(nodes_dir, exist_ok=True)
+        # 创建每层的metadata以及3dSceneLayer
+        # task_list.append(
+        self.submit_once(
+            f"sublayer/{idx}/metadata",
+            upload_json_data,
+            project_id,
+            model_file_id,
+            os.path.join(res_sublayer_dir, "metadata"),
+            sublayer.info.meta,
+            nbytes=Writer.json_size(sublayer.info.meta),
+        )
+        # )
+        # task_list.append(
+        self.submit_once(
+            f"sublayer/{idx}/3dSceneLayer",
+            upload_json_data,
+            project_id,
+            model_file_id,
+            os.path.join(res_sublayer_dir, "3dSceneLayer"),
+            sublayer.info.scene_layer,
+            nbytes=Writer.json_size(sublayer.info.scene_layer),
+        )
+
+        self.upload_nodepage(project_id, model_file_id, idx, sublayer)
+        # )
+        # 创建每个node的文件夹
+        # 处理属性
+        logger.debug(
+            f"upload sublayer: {sublayer.info.scene_layer.get('name')}, node count: {len(sublayer.nodes)}"
+        )
+        merged_nodes = sublayer.merged_nodes
+        # 增量转换：与上一版本指纹相同的节点由 model manager 直接复用
+        remapped = self.remap_unchanged_nodes(project_id, model_file_id, idx, sublayer) if self.incremental else set()
+        # 子层所有节点的属性一次性批量写入
+        attributes = [(index, node.attribute) for index, node in enumerate(merged_nodes) if index not in remapped]
+        self.submit_once(
+            f"sublayer/{idx}/attribute",
+            upload_node_attributes,
+            project_id,
+            model_file_id,
+            idx,
+            attributes,
+            nbytes=sum(Writer.attribute_size(attribute) for _, attribute in attributes),
+        )
+        # 已确认上传及复用的节点直接释放，不再压缩，计入进度
+        pending = []
+        for index in range(len(merged_nodes)):
+            if index in remapped or self.is_done(f"node/{idx}/{index}"):
+                Writer.release_merged_node(sublayer, index)
+            else:
+                pending.append(index)
+        self.pipeline.skip(len(merged_nodes) - len(pending))
+        for start in range(0, len(pending), self.draco_engine.chunk_size):
+            indexes = pending[start: start + self.draco_engine.chunk_size]
+            with self.profiler.stage("draco") as s:
+                geometries = self.draco_engine.encode_many(
+                    [Writer.geometry_buffer(merged_nodes[index], UPLOAD_GEOMETRY_LAYOUT) for index in indexes],
+                    UPLOAD_GEOMETRY_LAYOUT,
+                    t=0,
+                )
+                s.add(sum(len(geometry) for geometry in geometries if geometry), len(indexes))
+            hashes = [hashlib.sha256(geometry).hexdigest() if geometry else None for geometry in geometries]
+            # 一次查询整块的 hash，model manager 已保存的 geometry 只需链接，不再传输；
+            # 共享存储时直接检查 blob 是否存在，不需要查询
+            missing = find_missing_blobs(project_id, model_file_id, list(filter(None, set(hashes)))) \
+                if self.storage is None else None
+            for index, geometry, sha256 in zip(indexes, geometries, hashes):
                 node_dir = os.path.join(nodes_dir, f"{index}")
-                # self.write_merged_nodes(node, node_dir, sublayer.attrnamelist)
-                # task_list.append(
-                self.thread_pool.submit(
+                stored = False
+                if missing is not None and sha256 is not None:
+                    # 同一块内重复的 geometry 只上传第一份，其余节点先尝试链接
+                    stored = sha256 not in missing
+                    missing.discard(sha256)
+                self.submit_once(
+                    f"node/{idx}/{index}",
                     self.upload_merged_nodes,
                     project_id,
                     model_file_id,
-                    node,
+                    merged_nodes[index],
+                    geometry,
                     node_dir,
                     index,
                     idx,
+                    sha256,
+                    stored,
+                    nbytes=(len(geometry) if geometry else 0) + self.texture_size(merged_nodes[index]),
+                    nodes=1,
+                    release=partial(Writer.release_merged_node, sublayer, index),
                 )
-                # )
+            del geometries
+            self.pipeline.log_in_flight()
 
-        # as_completed(task_list)
-        logger.info("upload sublayers complete.")
+    def remap_unchanged_nodes(self, project_id: int, model_file_id: int, idx: int, sublayer: Sublayer) -> Set[int]:
+        """
+        计算子层各节点的指纹并保存，与上一版本相同的节点提交给 model manager 复用
+        :return: 复用的节点下标
+        """
+        with self.profiler.stage("fingerprint") as s:
+            fingerprints = [
+                node_fingerprint(
+                    node,
+                    UPLOAD_GEOMETRY_LAYOUT,
+                    self.texture_engine.content_key(node.diffuse_map[0]) if node.has_texture else None,
+                )
+                for node in sublayer.merged_nodes
+            ]
+            s.add(nodes=len(fingerprints))
+        self.submit_once(
+            f"sublayer/{idx}/fingerprints", save_fingerprints, project_id, model_file_id, idx, fingerprints,
+            nbytes=Writer.json_size(fingerprints),
+        )
+        previous = get_previous_fingerprints(project_id, model_file_id, idx)
+        if not previous:
+            return set()
+        previous_indexes = {}
+        for index, fingerprint in enumerate(previous["fingerprints"]):
+            previous_indexes.setdefault(fingerprint, index)
+        remap = [
+            (index, previous_indexes[fingerprint])
+            for index, fingerprint in enumerate(fingerprints) if fingerprint in previous_indexes
+        ]
+        logger.info(
+            f"sublayer {idx}: {len(remap)}/{len(fingerprints)} nodes unchanged since model file "
+            f"{previous['model_file_id']}"
+        )
+        if remap:
+            self.submit_once(
+                f"sublayer/{idx}/remap",
+                remap_nodes,
+                project_id,
+                model_file_id,
+                idx,
+                previous["model_file_id"],
+                remap,
+                nbytes=Writer.json_size(remap),
+            )
+        return {index for index, _ in remap}
 
     def upload_nodepage(self, project_id, model_file_id, idx: int, sublayer: Sublayer):
         np = sublayer.nodepage
-        self.thread_pool.submit(
+        self.submit_once(
+            f"sublayer/{idx}/nodepage",
             upload_json_data,
             project_id,
             model_file_id,
             f"project/{project_id}/model_file/{model_file_id}/sublayers/{idx}/nodepage",
             {"nodes": np.nodes},
+            nbytes=Writer.json_size({"nodes": np.nodes}),
         )
 
-    def upload_merged_nodes(self, project_id, model_file_id, node: MergedNode, node_dir: str, index: int,
-                            sublayer_idx: int):
+    def upload_merged_nodes(self, project_id, model_file_id, node: MergedNode, geometry: Optional[bytes],
+                            node_dir: str, index: int, sublayer_idx: int, sha256: str = None,
+                            stored: bool = False) -> bool:
+        """
+        上传单个节点的纹理与 geometry
+        :param sha256: geometry 的 sha256
+        :param stored: geometry 是否可能已存在于 model manager，是则先尝试链接，失败时再上传
+        :return: 是否全部上传成功，draco 压缩失败时返回 False，断点中不记录该节点，重试时重新处理
+        """
         geometries_dir = os.path.join(node_dir, "geometries")
-        os.makedirs(geometries_dir)
         # 创建texture且复制图片
         if node.has_texture:
             # logger.debug("开始处理纹理图片")
             texture_dir = os.path.join(node_dir, "textures")
-            os.makedirs(texture_dir)
-            oldmap = node.diffuse_map[0]
-            if oldmap not in self.image_cache:
-                logger.debug(f"图片纹理原路径：{oldmap}")
-                if not os.path.isfile(oldmap):
-                    logger.warning("图片不存在")
-                else:
-                    shutil.copy(oldmap, texture_dir + "\\" + f"{0}.jpg")  # 复制文件
-                    with image.Image(filename=texture_dir + "\\" + f"{0}.jpg") as img:  # 转换为dds
-                        img_size = img.size
-                        logger.debug(f"origin size: {img_size}")
-                        if img_size[0] != img_size[1]:
-                            new_size = min(img_size)
-                            img.transform(f"{new_size}x{new_size}", "100%")
-                            for i in range(1, 20):
-                                if (1 << i) < new_size < (1 << (i + 1)):  # TODO: here maybe cause some problems.
-                                    new_size = 1 << i if abs((1 << i) - new_size) < abs(
-                                        (1 << (i + 1)) - new_size) else 1 << (i + 1)
-                                    logger.debug(f"new size: {new_size}")
-                                    break
-                            img.resize(new_size, new_size)
-                        img.compression = "dxt3"
-                        with self.lock:
-                            self.image_cache[oldmap] = img.make_blob(format='dds')
-                        # img.save(filename=texture_dir + f"\\{0}_{0}_1.bin.dds")
-                        # blob_data = img.make_blob(format='dds')
-                        # upload_bin_by_file(project_id, model_file_id, self.slpk_root, texture_dir + f"\\{0}_{0}_1.bin.dds")
-            else:
-                logger.debug(f"use cache：{oldmap}")
-            blob_data = self.image_cache[oldmap]
-            upload_bin(project_id, model_file_id,
-                       absolute_to_relative_path(texture_dir + f"/0_0_1.bin.dds", self.slpk_root), blob_data)
-        # 写属性
-        # 线程里不能创建线程
-        upload_json_data(project_id, model_file_id,
-                         f"project/{project_id}/model_file/{model_file_id}/sublayers/{sublayer_idx}/nodes/{index}/attribute",
-                         node.attribute)
-        # self.thread_pool.submit(
-        #     upload_json_data,
-        #     project_id,
-        #     model_file_id,
-        #     f"{model_file_id}/sublayers/{sublayer_idx}/nodes/{index}/attribute",
-        #     node.attribute,
-        # )
-        # 处理geometry 0.bin头文件
-        # 生成geometry中的0.bin
-        bindoc_dir = os.path.join(node_dir, "geometries\\0.bin")
-        # 写入geometry 0.bin
-        with open(os.path.join(geometries_dir, "0.bin"), "ab") as fp:
-            fp.write(node.polymesh_header_data)
-            for position in node.polymesh_position_bytes:
-                fp.write(position)
-            for uv in node.polymesh_uv_bytes:
-                fp.write(uv)
-            for normal in node.polymesh_normal_bytes:
-                fp.write(normal)
-            for color in node.polymesh_color_bytes:
-                fp.write(color)
-            # for uvregion in node.polymesh_uvregion_bytes:
-            #     fp.write(uvregion)
-            for feature_id in node.feature_id_bytes:
-                fp.write(feature_id)
-            for face_range in node.face_range_bytes:
-                fp.write(face_range)
-        # Draco压缩
-        model = os.path.join(geometries_dir, "1.bin")
-        draco_encoder = os.path.join(
-            work_path,
-            "../thirdparty/draco_encoder.exe",
-        )
-        # TODO: 直接获取压缩后的二进制数据
+            blob_data = self.transcode_texture(node.diffuse_map[0])
+            if blob_data is not None:
+                if not self.put_bin(project_id, model_file_id,
+                                    absolute_to_relative_path(texture_dir + f"/0_0_1.bin.dds", self.slpk_root),
+                                    blob_data):
+                    return False
+        # draco 压缩结果由引擎直接返回
+        if geometry is None:
+            logger.warning(f"Failed to draco, sublayer: {sublayer_idx}, node: {index}")
+            return False
 
-        res = Writer.exec_cmd(
-            rf'"{draco_encoder}" -i "{bindoc_dir}" -o "{model}" --t {0}'
-        )
-        # print(res)
-        if "Failed" in res:
-            logger.warning(f"Failed to draco")
-            return
+        # upload geo 1.bin
+        geometry_path = absolute_to_relative_path(os.path.join(geometries_dir, "1.bin"), self.slpk_root)
+        if stored and link_blob(project_id, model_file_id, geometry_path, sha256):
+            return True
+        return self.put_bin(project_id, model_file_id, geometry_path, geometry, sha256)
 
-        # upload geo 1.bin.gz
-        upload_bin_by_file(project_id, model_file_id, self.slpk_root, model)
+    def create_sink(self) -> SlpkSink:
+        """
+        离线输出直接写入 slpk 文件；服务端模式写出 gz 目录树
+        """
+        workers = config.get("slpk_stream", {}).get("worker") or config["max_worker"]
+        if config["server"]["is_server"]:
+            if os.path.exists(self.slpk_root):
+                shutil.rmtree(self.slpk_root)
+            return SlpkDirectory(self.slpk_root, max_workers=workers)
+        return SlpkArchive(f"{self.slpk_root}.slpk", max_workers=workers)
 
     def write_init_info(self):
         """
@@ -249,196 +448,90 @@ class Writer:
         metadata.json
         :return:
         """
-        with open(
-                os.path.join(self.slpk_root, "metadata.json"), "w", encoding="utf-8"
-        ) as f:
-            json.dump(self.slpk.layer.meta, f, ensure_ascii=False)
-
-        with open(
-                os.path.join(self.slpk_root, "3dSceneLayer.json"), "w", encoding="utf-8"
-        ) as f:
-            json.dump(self.slpk.layer.to_dict(), f, ensure_ascii=False)
+        self.sink.add_json("metadata.json", self.slpk.layer.meta)
+        self.sink.add_json("3dSceneLayer.json", self.slpk.layer.to_dict())
 
     def write_sublayers(self):
-        def to_file(path, data):
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False)
-
         task_list = []
         with ThreadPoolExecutor(max_workers=config["max_worker"]) as t:
             for idx, sublayer in enumerate(self.slpk.sublayers):
-                sublayer_dir = os.path.join(self.slpk_root, f"sublayers/{idx}")
-                os.makedirs(sublayer_dir)
-                nodepages_dir = os.path.join(sublayer_dir, "nodepages")
-                os.makedirs(nodepages_dir)
-                nodes_dir = os.path.join(sublayer_dir, "nodes")
-                os.makedirs(nodes_dir)
+                sublayer_dir = f"sublayers/{idx}"
                 # 创建每层的metadata以及3dSceneLayer
-                task_list.append(
-                    t.submit(
-                        to_file,
-                        os.path.join(sublayer_dir, "metadata.json"),
-                        sublayer.info.meta,
-                    )
-                )
-                task_list.append(
-                    t.submit(
-                        to_file,
-                        os.path.join(sublayer_dir, "3dSceneLayer.json"),
-                        sublayer.info.scene_layer,
-                    )
-                )
+                self.sink.add_json(f"{sublayer_dir}/metadata.json", sublayer.info.meta)
+                self.sink.add_json(f"{sublayer_dir}/3dSceneLayer.json", sublayer.info.scene_layer)
                 self.write_nodepage(idx, sublayer)
-                # 创建每个node的文件夹
                 # 处理属性
                 logger.info(
                     f"write sublayer: {sublayer.info.scene_layer.get('name')}, merged node count: {len(sublayer.merged_nodes)}, node count: {len(sublayer.nodes)}"
                 )
-                for index, node in enumerate(sublayer.merged_nodes):
-                    node_dir = os.path.join(nodes_dir, f"{index}")
-                    # self.write_merged_nodes(node, node_dir, sublayer.attrnamelist)
-                    task_list.append(
-                        t.submit(
-                            self.write_merged_nodes,
-                            node,
-                            node_dir,
-                            sublayer.attrnamelist,
+                merged_nodes = sublayer.merged_nodes
+                for start in range(0, len(merged_nodes), self.draco_engine.chunk_size):
+                    chunk = merged_nodes[start: start + self.draco_engine.chunk_size]
+                    buffers = [Writer.geometry_buffer(node, FILE_GEOMETRY_LAYOUT) for node in chunk]
+                    with self.profiler.stage("draco") as s:
+                        if config["use_deck"]:
+                            geometries = self.draco_engine.encode_many(
+                                buffers, FILE_GEOMETRY_LAYOUT, t=0, use_deck=True
+                            )
+                        else:
+                            # TODO: 调整draco以适配arcgis前端，目前使用0.bin
+                            geometries = self.draco_engine.encode_many(buffers, FILE_GEOMETRY_LAYOUT, t=1)
+                        s.add(sum(len(geometry) for geometry in geometries if geometry), len(chunk))
+                    for index, (node, buffer, geometry) in enumerate(zip(chunk, buffers, geometries), start):
+                        task_list.append(
+                            t.submit(
+                                self.write_merged_nodes,
+                                node,
+                                buffer,
+                                geometry,
+                                f"{sublayer_dir}/nodes/{index}",
+                                sublayer.attrnamelist,
+                            )
                         )
-                    )
 
-        as_completed(task_list)
+        # 等待所有节点写入，任一节点失败时抛出异常
+        for task in as_completed(task_list):
+            task.result()
         logger.info("write sublayers complete.")
 
     def write_nodepage(self, idx: int, sublayer: Sublayer):
         np = sublayer.nodepage
         for i in range(0, len(np.nodes), config["nodepage_size"]):
             nodes = np.nodes[i: i + config["nodepage_size"]]
-            with open(
-                    os.path.join(self.slpk_root, SLPK.nodepage_path_tamp.format(idx, i // config["nodepage_size"]))
-                    + ".json",
-                    "w",
-                    encoding="utf-8",
-            ) as f:
-                json.dump({"nodes": nodes}, f, ensure_ascii=False)
-
-    def write_merged_nodes(self, node: MergedNode, node_dir: str, subattrnamelist: List[str]):
-        attributes_dir = os.path.join(node_dir, "attributes")
-        os.makedirs(attributes_dir)
-        # features_dir = os.path.join(node_dir, "features")
-        # os.makedirs(features_dir)
-        geometries_dir = os.path.join(node_dir, "geometries")
-        os.makedirs(geometries_dir)
+            self.sink.add_json(
+                SLPK.nodepage_path_tamp.format(idx, i // config["nodepage_size"]) + ".json",
+                {"nodes": nodes},
+            )
+
+    def write_merged_nodes(self, node: MergedNode, buffer: bytes, geometry: Optional[bytes], node_dir: str,
+                           subattrnamelist: List[str]):
+        """
+        :param node_dir: 节点相对 slpk 根目录的路径，如 `sublayers/0/nodes/1`
+        """
         # 创建texture且复制图片
         if node.has_texture:
             # logger.debug("开始处理纹理图片")
-            texture_dir = os.path.join(node_dir, "textures")
-            os.makedirs(texture_dir)
-            oldmap = node.diffuse_map[0]
-            if oldmap not in self.image_cache:
-                logger.debug(f"图片纹理原路径：{oldmap}")
-                if not os.path.isfile(oldmap):
-                    logger.warning("图片不存在")
-                else:
-                    shutil.copy(oldmap, texture_dir + "\\" + f"{0}.jpg")  # 复制文件
-                    with image.Image(filename=texture_dir + "\\" + f"{0}.jpg") as img:  # 转换为dds
-                        img_size = img.size
-                        logger.debug(f"origin size: {img_size}")
-                        if img_size[0] != img_size[1]:
-                            new_size = min(img_size)
-                            img.transform(f"{new_size}x{new_size}", "100%")
-                            for i in range(1, 20):
-                                if (1 << i) < new_size < (1 << (i + 1)):  # TODO: here maybe cause some problems.
-                                    new_size = 1 << i if abs((1 << i) - new_size) < abs(
-                                        (1 << (i + 1)) - new_size) else 1 << (i + 1)
-                                    logger.debug(f"new size: {new_size}")
-                                    break
-                            img.resize(new_size, new_size)
-                        img.compression = "dxt3"
-                        with self.lock:
-                            self.image_cache[oldmap] = img.make_blob(format='dds')
-                        img.save(filename=texture_dir + f"\\{0}_{0}_1.bin.dds")
-            else:
-                # logger.debug(f"use cache：{oldmap}")
-                with open(texture_dir + f"\\{0}_{0}_1.bin.dds", "wb") as fp:
-                    fp.write(self.image_cache[oldmap])
-                # self.image_cache[oldmap].save(filename=texture_dir + f"\\{0}_{0}_1.bin.dds")
-        # 生成属性文件夹
-        for idx, attrname in enumerate(subattrnamelist):
-            attr_dir = os.path.join(attributes_dir, f"f_{idx}")
-            os.makedirs(attr_dir)
-        # 生成geometry中的0.bin
-        bindoc_dir = os.path.join(node_dir, "geometries\\0.bin")
-        # 写属性
-        for idx, attr_bytes in enumerate(node.attribute_value_bytes_list):
-            attr_dir = os.path.join(attributes_dir, f"f_{idx}")
-            with open(os.path.join(attr_dir, "0.bin"), "wb") as fp:
-                fp.write(node.node_count_bytes)
-                if idx != 0:
-                    fp.write(node.attribute_total_size_bytes[idx])
-                    for attr_size_byte in node.attribute_size_bytes_list[idx]:
-                        fp.write(attr_size_byte)
-                for attr_byte in attr_bytes:
-                    fp.write(attr_byte)
-        # 处理geometry 0.bin头文件
+            blob_data = self.transcode_texture(node.diffuse_map[0])
+            if blob_data is not None:
+                self.sink.add_bytes(f"{node_dir}/textures/0_0_1.bin.dds", blob_data)
+        # 写属性，与 model manager 返回的属性二进制使用同一编码
+        for idx, attr_bytes in enumerate(encode_attributes(node.attribute)):
+            self.sink.add_bytes(f"{node_dir}/attributes/f_{idx}/0.bin", attr_bytes)
         # 写入geometry 0.bin
-        with open(os.path.join(geometries_dir, "0.bin"), "ab") as fp:
-            fp.write(node.polymesh_header_data)
-            for position in node.polymesh_position_bytes:
-                fp.write(position)
-            for normal in node.polymesh_normal_bytes:
-                fp.write(normal)
-            for uv in node.polymesh_uv_bytes:
-                fp.write(uv)
-            for color in node.polymesh_color_bytes:
-                fp.write(color)
-            for uvregion in node.polymesh_uvregion_bytes:
-                fp.write(uvregion)
-            for feature_id in node.feature_id_bytes:
-                fp.write(feature_id)
-            for face_range in node.face_range_bytes:
-                fp.write(face_range)
-        # Draco压缩
-        model = os.path.join(geometries_dir, "1.bin")
-        draco_encoder = os.path.join(
-            work_path,
-            "../thirdparty/draco_encoder.exe",
-        )
-        if config["use_deck"]:
-            res = Writer.exec_cmd(
-                rf'"{draco_encoder}" -i "{bindoc_dir}" -o "{model}" --t {0} --use-deck'
-            )
-
-        else:
-            # pass  # TODO: 调整draco以适配arcgis前端，目前使用0.bin
-            res = Writer.exec_cmd(
-                rf'"{draco_encoder}" -i "{bindoc_dir}" -o "{model}" --t {1}'
-            )
-        # print(res)
-        if "Failed" in res:
+        self.sink.add_bytes(f"{node_dir}/geometries/0.bin", buffer)
+        # 写入draco压缩后的1.bin
+        if geometry is None:
             logger.warning(f"Failed to draco")
+            return
+        self.sink.add_bytes(f"{node_dir}/geometries/1.bin", geometry)
 
     def finish(self):
         """
-        打包为 slpk 文件
+        写出所有在途的条目，完成 slpk 文件
         :return: None
         """
-        logger.info("start compress files.")
-        task_list = []
-        with ThreadPoolExecutor(max_workers=config["max_worker"]) as t:
-            for root, ds, fs in os.walk(self.slpk_root):
-                for f in fs:
-                    task_list.append(t.submit(compress_to_gz, os.path.join(root, f)))
-                # if f != "metadata.json":
-                # compress_to_gz(os.path.join(root, f))
-        # wait thread complete
-        as_completed(task_list)
-
+        self.sink.close()
         if not config["server"]["is_server"]:
-            logger.info("start build slpk file.")
-            build_slpk(
-                os.path.join(config["output_file_root"], f"{os.path.splitext(self.slpk.name)[0]}.slpk"),
-                self.slpk_root,
-            )
             logger.info(f"build slpk file success. output to : {self.slpk_root}.slpk")
 
     # for test, upload slpk file to test server.
@@ -456,9 +549,65 @@ class Writer:
         else:
             logger.error("upload failed.")
 
+    def transcode_texture(self, path: str) -> Optional[bytes]:
+        with self.profiler.stage("texture") as s:
+            blob_data = self.texture_engine.get(path)
+            if blob_data is not None:
+                s.add(len(blob_data), 1)
+        return blob_data
+
+    def is_done(self, key: str) -> bool:
+        return self.checkpoint is not None and self.checkpoint.is_done(key)
+
+    def checkpointed(self, key: str, fn: Callable, *args):
+        """
+        执行上传任务，成功后记录到断点中
+        """
+        res = fn(*args)
+        if res is not False and self.checkpoint:
+            self.checkpoint.mark(key)
+        return res
+
+    def submit_once(self, key: str, fn: Callable, *args, **kwargs):
+        """
+        通过流水线提交上传任务，断点中已记录的任务直接跳过
+        """
+        if self.is_done(key):
+            return None
+        return self.pipeline.submit(self.checkpointed, key, fn, *args, **kwargs)
+
+    def texture_size(self, node: MergedNode) -> int:
+        return self.texture_engine.size_hint(node.diffuse_map[0]) if node.has_texture else 0
+
+    @staticmethod
+    def json_size(data) -> int:
+        """
+        json 数据上传时的请求体大小，计入流水线的在途字节数
+        """
+        return len(json.dumps(data, ensure_ascii=False).encode())
+
+    @staticmethod
+    def attribute_size(attribute: Optional[dict]) -> int:
+        """
+        节点属性编码后的字节数(见 `utils/attribute_codec.py`)，不实际编码
+        """
+        if not attribute:
+            return 0
+        size = 0
+        for attribute_id, byte_counts in enumerate(attribute["size_bytes"]):
+            size += 4 + 4 * len(byte_counts) if attribute_id == 0 else 8 + 4 * len(byte_counts) + sum(byte_counts)
+        return size
+
+    @staticmethod
+    def release_merged_node(sublayer: Sublayer, index: int):
+        """
+        节点上传完成后释放其缓冲区
+        """
+        sublayer.merged_nodes[index] = None
+
     @staticmethod
-    def exec_cmd(cmd):
-        r = os.popen(cmd)
-        text = r.read()
-        r.close()
-        return text
+    def geometry_buffer(node: MergedNode, layout) -> bytearray:
+        """
+        按 layout 在内存中组装 geometry 0.bin
+        """
+        return geometry_buffer.assemble(node.polymesh_header_data, (getattr(node, name) for name in layout))
@@ -0,0 +1,132 @@
+"""
+节点属性二进制缓存
+
+`attributes/f_N/0` 请求原先每次读取节点的整个 attribute JSONB，再逐个值拼接出 I3S 属性二进制。
+现在某个节点的属性首次被请求时，用一次查询读取该节点的 attribute，将所有字段一次性编码为连续的 bytes
+(`utils/attribute_codec.py`，与 converter 的编码逐字节一致)放入 LRU 缓存，之后该节点各字段的请求直接返回缓存的 bytes。
+
+缓存的 key 为 (project_id, model_file_id, 版本, sublayer_index, node_index, attribute_id)，
+节点属性被写入(重新转换、增量复用、修改单个节点)时递增模型文件的版本，旧版本的缓存不再被访问，由 LRU 淘汰。
+版本号保存在数据库中，各 worker 进程共享，见 `db_manager/cache_version.py`；
+只清除单个节点无法通知其他 worker，因此修改单个节点时也使整个模型文件的属性缓存失效。
+
+批量请求(`get_attribute_buffers`)中未命中的节点按子层合并为一次 `node_index = ANY(...)` 查询。
+
+相关配置(`config["model"]`)：
+
+- `attribute_cache_size`: 缓存的最大字段数，默认 32768，为 0 时不缓存
+- `attribute_cache_ttl`: 过期时间，单位秒，默认 300
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from config import config
+from db_manager.cache_version import bump_version, get_version
+from db_model.common import SessionDispatcher
+from utils.attribute_codec import encode_attributes
+from utils.cache import LRUCache
+
+CACHE_NAME = "attribute"
+
+_cache: Optional[LRUCache] = None
+
+
+def get_attribute_cache() -> LRUCache:
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(
+            config["model"].get("attribute_cache_size", 32768),
+            config["model"].get("attribute_cache_ttl", 300),
+        )
+    return _cache
+
+
+async def invalidate_attributes(project_id: int, model_file_id: int):
+    """
+    节点属性被写入后调用
+    """
+    await bump_version(project_id, model_file_id, CACHE_NAME)
+
+
+async def load_attribute(project_id: int, model_file_id: int, sublayer_index: int,
+                         node_index: int) -> Optional[dict]:
+    """
+    :return: 节点的 attribute，节点不存在时返回 None
+    """
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        # 表名只由整数拼接，node_index 作为绑定参数传入
+        sql = f"SELECT attribute FROM \"{int(model_file_id)}_{int(sublayer_index)}_NODE_VERSION\" " \
+              f"WHERE node_index = :node_index"
+        row = (await session.execute(text(sql), {"node_index": node_index})).first()
+    return row.attribute if row else None
+
+
+async def load_attributes(project_id: int, model_file_id: int, sublayer_index: int,
+                          node_indexes: List[int]) -> Dict[int, dict]:
+    """
+    一次查询读取子层多个节点的 attribute
+    :return: {node_index: attribute}，不存在的节点不在结果中
+    """
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        sql = f"SELECT node_index, attribute FROM \"{int(model_file_id)}_{int(sublayer_index)}_NODE_VERSION\" " \
+              f"WHERE node_index = ANY(:node_indexes)"
+        rows = (await session.execute(text(sql), {"node_indexes": list(node_indexes)})).all()
+    return {row.node_index: row.attribute for row in rows}
+
+
+def _node_key(project_id: int, model_file_id: int, version: int, sublayer_index: int, node_index: int) -> tuple:
+    return project_id, model_file_id, version, sublayer_index, node_index
+
+
+def _put_buffers(node_key: tuple, attribute: Optional[dict]) -> List[bytes]:
+    if not attribute:
+        return []
+    buffers = encode_attributes(attribute)
+    cache = get_attribute_cache()
+    for i, field_buffer in enumerate(buffers):
+        cache.put(node_key + (i,), field_buffer)
+    return buffers
+
+
+async def get_attribute_buffer(project_id: int, model_file_id: int, sublayer_index: int, node_index: int,
+                               attribute_id: int) -> Optional[bytes]:
+    """
+    :return: 节点第 attribute_id 个字段的属性二进制，节点或字段不存在时返回 None
+    """
+    version = await get_version(project_id, model_file_id, CACHE_NAME)
+    node_key = _node_key(project_id, model_file_id, version, sublayer_index, node_index)
+    buffer = get_attribute_cache().get(node_key + (attribute_id,))
+    if buffer is not None:
+        return buffer
+
+    buffers = _put_buffers(node_key, await load_attribute(project_id, model_file_id, sublayer_index, node_index))
+    return buffers[attribute_id] if 0 <= attribute_id < len(buffers) else None
+
+
+async def get_attribute_buffers(project_id: int, model_file_id: int, sublayer_index: int,
+                                fields: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], Optional[bytes]]:
+    """
+    批量获取同一子层多个节点的字段，未命中缓存的节点用一次查询读取
+    :param fields: (node_index, attribute_id)
+    :return: {(node_index, attribute_id): 属性二进制}，节点或字段不存在时为 None
+    """
+    cache = get_attribute_cache()
+    version = await get_version(project_id, model_file_id, CACHE_NAME)
+    result: Dict[Tuple[int, int], Optional[bytes]] = {}
+    missing: Dict[int, List[int]] = {}
+    for node_index, attribute_id in fields:
+        buffer = cache.get(_node_key(project_id, model_file_id, version, sublayer_index, node_index) + (attribute_id,))
+        result[(node_index, attribute_id)] = buffer
+        if buffer is None:
+            missing.setdefault(node_index, []).append(attribute_id)
+    if not missing:
+        return result
+
+    attributes = await load_attributes(project_id, model_file_id, sublayer_index, list(missing))
+    for node_index, attribute_ids in missing.items():
+        node_key = _node_key(project_id, model_file_id, version, sublayer_index, node_index)
+        buffers = _put_buffers(node_key, attributes.get(node_index))
+        for attribute_id in attribute_ids:
+            result[(node_index, attribute_id)] = buffers[attribute_id] if 0 <= attribute_id < len(buffers) else None
+    return result
@@ -0,0 +1,119 @@
+"""
+SceneServer 节点资源的批量获取
+
+前端原先每个节点的 geometry、纹理及每个属性字段(`attributes/f_N/0`)各发一次请求，节点多而小的模型
+请求开销远大于数据本身。批量接口一次接收多个 (sublayer, node, resource)，返回一个按长度分帧的二进制流：
+
+- 属性：按子层分组，未命中缓存的节点每个子层一次 `node_index = ANY(...)` 查询(`db_manager/attribute_cache.py`)
+- 文件(geometry、纹理)：uuid 只解析一次，按路径排序后依次读取
+
+响应格式(小端)，每个资源一帧：`index: uint32`(资源在请求中的序号)、`length: int32`(资源不存在时为 -1)，
+随后 length 个字节。帧的顺序与请求顺序不一定一致：属性先返回，文件按路径顺序返回，客户端按 index 还原。
+
+resource 与单个资源接口的路径后缀一致：`geometries/{n}`、`textures/0_0_1`、`attributes/f_{n}/0`
+
+相关配置(`config["model"]`)：
+
+- `batch_max_items`: 单次请求的最大资源数，默认 1024
+"""
+import os
+import re
+import struct
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from db_manager.attribute_cache import get_attribute_buffers
+
+GEOMETRY_PATTERN = re.compile(r"^geometries/(\d+)$")
+TEXTURE_PATTERN = re.compile(r"^textures/0_0_1$")
+ATTRIBUTE_PATTERN = re.compile(r"^attributes/f_(\d+)/0$")
+
+FRAME_HEADER = struct.Struct("<Ii")
+MISSING = -1
+
+
+class BatchItem(NamedTuple):
+    sublayer_index: int
+    node_index: int
+    resource: str
+
+
+def batch_max_items() -> int:
+    return config["model"].get("batch_max_items", 1024)
+
+
+def frame(index: int, data: Optional[bytes]) -> bytes:
+    if data is None:
+        return FRAME_HEADER.pack(index, MISSING)
+    return FRAME_HEADER.pack(index, len(data)) + data
+
+
+def node_file_path(slpk_uuid: str, item: BatchItem) -> Optional[str]:
+    """
+    :return: geometry、纹理文件的绝对路径，其他资源返回 None
+    """
+    node_dir = os.path.join(config["model"]["slpk_root"], slpk_uuid, "sublayers", f"{item.sublayer_index}",
+                            "nodes", f"{item.node_index}")
+    match = GEOMETRY_PATTERN.match(item.resource)
+    if match:
+        return os.path.join(node_dir, "geometries", f"{int(match.group(1))}.bin")
+    if TEXTURE_PATTERN.match(item.resource):
+        return os.path.join(node_dir, "textures", "0_0_1.bin.dds")
+    return None
+
+
+def validate_items(items: List[BatchItem]):
+    """
+    :raise ValueError: 资源数超过限制或 resource 不支持
+    """
+    if len(items) > batch_max_items():
+        raise ValueError(f"too many items: {len(items)} > {batch_max_items()}")
+    for item in items:
+        if not (GEOMETRY_PATTERN.match(item.resource) or TEXTURE_PATTERN.match(item.resource)
+                or ATTRIBUTE_PATTERN.match(item.resource)):
+            raise ValueError(f"unsupported resource: {item.resource}")
+
+
+async def resolve_attributes(project_id: int, model_file_id: int,
+                             items: List[BatchItem]) -> Dict[int, Optional[bytes]]:
+    """
+    :return: {请求中的序号: 属性二进制}
+    """
+    by_sublayer: Dict[int, List[Tuple[int, int, int]]] = {}
+    for index, item in enumerate(items):
+        match = ATTRIBUTE_PATTERN.match(item.resource)
+        if match:
+            by_sublayer.setdefault(item.sublayer_index, []).append((index, item.node_index, int(match.group(1))))
+
+    result: Dict[int, Optional[bytes]] = {}
+    for sublayer_index, fields in by_sublayer.items():
+        buffers = await get_attribute_buffers(project_id, model_file_id, sublayer_index,
+                                              [(node_index, attribute_id) for _, node_index, attribute_id in fields])
+        for index, node_index, attribute_id in fields:
+            result[index] = buffers[(node_index, attribute_id)]
+    return result
+
+
+def read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+async def iter_batch(project_id: int, model_file_id: int, slpk_uuid: str,
+                     items: List[BatchItem]) -> AsyncIterator[bytes]:
+    attributes = await resolve_attributes(project_id, model_file_id, items)
+    if attributes:
+        yield b"".join(frame(index, data) for index, data in attributes.items())
+
+    files = []
+    for index, item in enumerate(items):
+        path = node_file_path(slpk_uuid, item)
+        if path is not None:
+            files.append((path, index))
+    for path, index in sorted(files):
+        yield frame(index, await run_in_threadpool(read_file, path))
@@ -0,0 +1,105 @@
+"""
+各 worker 进程共享的缓存版本
+
+模型文件、nodepage、节点属性的缓存保存在各 worker 进程内，写入后只能清除本进程的缓存。
+现在版本号保存在主库的 `cache_version` 表中，每个 (project_id, model_file_id, 缓存名) 一行，写入时在数据库中递增；
+查询缓存前先读取版本号，版本号是缓存 key 的一部分，任一 worker 写入后其他 worker 的旧条目不再被访问，由 LRU 淘汰。
+
+读取到的版本号在进程内保留 `cache_version_ttl` 秒，避免每次查询缓存都访问数据库，
+即其他 worker 写入后，本进程最多经过这段时间读到新数据；本进程的写入立即生效。
+
+相关配置(`config["model"]`)：
+
+- `cache_version_size`: 进程内保留的版本号数，默认 65536
+- `cache_version_ttl`: 版本号在进程内的有效期，单位秒，默认 1；为 0 时每次查询缓存都读取数据库
+"""
+import threading
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from config import config
+from db_model.common import SessionDispatcher
+from db_model.project import CacheVersion
+from utils.cache import LRUCache
+
+_cache: Optional[LRUCache] = None
+_lock = threading.Lock()
+_table_created = False
+
+
+def get_version_cache() -> LRUCache:
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(
+            config["model"].get("cache_version_size", 65536),
+            config["model"].get("cache_version_ttl", 1),
+        )
+    return _cache
+
+
+async def _ensure_table():
+    """
+    首次访问时建表，与调度器的队列表一致
+    """
+    global _table_created
+    if not _table_created:
+        async with SessionDispatcher().get_async_engine().begin() as conn:
+            await conn.run_sync(CacheVersion.__table__.create, checkfirst=True)
+        _table_created = True
+
+
+async def load_version(project_id: int, model_file_id: int, name: str) -> int:
+    """
+    :return: 数据库中的版本号，没有记录时为 0
+    """
+    await _ensure_table()
+    async with SessionDispatcher().get_async_session() as session:
+        result = await session.execute(select(CacheVersion.version).filter(
+            CacheVersion.project_id == project_id, CacheVersion.model_file_id == model_file_id,
+            CacheVersion.name == name,
+        ))
+        return result.scalar() or 0
+
+
+async def increment_version(project_id: int, model_file_id: int, name: str) -> int:
+    """
+    在数据库中原子地递增版本号
+    :return: 递增后的版本号
+    """
+    await _ensure_table()
+    stmt = insert(CacheVersion).values(project_id=project_id, model_file_id=model_file_id, name=name, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CacheVersion.project_id, CacheVersion.model_file_id, CacheVersion.name],
+        set_={"version": CacheVersion.version + 1},
+    ).returning(CacheVersion.version)
+    async with SessionDispatcher().get_async_session() as session:
+        version = (await session.execute(stmt)).scalar()
+        await session.commit()
+    return version
+
+
+def _remember(key: tuple, version: int):
+    # 并发时先发起的读取可能晚于递增返回，不用较旧的版本号覆盖
+    cache = get_version_cache()
+    with _lock:
+        cache.put(key, max(version, cache.get(key, 0)))
+
+
+async def get_version(project_id: int, model_file_id: int, name: str) -> int:
+    key = (project_id, model_file_id, name)
+    version = get_version_cache().get(key)
+    if version is None:
+        version = await load_version(project_id, model_file_id, name)
+        _remember(key, version)
+    return version
+
+
+async def bump_version(project_id: int, model_file_id: int, name: str) -> int:
+    """
+    数据被写入后调用，使所有 worker 中该缓存的旧条目失效
+    """
+    version = await increment_version(project_id, model_file_id, name)
+    _remember((project_id, model_file_id, name), version)
+    return version
@@ -0,0 +1,420 @@
+"""
+转换任务调度
+
+转换任务不再直接进入 celery 的单一 FIFO 队列，而是先在 model manager 中排队，由调度器按以下规则分发：
+
+- 根据 `tmp_file_size` 与历史转换速度估算任务耗时，超过阈值的为大任务
+- 大、小任务分别发送到 `convert_large`、`convert_small` 两个 celery 队列，各自限制同时运行的数量，
+  小任务不会排在大任务之后；小任务队列空闲时大任务可以借用小任务的名额
+- 同一类任务中按项目公平分配：每个项目累计已分发任务的估算耗时，优先分发累计值最小的项目，
+  项目内估算耗时短的任务优先
+- 小任务到达而名额被借用时，可以抢占(撤销)借用名额的大任务，大任务退还累计值后重新排队，
+  重新分发后从断点继续(需 converter 开启断点)
+
+调度状态(等待与运行中的任务、各项目的累计值)保存在全局数据库的 `convert_queue`、`convert_usage` 表中，
+多个 worker 进程共享同一份状态。每次调度操作在一个事务中完成，并通过 `pg_advisory_xact_lock` 互斥：
+
+- converter 上报的状态由任一 worker 处理都能释放名额
+- 服务重启后等待队列与运行中的任务保留，由定时回收(`reclaim`)继续分发
+- converter 在转换过程中定期上报 processing 状态(converter 配置 `model_manager.heartbeat_interval`)，
+  运行中的任务超过 `running_timeout` 未收到上报(如 worker 被 OOM 杀死)时撤销并重新排队，
+  回收超过 `max_reclaims` 次的任务不再重试，模型文件置为 fail
+
+调度操作会阻塞地访问数据库与 celery broker，路由中需通过 `run_in_threadpool` 调用。
+历史转换速度只用于估算，各进程分别学习。
+
+converter worker 监听的队列由 converter 配置中的 `celery.queues` 决定，默认包括 `convert_small`、`convert_large`。
+
+相关配置(`config["scheduler"]`)：
+
+- `large_file_size`: 大任务的文件大小阈值，单位 bytes，默认 200MB
+- `small_slots`、`large_slots`: 小、大任务同时运行的数量，默认 4、1
+- `preempt`: 是否抢占借用名额的大任务，默认 False
+- `seconds_per_mb`: 初始的转换速度，单位 秒/MB，默认 2
+- `running_timeout`: 运行中的任务多久未上报视为失联，单位秒，默认 1800
+- `max_reclaims`: 失联任务的最大回收次数，默认 2
+- `reclaim_interval`: 定时回收的间隔，单位秒，默认 60
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from config import config, logger
+from db_manager.model_manager import celery_app, set_convert_progress
+from db_model.common import SessionDispatcher, search_one_in_db, update_one_in_db
+from db_model.project import ConvertQueue, ConvertUsage
+from db_model.slpk_model import ModelFile
+
+SMALL = "small"
+LARGE = "large"
+PENDING = "pending"
+RUNNING = "running"
+# 调度操作的 advisory lock，所有 worker 进程共用
+LOCK_KEY = 2108_0016
+
+
+class QueueState:
+    """
+    一次调度操作中的队列状态，由 `ConvertScheduler.transaction` 在事务中读取，操作结束后写回数据库；
+    调度规则只修改这里的数据，不直接访问数据库
+    """
+
+    def __init__(self, tasks: Iterable[ConvertQueue] = (), usage: Dict[int, float] = None):
+        self.pending: Dict[str, List[ConvertQueue]] = {SMALL: [], LARGE: []}
+        self.running: Dict[Tuple[int, int], ConvertQueue] = {}
+        for task in sorted(tasks, key=lambda t: t.submit_time):
+            if task.state == RUNNING:
+                self.running[task.key] = task
+            else:
+                self.pending[task.kind].append(task)
+        # 各项目累计分发的估算耗时，用于公平分配
+        self.usage: Dict[int, float] = dict(usage or {})
+        self.added: List[ConvertQueue] = []
+        self.removed: List[ConvertQueue] = []
+        # 回收次数用尽的任务，事务提交后将模型文件置为 fail
+        self.failed: List[ConvertQueue] = []
+
+    def find_pending(self, project_id: int, model_file_id: int) -> Optional[ConvertQueue]:
+        for tasks in self.pending.values():
+            for task in tasks:
+                if task.key == (project_id, model_file_id):
+                    return task
+        return None
+
+    def add(self, task: ConvertQueue):
+        self.pending[task.kind].append(task)
+        self.added.append(task)
+
+    def remove(self, task: ConvertQueue):
+        if task in self.added:
+            self.added.remove(task)
+        else:
+            self.removed.append(task)
+
+
+class ConvertScheduler:
+    def __init__(self, celery_app):
+        scheduler_config = config.get("scheduler", {})
+        self.celery_app = celery_app
+        self.large_file_size = scheduler_config.get("large_file_size", 200 << 20)  # 单位 bytes
+        self.slots = {
+            SMALL: scheduler_config.get("small_slots", 4),
+            LARGE: scheduler_config.get("large_slots", 1),
+        }
+        self.preempt = scheduler_config.get("preempt", False)
+        # 历史平均转换速度，单位 秒/MB，按指数滑动平均更新
+        self.seconds_per_mb = scheduler_config.get("seconds_per_mb", 2.0)
+        self.running_timeout = scheduler_config.get("running_timeout", 1800)
+        self.max_reclaims = scheduler_config.get("max_reclaims", 2)
+        self.reclaim_interval = scheduler_config.get("reclaim_interval", 60)
+        self.tables_created = False
+
+    def estimate(self, size: Optional[int]) -> float:
+        """
+        :return: 估算的转换耗时，单位秒
+        """
+        return (size or 0) / (1 << 20) * self.seconds_per_mb
+
+    @contextmanager
+    def transaction(self) -> Iterator[QueueState]:
+        """
+        在事务中读取队列状态，with 块结束后写回；同一时刻只有一个调度操作在进行
+        """
+        session = SessionDispatcher().get_session()
+        try:
+            session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+            if not self.tables_created:
+                for table in (ConvertQueue.__table__, ConvertUsage.__table__):
+                    table.create(session.connection(), checkfirst=True)
+                self.tables_created = True
+            state = QueueState(
+                session.query(ConvertQueue).all(),
+                {row.project_id: row.usage for row in session.query(ConvertUsage).all()},
+            )
+            usage = dict(state.usage)
+            yield state
+            # 运行中任务的修改由 session 跟踪，这里只需写回新增、删除的任务及累计值
+            session.add_all(state.added)
+            for task in state.removed:
+                session.delete(task)
+            for project_id, value in state.usage.items():
+                if usage.get(project_id) != value:
+                    session.merge(ConvertUsage(project_id=project_id, usage=value))
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.remove()
+        self._fail_model_files(state.failed)
+
+    def _ensure_tables(self):
+        if not self.tables_created:
+            with self.transaction():
+                pass
+
+    def submit(self, project_id: int, model_file_id: int, uuid: str, size: Optional[int]):
+        """
+        加入等待队列并尝试分发；模型文件已在等待队列中(重新上传后再次发起转换)时替换原有的任务
+        """
+        now = time.time()
+        with self.transaction() as state:
+            self._cancel(state, project_id, model_file_id, running=False)
+            self._submit(state, project_id, model_file_id, uuid, size, now)
+            self._reclaim(state, now)
+            self._dispatch(state, now)
+
+    def finish(self, project_id: int, model_file_id: int, duration: Optional[int] = None):
+        """
+        转换结束(成功或失败)时调用，释放名额并分发后续任务
+        :param duration: 成功时的转换耗时，用于更新历史转换速度
+        """
+        now = time.time()
+        with self.transaction() as state:
+            self._finish(state, project_id, model_file_id, duration)
+            self._reclaim(state, now)
+            self._dispatch(state, now)
+
+    def report(self, project_id: int, model_file_id: int):
+        """
+        converter 上报 processing 状态时调用，刷新任务的上报时间
+        """
+        self._ensure_tables()
+        session = SessionDispatcher().get_session()
+        try:
+            session.query(ConvertQueue).filter_by(
+                project_id=project_id, model_file_id=model_file_id, state=RUNNING
+            ).update({"report_time": time.time()}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.remove()
+
+    def reclaim(self):
+        """
+        回收失联的任务并分发等待中的任务，定时调用
+        """
+        now = time.time()
+        with self.transaction() as state:
+            self._reclaim(state, now)
+            self._dispatch(state, now)
+
+    def cancel(self, project_id: int, model_file_id: int) -> bool:
+        """
+        取消模型文件的转换任务：等待中的任务移出队列，运行中的任务撤销并释放名额
+        :return: 是否有被取消的任务
+        """
+        now = time.time()
+        with self.transaction() as state:
+            cancelled = self._cancel(state, project_id, model_file_id)
+            self._dispatch(state, now)
+        return cancelled
+
+    def position(self, project_id: int, model_file_id: int) -> Optional[dict]:
+        """
+        :return: 任务在其队列中的分发顺序(从 1 开始)及预计等待时间，任务不在等待队列中时返回 None
+        """
+        self._ensure_tables()
+        session = SessionDispatcher().get_session()
+        try:
+            state = QueueState(
+                session.query(ConvertQueue).all(),
+                {row.project_id: row.usage for row in session.query(ConvertUsage).all()},
+            )
+        finally:
+            session.remove()
+        return self._position(state, project_id, model_file_id)
+
+    def _submit(self, state: QueueState, project_id: int, model_file_id: int, uuid: str, size: Optional[int],
+                now: float):
+        if (project_id, model_file_id) in state.running or state.find_pending(project_id, model_file_id):
+            logger.warning(f"convert task of model_file_id: {model_file_id} already scheduled.")
+            return
+        kind = LARGE if (size or 0) >= self.large_file_size else SMALL
+        task = ConvertQueue(
+            project_id=project_id, model_file_id=model_file_id, uuid=uuid, size=size or 0,
+            cost=self.estimate(size), kind=kind, state=PENDING, borrowed=False, reclaimed=0, submit_time=now,
+        )
+        # 新项目从当前最小的累计值开始，不因为之前空闲而长期优先
+        state.usage.setdefault(project_id, min(state.usage.values(), default=0))
+        state.add(task)
+        logger.info(f"convert task queued: model_file_id: {model_file_id}, {kind}, estimate {task.cost:.0f}s")
+
+    def _cancel(self, state: QueueState, project_id: int, model_file_id: int, running: bool = True) -> bool:
+        task = state.find_pending(project_id, model_file_id)
+        if task:
+            state.pending[task.kind].remove(task)
+        elif running:
+            task = state.running.pop((project_id, model_file_id), None)
+            if task is None:
+                return False
+            self._revoke(task)
+            # 未完成的任务退还累计值
+            state.usage[task.project_id] = state.usage.get(task.project_id, 0) - task.cost
+        else:
+            return False
+        state.remove(task)
+        logger.info(f"convert task cancelled: model_file_id: {model_file_id}")
+        return True
+
+    def _finish(self, state: QueueState, project_id: int, model_file_id: int, duration: Optional[int]):
+        task = state.running.pop((project_id, model_file_id), None)
+        if task is None:
+            return
+        state.remove(task)
+        if duration and task.size:
+            rate = duration / max(task.size / (1 << 20), 1e-3)
+            self.seconds_per_mb = 0.8 * self.seconds_per_mb + 0.2 * rate
+
+    def _reclaim(self, state: QueueState, now: float):
+        """
+        撤销超时未上报的任务，释放名额；回收次数用尽的任务不再重试
+        """
+        for task in list(state.running.values()):
+            last_report = task.dispatch_time if task.report_time is None else task.report_time
+            if now - last_report <= self.running_timeout:
+                continue
+            self._revoke(task)
+            del state.running[task.key]
+            state.usage[task.project_id] = state.usage.get(task.project_id, 0) - task.cost
+            task.reclaimed += 1
+            if task.reclaimed > self.max_reclaims:
+                state.remove(task)
+                state.failed.append(task)
+                logger.error(f"convert task lost, give up: model_file_id: {task.model_file_id}")
+                continue
+            task.state = PENDING
+            task.borrowed = False
+            task.task_id = None
+            state.pending[task.kind].append(task)
+            logger.warning(f"convert task lost, requeued: model_file_id: {task.model_file_id}, "
+                           f"no report for {now - last_report:.0f}s")
+
+    def _position(self, state: QueueState, project_id: int, model_file_id: int) -> Optional[dict]:
+        task = state.find_pending(project_id, model_file_id)
+        if task is None:
+            return None
+        order = self._order(state, task.kind)
+        position = order.index(task) + 1
+        ahead = sum(t.cost for t in order[:position - 1])
+        ahead += sum(t.cost for t in state.running.values() if t.kind == task.kind)
+        return {
+            "queue": task.kind,
+            "position": position,
+            "estimated_wait": round(ahead / self.slots[task.kind]),
+            "estimated_cost": round(task.cost),
+        }
+
+    def _order(self, state: QueueState, kind: str) -> List[ConvertQueue]:
+        """
+        模拟按项目公平分配的分发顺序
+        """
+        usage = dict(state.usage)
+        tasks = list(state.pending[kind])
+        order = []
+        while tasks:
+            task = min(tasks, key=lambda t: (usage.get(t.project_id, 0), t.cost, t.submit_time))
+            usage[task.project_id] = usage.get(task.project_id, 0) + task.cost
+            tasks.remove(task)
+            order.append(task)
+        return order
+
+    def _running_count(self, state: QueueState, kind: str, borrowed: bool = False) -> int:
+        return sum(1 for t in state.running.values() if t.kind == kind and t.borrowed == borrowed)
+
+    def _free_slots(self, state: QueueState, kind: str) -> int:
+        used = self._running_count(state, kind)
+        if kind == SMALL:
+            used += self._running_count(state, LARGE, borrowed=True)
+        return self.slots[kind] - used
+
+    def _dispatch(self, state: QueueState, now: float):
+        while state.pending[SMALL] and self._free_slots(state, SMALL) <= 0 and self.preempt \
+                and self._preempt_one(state):
+            pass
+        while state.pending[SMALL] and self._free_slots(state, SMALL) > 0:
+            if not self._send(state, self._order(state, SMALL)[0], False, now):
+                return
+        while state.pending[LARGE] and self._free_slots(state, LARGE) > 0:
+            if not self._send(state, self._order(state, LARGE)[0], False, now):
+                return
+        # 小任务队列空闲时，大任务借用小任务的名额
+        while state.pending[LARGE] and not state.pending[SMALL] and self._free_slots(state, SMALL) > 0:
+            if not self._send(state, self._order(state, LARGE)[0], True, now):
+                return
+
+    def _send(self, state: QueueState, task: ConvertQueue, borrowed: bool, now: float) -> bool:
+        """
+        :return: 是否发送成功；broker 不可用时任务留在等待队列中，由之后的调度操作重试
+        """
+        # 借用名额的大任务由小任务队列的 worker 执行
+        queue = f"convert_{SMALL if borrowed else task.kind}"
+        try:
+            result = self.celery_app.send_task(
+                "src.api.start_convert",
+                args=[task.uuid, task.project_id, task.model_file_id],
+                queue=queue,
+            )
+        except Exception as e:
+            logger.error(f"fail to dispatch convert task, model_file_id: {task.model_file_id}: {e}")
+            return False
+        state.pending[task.kind].remove(task)
+        task.state = RUNNING
+        task.borrowed = borrowed
+        task.task_id = result.id
+        task.dispatch_time = now
+        task.report_time = None
+        state.running[task.key] = task
+        state.usage[task.project_id] = state.usage.get(task.project_id, 0) + task.cost
+        logger.info(f"convert task dispatched: model_file_id: {task.model_file_id}, queue: {queue}, "
+                    f"waited {now - task.submit_time:.0f}s")
+        return True
+
+    def _revoke(self, task: ConvertQueue):
+        if not task.task_id:
+            return
+        try:
+            self.celery_app.control.revoke(task.task_id, terminate=True)
+        except Exception as e:
+            logger.warning(f"fail to revoke convert task `{task.task_id}`: {e}")
+
+    def _preempt_one(self, state: QueueState) -> bool:
+        """
+        撤销一个借用小任务名额的大任务，放回大任务队列
+        """
+        borrowed = [t for t in state.running.values() if t.kind == LARGE and t.borrowed]
+        if not borrowed:
+            return False
+        # 撤销最晚分发的，已完成的工作最少
+        task = max(borrowed, key=lambda t: t.dispatch_time)
+        self._revoke(task)
+        del state.running[task.key]
+        state.usage[task.project_id] = state.usage.get(task.project_id, 0) - task.cost
+        task.state = PENDING
+        task.task_id = None
+        task.borrowed = False
+        state.pending[LARGE].append(task)
+        logger.info(f"convert task preempted: model_file_id: {task.model_file_id}")
+        return True
+
+    def _fail_model_files(self, tasks: List[ConvertQueue]):
+        for task in tasks:
+            set_convert_progress(task.project_id, task.model_file_id)
+            session = SessionDispatcher().get_session(f"proj_{task.project_id}")
+            try:
+                mf = search_one_in_db(session, ModelFile, id=task.model_file_id)
+                if mf and mf.state in ("waiting", "processing"):
+                    update_one_in_db(session, mf, True, state="fail")
+            finally:
+                session.remove()
+
+
+_scheduler = None
+
+
+def get_convert_scheduler() -> ConvertScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ConvertScheduler(celery_app)
+    return _scheduler
@@ -0,0 +1,160 @@
+"""
+模型文件元数据缓存
+
+SceneServer 的 layer、metadata、sublayer、ClassAttribute 等接口原先每次请求都要依次查询 ModelFile、
+SublayerVersion(`id IN sublayer_version_id`)、SublayerInfoVersion/SublayerMetaVersion，返回数据前需要三到四次数据库往返。
+
+现在每个模型文件缓存一个 `ResolvedModelFile`：layer、meta 以及子层序号 → 各版本记录的 id 与内容，
+未命中时用一次查询(ModelFile 外连接各版本表)加载，命中时不访问数据库。
+nodepage 的内容较大，仍由 `db_manager/nodepage_cache.py` 按页缓存，这里只保存其记录 id。
+
+以下写入后需调用 `invalidate_model_file`：
+
+- `save_attribute_to_db` 写入 layer、metadata、sublayer、nodepage、sublayer meta
+- `update_class_attribute` 修改子层的类属性
+- `set_model_transform` 修改 layer 与子层范围
+
+缓存的 key 为 (project_id, model_file_id, 版本)，写入时递增版本，正在加载的旧数据不会覆盖新版本。
+版本号保存在数据库中，各 worker 进程共享，见 `db_manager/cache_version.py`。
+
+相关配置(`config["model"]`)：
+
+- `model_file_cache_size`: 缓存的模型文件数，默认 1024，为 0 时不缓存
+- `model_file_cache_ttl`: 过期时间，单位秒，默认 300
+"""
+import asyncio
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import any_, select
+
+from config import config
+from db_manager.cache_version import bump_version, get_version
+from db_model.common import SessionDispatcher
+from db_model.slpk_model import ModelFile, LayerVersion, MetaVersion, SublayerVersion, SublayerInfoVersion, \
+    SublayerMetaVersion
+from utils.cache import LRUCache
+
+CACHE_NAME = "model_file"
+
+_cache: Optional[LRUCache] = None
+_lock = threading.Lock()
+# 同一模型文件并发未命中时只加载一次
+_load_locks: Dict[tuple, asyncio.Lock] = {}
+
+
+class ResolvedSublayer(NamedTuple):
+    id: int  # SublayerVersion.id
+    sublayer_version_id: Optional[int]
+    sublayer: Optional[dict]
+    sublayer_attribute: Optional[dict]
+    sublayer_meta_version_id: Optional[int]
+    meta: Optional[dict]
+    nodepage_version_id: Optional[int]
+
+
+class ResolvedModelFile(NamedTuple):
+    """
+    缓存的内容在多个请求间共享，使用时不能修改
+    """
+    id: int
+    uuid: str
+    layer_version_id: Optional[int]
+    layer: Optional[dict]
+    meta_version_id: Optional[int]
+    meta: Optional[dict]
+    sublayers: Dict[int, ResolvedSublayer]
+
+
+def get_model_file_cache() -> LRUCache:
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(
+            config["model"].get("model_file_cache_size", 1024),
+            config["model"].get("model_file_cache_ttl", 300),
+        )
+    return _cache
+
+
+async def invalidate_model_file(project_id: int, model_file_id: int):
+    """
+    模型文件的 layer、meta 或子层记录被写入后调用
+    """
+    await bump_version(project_id, model_file_id, CACHE_NAME)
+
+
+async def load_model_file(project_id: int, model_file_id: int) -> Optional[ResolvedModelFile]:
+    """
+    一次查询读取模型文件的 layer、meta 及所有子层，每个子层一行
+    :return: 模型文件不存在时返回 None
+    """
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        result = await session.execute(select(
+            ModelFile.uuid,
+            ModelFile.layer_version_id,
+            LayerVersion.layer,
+            ModelFile.meta_version_id,
+            MetaVersion.meta.label("layer_meta"),
+            SublayerVersion.id.label("sublayer_id"),
+            SublayerVersion.sublayer_index,
+            SublayerVersion.sublayer_version_id,
+            SublayerInfoVersion.sublayer,
+            SublayerInfoVersion.sublayer_attribute,
+            SublayerVersion.sublayer_meta_version_id,
+            SublayerMetaVersion.meta.label("sublayer_meta"),
+            SublayerVersion.nodepage_version_id,
+        ).select_from(ModelFile).
+            outerjoin(LayerVersion, LayerVersion.id == ModelFile.layer_version_id).
+            outerjoin(MetaVersion, MetaVersion.id == ModelFile.meta_version_id).
+            outerjoin(SublayerVersion, SublayerVersion.id == any_(ModelFile.sublayer_version_id)).
+            outerjoin(SublayerInfoVersion, SublayerInfoVersion.id == SublayerVersion.sublayer_version_id).
+            outerjoin(SublayerMetaVersion, SublayerMetaVersion.id == SublayerVersion.sublayer_meta_version_id).
+            filter(ModelFile.id == model_file_id))
+        rows = result.all()
+    if not rows:
+        return None
+
+    sublayers = {
+        row.sublayer_index: ResolvedSublayer(
+            row.sublayer_id, row.sublayer_version_id, row.sublayer, row.sublayer_attribute,
+            row.sublayer_meta_version_id, row.sublayer_meta, row.nodepage_version_id,
+        )
+        for row in rows if row.sublayer_id is not None
+    }
+    first = rows[0]
+    return ResolvedModelFile(model_file_id, first.uuid, first.layer_version_id, first.layer,
+                             first.meta_version_id, first.layer_meta, sublayers)
+
+
+async def get_model_file(project_id: int, model_file_id: int) -> Optional[ResolvedModelFile]:
+    """
+    :return: 模型文件不存在时返回 None，不缓存
+    """
+    cache = get_model_file_cache()
+    version = await get_version(project_id, model_file_id, CACHE_NAME)
+    key = (project_id, model_file_id, version)
+    resolved = cache.get(key)
+    if resolved is not None:
+        return resolved
+
+    with _lock:
+        load_lock = _load_locks.setdefault(key, asyncio.Lock())
+    async with load_lock:
+        resolved = cache.get(key)
+        if resolved is None:
+            resolved = await load_model_file(project_id, model_file_id)
+            if resolved is not None:
+                cache.put(key, resolved)
+    with _lock:
+        _load_locks.pop(key, None)
+    return resolved
+
+
+async def get_sublayer(project_id: int, model_file_id: int, sublayer_index: int) -> Optional[ResolvedSublayer]:
+    """
+    :return: 模型文件或子层不存在时返回 None
+    """
+    resolved = await get_model_file(project_id, model_file_id)
+    if resolved is None:
+        return None
+    return resolved.sublayers.get(sublayer_index)
@@ -1,20 +1,31 @@
 """
 为slpk文件提供增删改查的支持函数
 """
+import json
+import os
+from typing import Optional
 
 from aiohttp import FormData, ClientSession
 from celery import Celery
 
 from config import logger, config
 
+from sqlalchemy import select
+
+from db_model import async_common
 from db_model.common import create_record_in_db, search_one_in_db, SessionDispatcher, update_one_in_db
 from db_model.slpk_model import Model, ModelFile
+from utils.cache import LRUCache
 
 
 celery_app = Celery("celery_app",
                     broker=config["celery"]["broker"],
                     backend=config["celery"]["backend"])
 session_dispatcher = SessionDispatcher.get_instance()
+# 转换进度，由 converter 在 processing 状态下定期上报，key 为 (project_id, model_file_id)
+convert_progress = dict()
+# (project_id, model_file_id) -> uuid，模型文件的 uuid 创建后不再改变，分发 geometry、纹理时不再查询数据库
+uuid_cache = LRUCache(config["model"].get("uuid_cache_size", 65536))
 
 
 def create_model_in_project(
@@ -61,7 +72,7 @@ def update_model_in_project(
     return model
 
 
-def create_model_file_in_project(
+async def create_model_file_in_project(
         project_id: int,
         new_record: dict
 ):
@@ -70,28 +81,110 @@ def create_model_file_in_project(
         if item[1] and item[0] in ModelFile.__dict__:
             return True
 
-    sd = SessionDispatcher()
-    session = sd.get_session(f"proj_{project_id}")
     new_record = dict(filter(filter_func, new_record.items()))
-    record = create_record_in_db(session, ModelFile, True, **new_record)
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        record = await async_common.create_record_in_db(session, ModelFile, True, **new_record)
     new_record["id"] = record.id
+    invalidate_uuid(project_id, record.id)
     return new_record
 
 
-def get_uuid_from_mf(project_id: int, model_file_id: int) -> str:
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    mf = search_one_in_db(session, ModelFile, id=model_file_id)
-    slpk_uuid = mf.uuid
-    session.close()
+def set_convert_progress(project_id: int, model_file_id: int, progress: dict = None):
+    if progress is None:
+        convert_progress.pop((project_id, model_file_id), None)
+    else:
+        convert_progress[(project_id, model_file_id)] = progress
+
+
+def get_convert_progress(project_id: int, model_file_id: int) -> dict:
+    return convert_progress.get((project_id, model_file_id))
+
+
+def convert_metrics_path(slpk_uuid: str) -> str:
+    return os.path.join(config["model"]["slpk_root"], slpk_uuid, "profile.json")
+
+
+async def save_convert_metrics(project_id: int, model_file_id: int, metrics: dict):
+    """
+    保存 converter 随最终状态上报的各阶段性能统计
+    """
+    path = convert_metrics_path(await get_uuid_from_mf(project_id, model_file_id))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False)
+
+
+def load_convert_metrics(slpk_uuid: str) -> dict:
+    try:
+        with open(convert_metrics_path(slpk_uuid), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fingerprints_path(slpk_uuid: str, sublayer_idx: int) -> str:
+    return os.path.join(config["model"]["slpk_root"], slpk_uuid, "sublayers", f"{sublayer_idx}", "fingerprints.json")
+
+
+def save_fingerprints(slpk_uuid: str, sublayer_idx: int, fingerprints: list):
+    """
+    保存子层各节点的内容指纹，供同一模型的下一版本增量转换时比较
+    """
+    path = fingerprints_path(slpk_uuid, sublayer_idx)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprints": fingerprints}, f)
+
+
+def load_fingerprints(slpk_uuid: str, sublayer_idx: int) -> list:
+    try:
+        with open(fingerprints_path(slpk_uuid, sublayer_idx), "r", encoding="utf-8") as f:
+            return json.load(f).get("fingerprints")
+    except (OSError, ValueError):
+        return None
+
+
+async def get_previous_model_file(session, mf: ModelFile):
+    """
+    同一模型中，在 mf 之前上传且转换成功的最新模型文件
+    """
+    if mf.model_id is None:
+        return None
+    result = await session.execute(select(ModelFile).filter(
+        ModelFile.model_id == mf.model_id, ModelFile.state == "success", ModelFile.id < mf.id
+    ).order_by(ModelFile.id.desc()).limit(1))
+    return result.scalars().first()
+
+
+async def get_uuid_from_mf(project_id: int, model_file_id: int) -> Optional[str]:
+    """
+    :return: 模型文件的 uuid，模型文件不存在时返回 None
+    """
+    slpk_uuid = uuid_cache.get((project_id, model_file_id))
+    if slpk_uuid is not None:
+        return slpk_uuid
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        result = await session.execute(select(ModelFile.uuid).filter(ModelFile.id == model_file_id))
+        slpk_uuid = result.scalar()
+    if slpk_uuid is not None:
+        uuid_cache.put((project_id, model_file_id), slpk_uuid)
     return slpk_uuid
 
 
+def invalidate_uuid(project_id: int, model_file_id: int):
+    """
+    模型文件记录被创建或删除时调用(数据库重建后 id 可能被复用)
+    """
+    uuid_cache.pop((project_id, model_file_id))
+
+
 async def upload_file_by_aiohttp(project_id: int, mf_id: int, url: str, data: FormData, headers: dict = None):
     async with ClientSession() as session:
         async with session.post(url, data=data, headers=headers) as response:
             print(await response.text())
-            s = SessionDispatcher().get_session(f"proj_{project_id}")
-            update_one_in_db(s, search_one_in_db(s, ModelFile, id=mf_id), True, state="created")
+            async with SessionDispatcher().get_async_session(f"proj_{project_id}") as s:
+                mf = await async_common.search_one_in_db(s, ModelFile, id=mf_id)
+                await async_common.update_one_in_db(s, mf, True, state="created")
             return response.status
 
 
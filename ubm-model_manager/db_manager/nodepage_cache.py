@@ -0,0 +1,125 @@
+"""
+nodepage 分页缓存
+
+子层的全部节点保存在同一条 `NodepageVersion.nodepage` 记录中。原先每次请求一页都要读取整条记录再截取，
+打开一个有 N 页的子层需要传输 O(N²) 的数据。
+
+现在按页缓存：某一页未命中时，用一次查询读取整个子层的 nodepage，按页大小切分后全部放入 LRU 缓存，
+同一子层其余页的请求直接命中缓存。缓存的 key 为 (project_id, model_file_id, 版本, sublayer_index, 页大小, 页号)，
+其中版本在模型文件的 nodepage 被写入(重新转换、修改位置)时递增，旧版本的页不再被访问，由 LRU 淘汰；
+版本号保存在数据库中，各 worker 进程共享，见 `db_manager/cache_version.py`。
+加载时同时缓存子层的页数，超出范围的页直接返回空列表，不再重新加载整个子层。
+
+相关配置(`config["model"]`)：
+
+- `nodepage_size`: 每页节点数，默认 64，需与子层 3dSceneLayer 中的 `nodePages.nodesPerPage` 一致，
+  get_sublayer 返回时会以此覆盖
+- `nodepage_cache_size`: 缓存的最大页数，默认 4096，为 0 时不缓存
+- `nodepage_cache_ttl`: 过期时间，单位秒，默认 300
+"""
+import asyncio
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy import any_, select
+
+from config import config
+from db_manager.cache_version import bump_version, get_version
+from db_model.common import SessionDispatcher
+from db_model.slpk_model import ModelFile, SublayerVersion, NodepageVersion
+from utils.cache import LRUCache
+
+CACHE_NAME = "nodepage"
+# 子层的页数在缓存中的 key 为 sublayer_key + (PAGE_COUNT,)
+PAGE_COUNT = "count"
+
+_cache: Optional[LRUCache] = None
+_lock = threading.Lock()
+# 同一子层并发未命中时只加载一次
+_load_locks: Dict[tuple, asyncio.Lock] = {}
+
+
+def nodepage_size() -> int:
+    return config["model"].get("nodepage_size", 64)
+
+
+def get_nodepage_cache() -> LRUCache:
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(
+            config["model"].get("nodepage_cache_size", 4096),
+            config["model"].get("nodepage_cache_ttl", 300),
+        )
+    return _cache
+
+
+async def invalidate_nodepages(project_id: int, model_file_id: int):
+    """
+    模型文件的 nodepage 被写入后调用
+    """
+    await bump_version(project_id, model_file_id, CACHE_NAME)
+
+
+async def load_nodepage(project_id: int, model_file_id: int, sublayer_index: int) -> Optional[List[dict]]:
+    """
+    一次查询读取子层的全部节点
+    :return: 子层不存在时返回 None
+    """
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        result = await session.execute(
+            select(NodepageVersion.nodepage).
+            join(SublayerVersion, SublayerVersion.nodepage_version_id == NodepageVersion.id).
+            join(ModelFile, SublayerVersion.id == any_(ModelFile.sublayer_version_id)).
+            filter(ModelFile.id == model_file_id, SublayerVersion.sublayer_index == sublayer_index).limit(1)
+        )
+        record = result.first()
+    if record is None:
+        return None
+    return (record.nodepage or {}).get("nodes", [])
+
+
+def cached_page(cache: LRUCache, sublayer_key: tuple, page: int) -> Optional[List[dict]]:
+    """
+    :return: 缓存的页，已知超出范围时为空列表，未命中时返回 None
+    """
+    nodes = cache.get(sublayer_key + (page,))
+    if nodes is None:
+        count = cache.get(sublayer_key + (PAGE_COUNT,))
+        if count is not None and not 0 <= page < count:
+            return []
+    return nodes
+
+
+async def get_nodepage(project_id: int, model_file_id: int, sublayer_index: int, page: int) -> Optional[List[dict]]:
+    """
+    :return: 第 page 页的节点，超出范围时为空列表；子层不存在时返回 None
+    """
+    cache = get_nodepage_cache()
+    size = nodepage_size()
+    version = await get_version(project_id, model_file_id, CACHE_NAME)
+    sublayer_key = (project_id, model_file_id, version, sublayer_index, size)
+    nodes = cached_page(cache, sublayer_key, page)
+    if nodes is not None:
+        return nodes
+
+    with _lock:
+        load_lock = _load_locks.setdefault(sublayer_key, asyncio.Lock())
+    async with load_lock:
+        nodes = cached_page(cache, sublayer_key, page)
+        if nodes is not None:
+            return nodes
+        all_nodes = await load_nodepage(project_id, model_file_id, sublayer_index)
+        if all_nodes is None:
+            return None
+        pages = [all_nodes[start: start + size] for start in range(0, len(all_nodes), size)]
+        # 请求的页最后放入，在缓存容量不足以容纳整个子层时也不会被立即淘汰
+        for i, page_nodes in enumerate(pages):
+            if i != page:
+                cache.put(sublayer_key + (i,), page_nodes)
+        nodes = pages[page] if 0 <= page < len(pages) else []
+        if nodes:
+            cache.put(sublayer_key + (page,), nodes)
+        cache.put(sublayer_key + (PAGE_COUNT,), len(pages))
+    with _lock:
+        _load_locks.pop(sublayer_key, None)
+    return nodes
@@ -0,0 +1,218 @@
+"""
+异步数据访问(SQLAlchemy asyncio + asyncpg)
+
+路由都是 `async def`，同步 session 的查询会阻塞事件循环，一个慢查询会使同一 worker 上的其他请求全部等待。
+这里提供与 `db_model/common.py` 同名的异步版本，参数与返回值保持一致，调用时需要 await：
+
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+
+- session 由 `SessionDispatcher.get_async_session` 创建，`expire_on_commit=False`，提交后仍可读取记录的属性
+- 节点表的 reflect 结果按 (数据库, 表名) 缓存，同一张表只 reflect 一次；reflect 与写入使用同一个连接
+"""
+from typing import AsyncIterable, Dict, List, Tuple
+
+from sqlalchemy import MetaData, Table, bindparam, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from config import logger
+from db_model.common import SessionDispatcher, define_node_table
+
+_reflected_tables: Dict[Tuple[str, str], Table] = {}
+
+
+async def reflect_table(conn: AsyncConnection, table_name: str) -> Table:
+    key = (conn.engine.url.database, table_name)
+    table = _reflected_tables.get(key)
+    if table is None:
+        table = await conn.run_sync(lambda sync_conn: Table(table_name, MetaData(), autoload_with=sync_conn))
+        _reflected_tables[key] = table
+    return table
+
+
+async def create_record_in_db(session: AsyncSession, db_model, autocommit: bool, **kvargs):
+    record = db_model(**kvargs)
+    session.add(record)
+    if autocommit:
+        await session.commit()
+        # 读取数据库生成的默认值(create_time 等)
+        await session.refresh(record)
+    else:
+        await session.flush()
+    logger.debug(f"create record success: {db_model.__tablename__} | {record} {record.id}")
+    return record
+
+
+async def create_records_in_db(session: AsyncSession, db_model, autocommit: bool, keys, values):
+    assert len(keys) > 0
+    assert len(values) > 0
+    assert all(map(lambda l: len(l) == len(keys), values))
+    records = [db_model(**dict(zip(keys, row_v))) for row_v in values]
+    session.add_all(records)
+    if autocommit:
+        await session.commit()
+    else:
+        await session.flush()
+    logger.debug(f"create record success: {db_model.__tablename__} | {records}")
+    return records
+
+
+async def search_one_in_db(session: AsyncSession, db_model, **kvargs):
+    result = await session.execute(select(db_model).filter_by(**kvargs).limit(1))
+    return result.scalars().first()
+
+
+async def search_one_in_db_by_filter(session: AsyncSession, db_model, **kvargs):
+    result = await session.execute(select(db_model).filter_by(**kvargs))
+    return result.scalars().all()
+
+
+async def search_all_in_db(session: AsyncSession, db_model):
+    result = await session.execute(select(db_model))
+    return result.scalars().all()
+
+
+async def search_all_by_name(session: AsyncSession, db_model, name):
+    assert hasattr(db_model, "name")
+    result = await session.execute(select(db_model).filter(db_model.name.like(f'%{name}%')))
+    return result.scalars().all()
+
+
+async def search_all_by_id_list(session: AsyncSession, db_model, id_list):
+    assert hasattr(db_model, "id")
+    result = await session.execute(select(db_model).filter(db_model.id.in_(id_list)))
+    return result.scalars().all()
+
+
+async def update_one_in_db(session: AsyncSession, record, autocommit: bool, **kvargs):
+
+    def filter_func(item):
+        if item[1] and item[0] in record.__dict__:
+            return True
+
+    res = dict(filter(filter_func, kvargs.items()))
+    for k, v in res.items():
+        setattr(record, k, v)
+    session.add(record)
+    if autocommit:
+        await session.commit()
+    logger.debug(f"update record `{record}` success.")
+
+
+async def create_node_table(db_name, table_name):
+    meta = MetaData()
+    table = define_node_table(meta, table_name)
+    async with SessionDispatcher().get_async_engine(db_name).begin() as conn:
+        await conn.run_sync(meta.create_all)
+    logger.debug(f"create table `{table}` in `{db_name}` success.")
+
+
+async def create_records_reflect(db_name, table_name, data):
+    async with SessionDispatcher().get_async_engine(db_name).begin() as conn:
+        table = await reflect_table(conn, table_name)
+        await conn.execute(table.insert(), data)
+
+
+async def search_record_reflect(db_name, table_name, search_one=True, **filter_by):
+    async with SessionDispatcher().get_async_engine(db_name).connect() as conn:
+        table = await reflect_table(conn, table_name)
+        stmt = select(table).where(*(table.c[k] == v for k, v in filter_by.items()))
+        if search_one:
+            return (await conn.execute(stmt.limit(1))).first()
+        return (await conn.execute(stmt)).all()
+
+
+async def update_record_reflect(db_name, table_name, data, **filter_by):
+    """
+    根据条件更新数据，需要保证查询条件返回结果唯一，即只更新一条记录
+    """
+    async with SessionDispatcher().get_async_engine(db_name).begin() as conn:
+        table = await reflect_table(conn, table_name)
+        data = {k: v for k, v in data.items() if v and k in table.c}
+        if not data:
+            return
+        await conn.execute(table.update().where(*(table.c[k] == v for k, v in filter_by.items())).values(**data))
+
+
+async def _upsert_node_records(conn: AsyncConnection, table: Table, records: List[dict]) -> Tuple[int, int]:
+    """
+    node_index 已存在则更新 attribute 与 version，否则插入
+    :return: (插入数, 更新数)
+    """
+    exist_indexes = set((await conn.execute(select(table.c.node_index).where(
+        table.c.node_index.in_([record["node_index"] for record in records])
+    ))).scalars())
+    updates = [{
+        "b_node_index": record["node_index"],
+        "attribute": record["attribute"],
+        "version": record["version"],
+    } for record in records if record["node_index"] in exist_indexes]
+    inserts = [record for record in records if record["node_index"] not in exist_indexes]
+    if updates:
+        await conn.execute(
+            table.update().where(table.c.node_index == bindparam("b_node_index")).values(
+                attribute=bindparam("attribute"), version=bindparam("version")
+            ),
+            updates,
+        )
+    if inserts:
+        await conn.execute(table.insert(), inserts)
+    return len(inserts), len(updates)
+
+
+async def save_node_record_batches_reflect(session: AsyncSession, table_name,
+                                           batches: AsyncIterable[List[dict]]) -> int:
+    """
+    在同一个事务中逐批写入节点记录，批次可以边读取请求体边产生，内存中只保留当前一批；
+    后面批次中重复的 node_index 覆盖前面的写入
+    :param batches: 节点记录的批次，每条记录需包含 node_index, attribute, version
+    :return: 写入的记录数
+    """
+    inserted = updated = 0
+    async with session.bind.begin() as conn:
+        table = None
+        async for records in batches:
+            # 同一批中重复的 node_index 以最后一条为准
+            records = list({record["node_index"]: record for record in records}.values())
+            if not records:
+                continue
+            if table is None:
+                table = await reflect_table(conn, table_name)
+            batch_inserted, batch_updated = await _upsert_node_records(conn, table, records)
+            inserted += batch_inserted
+            updated += batch_updated
+    logger.debug(f"save node records to `{table_name}` success: {inserted} inserted, {updated} updated.")
+    return inserted + updated
+
+
+async def copy_node_records_reflect(session: AsyncSession, source_table: str, target_table: str,
+                                    remap: List[Tuple[int, int]]) -> int:
+    """
+    在同一个事务中将源节点表中的记录按 remap 复制到目标节点表(INSERT ... SELECT，数据不经过应用)，
+    目标表中已存在的对应 node_index 先删除
+    :param session: 对应项目数据库的 session
+    :param remap: (目标 node_index, 源 node_index) 序列
+    :return: 复制的记录数
+    """
+    if not remap:
+        return 0
+    new_indexes = [new for new, _ in remap]
+    old_indexes = [old for _, old in remap]
+    async with session.bind.begin() as conn:
+        await conn.execute(
+            text(f'DELETE FROM "{target_table}" WHERE node_index = ANY(CAST(:new_indexes AS integer[]))'),
+            {"new_indexes": new_indexes},
+        )
+        result = await conn.execute(
+            text(
+                f'INSERT INTO "{target_table}" '
+                f'(node_index, version, material_ids, category_id, attribute, custom_attribute, old_version_list) '
+                f'SELECT r.new_index, s.version, s.material_ids, s.category_id, s.attribute, s.custom_attribute, '
+                f's.old_version_list FROM "{source_table}" s '
+                f'JOIN unnest(CAST(:new_indexes AS integer[]), CAST(:old_indexes AS integer[])) '
+                f'AS r(new_index, old_index) ON s.node_index = r.old_index'
+            ),
+            {"new_indexes": new_indexes, "old_indexes": old_indexes},
+        )
+    logger.debug(f"copy {result.rowcount} node records from `{source_table}` to `{target_table}`.")
+    return result.rowcount
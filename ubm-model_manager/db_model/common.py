@@ -2,7 +2,6 @@ import asyncio
 import os
 import re
 import threading
-from typing import List
 from sqlalchemy import (
     Column,
     String,
@@ -16,13 +15,13 @@ from sqlalchemy import (
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy_utils import database_exists
 from config import config
 from config import logger
 
 
-# TODO: 改成异步形式
 # user = config["pg"]["user"]
 # pwd = config["pg"]["password"]
 # host = config["pg"]["host"]
@@ -52,6 +51,9 @@ class SessionDispatcher:
     user = None
     instance = None
     session_mapper = dict()
+    # 异步 session(asyncpg)，路由中使用，不阻塞事件循环；见 db_model/async_common.py
+    async_engine_mapper = dict()
+    async_session_mapper = dict()
     lock = asyncio.Lock()
 
     @synchronized
@@ -74,17 +76,13 @@ class SessionDispatcher:
     # @synchronized
     @classmethod
     def init(cls):
-        from db_model.project import Project
         cls.user = config["pg"]["user"]
         cls.pwd = config["pg"]["password"]
         cls.host = config["pg"]["host"]
         cls.port = config["pg"]["port"]
         cls.add_session(config["pg"]["db_name"])
-        # add exist db in session map
-        session = cls.get_session(config["pg"]["db_name"])
-        projects = session.query(Project).all()
-        for p in projects:
-            cls.add_session(f"proj_{p.id}")
+        # 项目数据库的连接池在首次使用时创建(get_session / get_async_session)，
+        # 路由已改用异步 session，不再为每个项目预先创建同步连接池
 
     # @synchronized
     @classmethod
@@ -92,24 +90,56 @@ class SessionDispatcher:
         # print(f"call from add_session(),added by session: {cls.instance}")
         url = f"postgresql://{cls.user}:{cls.pwd}@{cls.host}:{cls.port}/{db_name}"
         logger.debug(f"db adder: {url}")
-        engine = create_engine(url, pool_size=100)
+        engine = create_engine(url, pool_size=config["pg"].get("pool_size", 10))
         SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
         session = scoped_session(SessionLocal)
         cls.session_mapper[db_name] = SessionLocal
         # self.session_mapper[db_name] = session
 
+    @classmethod
+    def add_async_session(cls, db_name):
+        async_engine = create_async_engine(
+            f"postgresql+asyncpg://{cls.user}:{cls.pwd}@{cls.host}:{cls.port}/{db_name}",
+            pool_size=config["pg"].get("async_pool_size", 10),
+        )
+        cls.async_engine_mapper[db_name] = async_engine
+        # 提交后不使记录过期，异步 session 中访问过期属性会触发隐式 IO 而报错
+        cls.async_session_mapper[db_name] = sessionmaker(
+            async_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+        )
+
+    @classmethod
+    def check_database(cls, db_name):
+        if not database_exists(f"postgresql://{cls.user}:{cls.pwd}@{cls.host}:{cls.port}/{db_name}"):
+            raise OperationalError(f"Database '{db_name}' does not exist.", params={}, orig=None)
+
     # @synchronized
     @classmethod
     def get_session(cls, db_name=config["pg"]["db_name"]):
         # print(f"call from add_session(),got by session: {cls.instance}")
         if db_name not in cls.session_mapper:
-            if database_exists(f"postgresql://{cls.user}:{cls.pwd}@{cls.host}:{cls.port}/{db_name}"):
-                cls.add_session(db_name)
-            else:
-                raise OperationalError(f"Database '{db_name}' does not exist.", params={}, orig=None)
+            cls.check_database(db_name)
+            cls.add_session(db_name)
         # return self.session_mapper[db_name]
         return scoped_session(cls.session_mapper[db_name])
 
+    @classmethod
+    def get_async_session(cls, db_name=config["pg"]["db_name"]) -> AsyncSession:
+        """
+        用法：`async with SessionDispatcher().get_async_session(db_name) as session:`，退出时关闭 session
+        """
+        if db_name not in cls.async_session_mapper:
+            cls.check_database(db_name)
+            cls.add_async_session(db_name)
+        return cls.async_session_mapper[db_name]()
+
+    @classmethod
+    def get_async_engine(cls, db_name=config["pg"]["db_name"]) -> AsyncEngine:
+        if db_name not in cls.async_engine_mapper:
+            cls.check_database(db_name)
+            cls.add_async_session(db_name)
+        return cls.async_engine_mapper[db_name]
+
 
 class ModelBase:
     @declared_attr
@@ -264,7 +294,16 @@ def create_node_table(db_name, table_name):
     url = f"postgresql://{user}:{pwd}@{host}:{port}/{db_name}"
     engine = create_engine(url)
     meta = MetaData()
-    table_name = Table(
+    table_name = define_node_table(meta, table_name)
+    meta.create_all(engine)
+    logger.debug(f"create table `{table_name}` in `{db_name}` success.")
+
+
+def define_node_table(meta: MetaData, table_name: str) -> Table:
+    """
+    节点表的结构，每个子层一张表，表名如 `1_0_NODE_VERSION`
+    """
+    return Table(
         table_name,
         meta,
         Column("id", Integer, primary_key=True, autoincrement=True),
@@ -280,8 +319,6 @@ def create_node_table(db_name, table_name):
         Column("update_by", String, nullable=False, server_default="anonymous"),
         Column("update_time", DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
     )
-    meta.create_all(engine)
-    logger.debug(f"create table `{table_name}` in `{db_name}` success.")
 
 
 def create_records_reflect(db_name, table_name, data):
@@ -351,31 +388,6 @@ def update_record_reflect(db_name, table_name, data, **filter_by):
     session.close()
 
 
-def attribute_encode(attribute_id: int, values: List[str], byte_counts: List[int]):
-    count = len(byte_counts)
-    binary_response: List[bytes] = []
-    if attribute_id != 0:
-        size = sum(byte_counts)
-        binary_response.append(count.to_bytes(4, "little", signed=False))
-        binary_response.append(size.to_bytes(4, "little", signed=False))
-        for byte_count in byte_counts:
-            binary_byte_count = byte_count.to_bytes(4, "little", signed=False)
-            binary_response.append(binary_byte_count)
-        for value in values:
-            if value is not None:
-                binary_response.append(value.encode())
-            binary_response.append(0x00.to_bytes(1, "little", signed=False))
-    elif attribute_id == 0:
-        binary_response.append(count.to_bytes(4, "little", signed=False))
-        values: List[int]
-        for value in values:
-            binary_response.append(value.to_bytes(4, "little", signed=False))
-    content_length = 0
-    for i in binary_response:
-        content_length += i.__len__()
-    return binary_response
-
-
 if __name__ == "__main__":  # for test
     from db_model.slpk_model import ModelFile
 
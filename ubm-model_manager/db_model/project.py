@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, create_engine, cast, func, DateTime, Enum
+from sqlalchemy import Column, Integer, String, create_engine, cast, func, DateTime, Enum, BigInteger, Boolean, Float, \
+    UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.dialects import postgresql
@@ -32,3 +33,51 @@ class TemplateField(Base):
     key = Column(String, nullable=False)  # 字段名为field_key
     value_type = Column(ValueType, nullable=False)  # field_value_type
     template_id = Column(Integer)
+
+
+class ConvertQueue(Base):
+    """
+    转换任务的调度队列，每个等待或运行中的转换任务一条记录，见 db_manager/convert_scheduler.py
+    """
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(Integer, nullable=False)
+    model_file_id = Column(Integer, nullable=False)
+    uuid = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False, default=0)  # 单位 bytes
+    cost = Column(Float, nullable=False, default=0)  # 估算的转换耗时，单位秒
+    kind = Column(String, nullable=False)  # small / large
+    state = Column(String, nullable=False, default="pending")  # pending / running
+    borrowed = Column(Boolean, nullable=False, default=False)  # 大任务是否占用了小任务的名额
+    task_id = Column(String)  # celery 任务 id
+    reclaimed = Column(Integer, nullable=False, default=0)  # 超时被回收的次数
+    # 以下为时间戳，单位秒
+    submit_time = Column(Float, nullable=False)
+    dispatch_time = Column(Float)
+    report_time = Column(Float)  # 最近一次收到 converter 上报的时间
+
+    __table_args__ = (UniqueConstraint("project_id", "model_file_id"),)
+
+    @property
+    def key(self):
+        return self.project_id, self.model_file_id
+
+    def __str__(self):
+        return f"ConvertQueue <project_id={self.project_id}, model_file_id={self.model_file_id}, state={self.state}>"
+
+
+class ConvertUsage(Base):
+    """
+    各项目累计分发的转换任务估算耗时，用于按项目公平调度
+    """
+    project_id = Column(Integer, primary_key=True)
+    usage = Column(Float, nullable=False, default=0)
+
+
+class CacheVersion(Base):
+    """
+    各 worker 进程共享的缓存版本，模型文件的数据被写入时递增，见 db_manager/cache_version.py
+    """
+    project_id = Column(Integer, primary_key=True)
+    model_file_id = Column(Integer, primary_key=True)
+    name = Column(String, primary_key=True)  # 缓存名，如 nodepage、attribute
+    version = Column(Integer, nullable=False, default=0)
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import logging
 import os
 import uuid
@@ -8,18 +10,28 @@ from aiohttp import FormData
 from config import logger, config
 from typing import List, Union
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, Body, Form, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, Body, Form, BackgroundTasks, Request
 from pydantic import BaseModel, HttpUrl
+from starlette.concurrency import run_in_threadpool
 import numpy as np
 
 from db_manager.model_manager import update_model_in_project, create_model_in_project, create_model_file_in_project, \
-    get_uuid_from_mf, upload_file_by_aiohttp, celery_app
-from db_model.common import update, search_one_in_db, search_all_in_db, create_node_table, create_record_in_db, \
-    update_one_in_db, create_records_in_db, create_records_reflect, SessionDispatcher, \
-    search_all_by_name, search_all_by_id_list, search_one_in_db_by_filter, search_record_reflect, update_record_reflect
+    get_uuid_from_mf, upload_file_by_aiohttp, celery_app, set_convert_progress, get_convert_progress, \
+    save_convert_metrics, load_convert_metrics, save_fingerprints, load_fingerprints, get_previous_model_file
+from db_manager.convert_scheduler import get_convert_scheduler
+from db_manager.attribute_cache import invalidate_attributes
+from db_manager.model_file_cache import invalidate_model_file
+from db_manager.nodepage_cache import invalidate_nodepages
+from db_model.common import SessionDispatcher
+from db_model.async_common import search_one_in_db, search_all_in_db, create_node_table, create_record_in_db, \
+    update_one_in_db, create_records_in_db, create_records_reflect, search_all_by_name, search_all_by_id_list, \
+    search_one_in_db_by_filter, search_record_reflect, update_record_reflect, save_node_record_batches_reflect, \
+    copy_node_records_reflect
 from db_model.slpk_model import Model, ModelFile, SublayerVersion, SublayerInfoVersion, NodepageVersion, LayerVersion
 from dependence import get_authorization_header
 from utils.common import split_page
+from utils.blob_store import put_blob, link_blob, link_tree, has_blob, missing_blobs
+from utils.staging import commit_staging, is_valid_staging_name
 from utils.parser import parse_path
 
 router = APIRouter(
@@ -38,6 +50,7 @@ class RAttribute(BaseModel):
 class RTaskStatus(BaseModel):
     status: str
     msg: str = None
+    metrics: dict = None
 
 
 class RTask(BaseModel):
@@ -66,6 +79,37 @@ class RTransform(BaseModel):
     rotation: RRotation = None
 
 
+class RBlobHashes(BaseModel):
+    hashes: List[str]
+
+
+class RBlobLink(BaseModel):
+    path: str
+    sha256: str
+
+
+class RBlobLinks(BaseModel):
+    links: List[RBlobLink]
+
+
+class RStagingEntry(BaseModel):
+    path: str
+    sha256: str = None
+
+
+class RStagingManifest(BaseModel):
+    entries: List[RStagingEntry]
+
+
+class RFingerprints(BaseModel):
+    fingerprints: List[str]
+
+
+class RRemap(BaseModel):
+    source_model_file_id: int
+    remap: List[List[int]]  # [当前节点下标, 上一版本节点下标]
+
+
 class RModel(BaseModel):
     # application_id: int = None
     name: str = None
@@ -87,36 +131,35 @@ async def create_model(r_model: RModel, project_id: int, model_id: int = None):
 
     **已完成**
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    model = search_one_in_db(session, Model, id=model_id)
-    if model_id and model:
-        new_record = {}
-        default = RModel.dict(RModel())
-        for k, v in r_model:
-            if k and v != default[k]:
-                new_record[k] = v
-        new_record["app_id_list"] = list(
-            set(model.app_id_list).union(r_model.attach_to_apps) - set(r_model.remove_from_apps))
-        print(new_record)
-        new_record = dict(filter(lambda item: item[0] in model.__dict__, new_record.items()))
-        print(new_record)
-        for k, v in new_record.items():
-            setattr(model, k, v)
-        session.add(model)
-
-        if "current_model_file_id" in new_record:
-            mf = search_one_in_db(session, ModelFile, id=new_record["current_model_file_id"])
-            update_one_in_db(session, mf, False, model_id=model.id)
-        session.commit()
-        # update_one_in_db(session, model, True, **new_record)
-    else:
-        record = r_model.dict()
-        record["id"] = model_id
-        record["app_id_list"] = record["attach_to_apps"]
-        del record["attach_to_apps"]   # TODO: 应该有更好的方案
-        del record["remove_from_apps"]
-        model = create_record_in_db(session, Model, autocommit=True, **record)
-    session.remove()
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        model = await search_one_in_db(session, Model, id=model_id)
+        if model_id and model:
+            new_record = {}
+            default = RModel.dict(RModel())
+            for k, v in r_model:
+                if k and v != default[k]:
+                    new_record[k] = v
+            new_record["app_id_list"] = list(
+                set(model.app_id_list).union(r_model.attach_to_apps) - set(r_model.remove_from_apps))
+            print(new_record)
+            new_record = dict(filter(lambda item: item[0] in model.__dict__, new_record.items()))
+            print(new_record)
+            for k, v in new_record.items():
+                setattr(model, k, v)
+            session.add(model)
+
+            if "current_model_file_id" in new_record:
+                mf = await search_one_in_db(session, ModelFile, id=new_record["current_model_file_id"])
+                await update_one_in_db(session, mf, False, model_id=model.id)
+            await session.commit()
+            # update_one_in_db(session, model, True, **new_record)
+        else:
+            record = r_model.dict()
+            record["id"] = model_id
+            record["app_id_list"] = record["attach_to_apps"]
+            del record["attach_to_apps"]   # TODO: 应该有更好的方案
+            del record["remove_from_apps"]
+            model = await create_record_in_db(session, Model, autocommit=True, **record)
     return {
         "code": 200,
         "data": model
@@ -130,17 +173,15 @@ async def bind_model_file_with_model(project_id: int, model_id: int, model_file:
 
     **已完成**
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    model = search_one_in_db(session, Model, id=model_id)
-    mf = search_one_in_db(session, ModelFile, id=model_file.model_file_id)
-    if model and mf:
-        update_one_in_db(session, model, False, current_model_file_id=model_file.model_file_id)
-        update_one_in_db(session, mf, True, model_id=model_id)
-        session.remove()
-        return {
-            "code": 200,
-        }
-    session.remove()
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        model = await search_one_in_db(session, Model, id=model_id)
+        mf = await search_one_in_db(session, ModelFile, id=model_file.model_file_id)
+        if model and mf:
+            await update_one_in_db(session, model, False, current_model_file_id=model_file.model_file_id)
+            await update_one_in_db(session, mf, True, model_id=model_id)
+            return {
+                "code": 200,
+            }
     return {
         "code": 400,
         "msg": "model or model file may not exist."
@@ -176,13 +217,14 @@ async def simple_upload(file: UploadFile, background_tasks: BackgroundTasks, pro
             "tmp_file_size": len(data),
             "uuid": uuid_,
         }
-        session = SessionDispatcher().get_session(f"proj_{project_id}")
-        model = search_one_in_db(session, Model, id=model_id)
-        if model_id and model:
-            record["model_id"] = model_id
-        mf = create_model_file_in_project(project_id, record)
-        if model:
-            update_one_in_db(session, model, True, current_model_file_id=mf.get("id"), version=model.version + 1)
+        async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+            model = await search_one_in_db(session, Model, id=model_id)
+            if model_id and model:
+                record["model_id"] = model_id
+            mf = await create_model_file_in_project(project_id, record)
+            if model:
+                await update_one_in_db(session, model, True, current_model_file_id=mf.get("id"),
+                                       version=model.version + 1)
         logger.debug(f"create model file record success.")
         # upload to converter server
         url = config["model"]["converter_server_url"]
@@ -197,7 +239,6 @@ async def simple_upload(file: UploadFile, background_tasks: BackgroundTasks, pro
         background_tasks.add_task(upload_file_by_aiohttp, project_id, mf["id"], url, form_data, headers=headers)
         # update_one_in_db(session, search_one_in_db(session, ModelFile, id=mf["id"]), True, state="created")
         await file.close()
-        session.remove()
         return {
             "code": 200,
             "data": {
@@ -241,32 +282,73 @@ async def finish_multipart_upload():
     pass
 
 
+@router.on_event("startup")
+async def start_convert_reclaim():
+    """
+    定时回收失联的转换任务；服务重启后由此继续分发等待中的任务
+    """
+    asyncio.get_event_loop().create_task(reclaim_convert_tasks())
+
+
+async def reclaim_convert_tasks():
+    scheduler = get_convert_scheduler()
+    while True:
+        try:
+            await run_in_threadpool(scheduler.reclaim)
+        except Exception as e:
+            logger.error(f"fail to reclaim convert tasks: {e}")
+        await asyncio.sleep(scheduler.reclaim_interval)
+
+
 @router.post("/{project_id}/model-file/convert")
-def create_convert_task(task: RTask, project_id: int):
+async def create_convert_task(task: RTask, project_id: int):
     """
     发起转换任务
 
     **已完成**
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    mf = search_one_in_db(session, ModelFile, id=task.model_file_id)
-    if mf and (mf.state == "transfer" or mf.state == "processing"):
-        return {
-            "code": 400,
-            "msg": f"model(id = {mf.id}) file state is {mf.state}, can not convert."
-        }
-    if mf:
-        update_one_in_db(session, mf, True, state="waiting")
-        celery_app.send_task("src.api.start_convert", args=[mf.uuid, project_id, task.model_file_id])
-        session.remove()
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        mf = await search_one_in_db(session, ModelFile, id=task.model_file_id)
+        if mf and (mf.state == "transfer" or mf.state == "processing"):
+            return {
+                "code": 400,
+                "msg": f"model(id = {mf.id}) file state is {mf.state}, can not convert."
+            }
+        if mf:
+            await update_one_in_db(session, mf, True, state="waiting")
+            # 由调度器按任务大小及项目公平分发
+            scheduler = get_convert_scheduler()
+            await run_in_threadpool(scheduler.submit, project_id, mf.id, mf.uuid, mf.tmp_file_size)
+            return {
+                "code": 200,
+                "data": await run_in_threadpool(scheduler.position, project_id, task.model_file_id),
+            }
+        else:
+            return {
+                "code": 404,
+                "msg": "no such model file."
+            }
+
+
+@router.delete("/{project_id}/model-file/convert/{model_file_id}")
+async def cancel_convert_task(project_id: int, model_file_id: int):
+    """
+    取消转换任务，等待中的任务移出队列，运行中的任务被撤销，模型文件恢复为可重新发起转换的状态
+    """
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+        if not mf:
+            return {
+                "code": 404,
+                "msg": "no such model file."
+            }
+        cancelled = await run_in_threadpool(get_convert_scheduler().cancel, project_id, model_file_id)
+        if mf.state == "waiting" or mf.state == "processing":
+            await update_one_in_db(session, mf, True, state="created")
+            set_convert_progress(project_id, model_file_id)
         return {
             "code": 200,
-        }
-    else:
-        session.remove()
-        return {
-            "code": 404,
-            "msg": "no such model file."
+            "data": {"cancelled": cancelled}
         }
 
 
@@ -278,86 +360,85 @@ async def get_convert_task_state(project_id: int, model_file_id: int = None):
 
     **已完成**
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    if model_file_id:
-        mf = search_one_in_db(session, ModelFile, id=model_file_id)
-        if mf:
-            session.remove()
-            return {
-                "code": 200,
-                "data": {
-                    "model_file_id": mf.id,
-                    "name": mf.name,
-                    "state": mf.state,
-                },
-            }
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        if model_file_id:
+            mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+            if mf:
+                return {
+                    "code": 200,
+                    "data": {
+                        "model_file_id": mf.id,
+                        "name": mf.name,
+                        "state": mf.state,
+                        "progress": get_convert_progress(project_id, mf.id),
+                        "metrics": load_convert_metrics(mf.uuid),
+                        "queue": await run_in_threadpool(get_convert_scheduler().position, project_id, mf.id),
+                    },
+                }
+            else:
+                return {
+                    "code": 404,
+                    "msg": "no such model file."
+                }
         else:
-            session.remove()
+            model_files = await search_all_in_db(session, ModelFile)
+            res = list(map(lambda record: {
+                "model_file_id": record.id,
+                "name": record.name,
+                "state": record.state,
+            }, model_files))
             return {
-                "code": 404,
-                "msg": "no such model file."
+                "code": 200,
+                "data": res,
             }
-    else:
-        model_files = search_all_in_db(session, ModelFile)
-        res = list(map(lambda record: {
-            "model_file_id": record.id,
-            "name": record.name,
-            "state": record.state,
-        }, model_files))
-        session.remove()
-        return {
-            "code": 200,
-            "data": res,
-        }
 
 
 @router.post("/{project_id}/model-file/{model_file_id}/bin")
 async def save_attribute_to_file(project_id: int, model_file_id: int,
                                  path: str = Form(media_type="multipart/form-data"),
-                                 bin_data: UploadFile = Form(media_type="multipart/form-data")):
+                                 bin_data: UploadFile = Form(media_type="multipart/form-data"),
+                                 sha256: str = Form(None, media_type="multipart/form-data")):
     """
     将模型二进制属性(几何信息，材质信息)存入文件系统，内部调用
 
+    geometry 与纹理按内容 hash 存入 blob 存储，节点路径链接到对应的 blob；传入 sha256 时校验内容
+
     **已完成，通过简单测试**
     """
 
     res = parse_path(path)
     output_file_root = config["model"]["slpk_root"]
-    slpk_uuid = get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    slpk_uuid = await get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
     if res["type"] == "node_text":
         # 当路径解析的结果为"node_text"时，仅接受后缀为.dds.gz的压缩文件
         print(bin_data.filename)
         if not bin_data.filename.endswith(".dds"):
             raise HTTPException(406, detail="Unacceptable file type")
         texture_path = os.path.join(Path(output_file_root), Path(slpk_uuid), Path(path))
-        if not os.path.isfile(texture_path):
-            dir_path = os.path.dirname(texture_path)
-            os.makedirs(dir_path, exist_ok=True)
-            # return {
-            #     "code": 404,
-            #     "msg": texture_path
-            # }
+        # return {
+        #     "code": 404,
+        #     "msg": texture_path
+        # }
         filebytes = await bin_data.read()
-        f = open(texture_path, "wb")
-        f.write(filebytes)
-        f.close()
+        # 复用的节点路径是上一版本文件的硬链接，原地写入会同时修改上一版本，按内容保存为 blob 后重新链接；
+        # 写文件与创建链接是阻塞调用，放到线程池中执行
+        await run_in_threadpool(lambda: link_blob(put_blob(filebytes), texture_path))
     elif res["type"] == "node_geom":
         # 当路径解析的结果为"node_geome"时，仅接受后缀为bin的二进制文件
         if not bin_data.filename.endswith(".bin"):
             raise HTTPException(406, detail="Unacceptable file type")
         geometry_path = os.path.join(Path(output_file_root), Path(slpk_uuid), Path(path))
-        if not os.path.isfile(geometry_path):
-            dir_path = os.path.dirname(geometry_path)
-            os.makedirs(dir_path, exist_ok=True)
         #     print(geometry_path)
         #     return {
         #         "code": 404,
         #         "msg": geometry_path
         #     }
         filebytes = await bin_data.read()
-        f = open(geometry_path, "wb")
-        f.write(filebytes)
-        f.close()
+        try:
+            digest = await run_in_threadpool(put_blob, filebytes, sha256)
+        except ValueError as e:
+            raise HTTPException(422, detail=str(e))
+        await run_in_threadpool(link_blob, digest, geometry_path)
     else:
         raise NotImplemented
     return {
@@ -365,6 +446,73 @@ async def save_attribute_to_file(project_id: int, model_file_id: int,
     }
 
 
+@router.post("/{project_id}/model-file/{model_file_id}/blob/missing")
+async def get_missing_blobs(project_id: int, model_file_id: int, r_hashes: RBlobHashes):
+    """
+    返回尚未保存的 blob hash，转换器只需上传这些 blob，内部调用
+    """
+    return {
+        "code": 200,
+        "data": await run_in_threadpool(missing_blobs, r_hashes.hashes),
+    }
+
+
+@router.post("/{project_id}/model-file/{model_file_id}/blob/link")
+async def link_blobs_to_path(project_id: int, model_file_id: int, r_links: RBlobLinks):
+    """
+    将节点的 geometry 路径链接到已保存的 blob，不再传输数据，内部调用
+
+    不存在的 blob 不做处理，在返回的 `missing` 中列出，由转换器重新上传
+    """
+    output_file_root = config["model"]["slpk_root"]
+    slpk_uuid = await get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    for link in r_links.links:
+        if parse_path(link.path)["type"] != "node_geom" or not link.path.endswith(".bin"):
+            raise HTTPException(406, detail=f"Unacceptable path: {link.path}")
+
+    def link_all() -> List[str]:
+        missing = []
+        for link in r_links.links:
+            if not has_blob(link.sha256):
+                missing.append(link.path)
+                continue
+            link_blob(link.sha256, os.path.join(Path(output_file_root), Path(slpk_uuid), Path(link.path)))
+        return missing
+
+    return {
+        "code": 200,
+        "missing": await run_in_threadpool(link_all),
+    }
+
+
+@router.post("/{project_id}/model-file/{model_file_id}/staging/{name}/commit")
+async def commit_staged_files(project_id: int, model_file_id: int, name: str, r_manifest: RStagingManifest):
+    """
+    共享存储模式下提交 converter 写入暂存区的二进制数据，内部调用
+
+    geometry 链接到 converter 写入的 blob，其他文件从暂存区原子地移动到模型目录；
+    缺少数据的路径在返回的 `missing` 中列出，此时保留暂存区，可在补齐后重新提交
+    """
+    if not is_valid_staging_name(name):
+        raise HTTPException(406, detail=f"Unacceptable staging name: {name}")
+    for entry in r_manifest.entries:
+        res_type = parse_path(entry.path)["type"]
+        if res_type not in ("node_text", "node_geom") or (res_type == "node_geom") != bool(entry.sha256):
+            raise HTTPException(406, detail=f"Unacceptable path: {entry.path}")
+    slpk_uuid = await get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    target_root = os.path.join(config["model"]["slpk_root"], slpk_uuid)
+    try:
+        missing = await run_in_threadpool(
+            commit_staging, name, [entry.dict() for entry in r_manifest.entries], target_root
+        )
+    except ValueError as e:
+        raise HTTPException(406, detail=str(e))
+    return {
+        "code": 200,
+        "missing": missing,
+    }
+
+
 @router.post("/{project_id}/model-file/{model_file_id}/attribute")
 async def save_attribute_to_db(project_id: int, model_file_id: int, r_attr: RAttribute):
     """
@@ -373,95 +521,122 @@ async def save_attribute_to_db(project_id: int, model_file_id: int, r_attr: RAtt
     **已完成**
     """
 
-    def create_sublayer(session, layer_json):
+    async def create_sublayer(session, layer_json):
         sublayers = layer_json.get("sublayers")
         # TODO: 为兼容性考虑，递归遍历sublayers
         sublayers = list(filter(lambda item: item["layerType"] == "3DObject", sublayers))
+        # 转换重试时子层记录可能已存在，只创建缺少的部分
+        existing = {
+            record.sublayer_index: record.id
+            for record in await search_one_in_db_by_filter(session, SublayerVersion, model_file_id=model_file_id)
+        }
         keys = ("sublayer_index", "model_file_id")
         values = []
         for i in range(len(sublayers)):
-            values.append((i, model_file_id))
-            create_node_table(f"proj_{project_id}", f"{model_file_id}_{i}_NODE_VERSION")
+            if i not in existing:
+                values.append((i, model_file_id))
+            await create_node_table(f"proj_{project_id}", f"{model_file_id}_{i}_NODE_VERSION")
         # session = SessionDispatcher().get_session(f"proj_{project_id}")
-        ids = create_records_in_db(session, SublayerVersion, False, keys, values)
-        ids = list(map(lambda i: i.id, ids))
+        if values:
+            records = await create_records_in_db(session, SublayerVersion, False, keys, values)
+            existing.update({record.sublayer_index: record.id for record in records})
+        ids = [existing[i] for i in range(len(sublayers))]
         # add association with model file
         print(f"ids: {ids}")
         return ids
 
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    res = parse_path(r_attr.path)
-    mf = search_one_in_db(session, ModelFile, id=model_file_id)
-    if res["type"] == "layer":
-        _, model = res["data"]
-        record_id = create_record_in_db(session, model, False, layer=r_attr.data)
-        logger.debug(f"type: layer, new record id: {record_id.id}")
-        ids = create_sublayer(session, r_attr.data)
-        update_one_in_db(session, mf, False, sublayer_version_id=ids, layer_version_id=record_id.id)
-    elif res["type"] == "metadata":
-        _, model = res["data"]
-        record_id = create_record_in_db(session, model, False, meta=r_attr.data)
-        logger.debug(f"type: metadata, new record id: {record_id.id}")
-        update_one_in_db(session, mf, False, meta_version_id=record_id.id)
-    elif res["type"] == "sublayer":
-        sublayer_idx, model = res["data"]
-        sublayer = search_one_in_db(session, SublayerVersion, model_file_id=model_file_id, sublayer_index=sublayer_idx)
-        if sublayer:
-            record_id = create_record_in_db(session, model, False, sublayer=r_attr.data)
-            logger.debug(f"type: sublayer, new record id: {record_id.id}")
-            update_one_in_db(session, sublayer, False, sublayer_version_id=record_id.id)
-        else:
-            logger.error(f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists.")
-            session.remove()
-            return {
-                "code": 400,
-                "msg": f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists."
-            }
-    elif res["type"] == "nodepage":
-        sublayer_idx, model = res["data"]
-        sublayer = search_one_in_db(session, SublayerVersion, model_file_id=model_file_id, sublayer_index=sublayer_idx)
-        if sublayer:
-            record_id = create_record_in_db(session, model, False, nodepage=r_attr.data)
-            update_one_in_db(session, sublayer, False, nodepage_version_id=record_id.id)
+    async def save_version(session, model, record_id, **data):
+        """
+        已关联版本记录时原地更新，使转换器重复发送同一数据时结果不变
+        """
+        record = await search_one_in_db(session, model, id=record_id) if record_id else None
+        if record:
+            await update_one_in_db(session, record, False, **data)
+            return record
+        return await create_record_in_db(session, model, False, **data)
+
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        res = parse_path(r_attr.path)
+        mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+        if res["type"] == "layer":
+            _, model = res["data"]
+            record_id = await save_version(session, model, mf.layer_version_id, layer=r_attr.data)
+            logger.debug(f"type: layer, record id: {record_id.id}")
+            ids = await create_sublayer(session, r_attr.data)
+            await update_one_in_db(session, mf, False, sublayer_version_id=ids, layer_version_id=record_id.id)
+        elif res["type"] == "metadata":
+            _, model = res["data"]
+            record_id = await save_version(session, model, mf.meta_version_id, meta=r_attr.data)
+            logger.debug(f"type: metadata, record id: {record_id.id}")
+            await update_one_in_db(session, mf, False, meta_version_id=record_id.id)
+        elif res["type"] == "sublayer":
+            sublayer_idx, model = res["data"]
+            sublayer = await search_one_in_db(session, SublayerVersion, model_file_id=model_file_id,
+                                              sublayer_index=sublayer_idx)
+            if sublayer:
+                record_id = await save_version(session, model, sublayer.sublayer_version_id, sublayer=r_attr.data)
+                logger.debug(f"type: sublayer, record id: {record_id.id}")
+                await update_one_in_db(session, sublayer, False, sublayer_version_id=record_id.id)
+            else:
+                logger.error(f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} "
+                             f"sublayer records not exists.")
+                return {
+                    "code": 400,
+                    "msg": f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists."
+                }
+        elif res["type"] == "nodepage":
+            sublayer_idx, model = res["data"]
+            sublayer = await search_one_in_db(session, SublayerVersion, model_file_id=model_file_id,
+                                              sublayer_index=sublayer_idx)
+            if sublayer:
+                record_id = await save_version(session, model, sublayer.nodepage_version_id, nodepage=r_attr.data)
+                await update_one_in_db(session, sublayer, False, nodepage_version_id=record_id.id)
+            else:
+                logger.error(f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} "
+                             f"sublayer records not exists.")
+                return {
+                    "code": 400,
+                    "msg": f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists."
+                }
+        elif res["type"] == "sublayer_meta":
+            sublayer_idx, model = res["data"]
+            sublayer = await search_one_in_db(session, SublayerVersion, model_file_id=model_file_id,
+                                              sublayer_index=sublayer_idx)
+            if sublayer:
+                record_id = await save_version(session, model, sublayer.sublayer_meta_version_id, meta=r_attr.data)
+                await update_one_in_db(session, sublayer, False, sublayer_meta_version_id=record_id.id)
+            else:
+                logger.error(f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} "
+                             f"sublayer records not exists.")
+                return {
+                    "code": 400,
+                    "msg": f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists."
+                }
+        elif res["type"] == "node_attr":
+            sublayer_idx, node_idx = res["data"]
+            has_table = await search_record_reflect(f"proj_{project_id}",
+                                                    f"{model_file_id}_{sublayer_idx}_NODE_VERSION", node_index=node_idx)
+            # 若路径解析为attribute且对应node_idx已存在，则执行更新逻辑
+            if has_table:
+                await update_record_reflect(f"proj_{project_id}", f"{model_file_id}_{sublayer_idx}_NODE_VERSION", {
+                    "attribute": r_attr.data,
+                    "version": 1,
+                }, node_index=node_idx)
+            else:
+                await create_records_reflect(f"proj_{project_id}", f"{model_file_id}_{sublayer_idx}_NODE_VERSION", [{
+                    "node_index": node_idx,
+                    "attribute": r_attr.data,
+                    "version": 1,
+                }])
         else:
-            logger.error(f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists.")
-            session.remove()
-            return {
-                "code": 400,
-                "msg": f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists."
-            }
-    elif res["type"] == "sublayer_meta":
-        sublayer_idx, model = res["data"]
-        sublayer = search_one_in_db(session, SublayerVersion, model_file_id=model_file_id, sublayer_index=sublayer_idx)
-        if sublayer:
-            record_id = create_record_in_db(session, model, False, meta=r_attr.data)
-            update_one_in_db(session, sublayer, False, sublayer_meta_version_id=record_id.id)
-        else:
-            logger.error(f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists.")
-            session.remove()
-            return {
-                "code": 400,
-                "msg": f"model_file_id: {model_file_id}, sublayer_idx: {sublayer_idx} sublayer records not exists."
-            }
-    elif res["type"] == "node_attr":
-        sublayer_idx, node_idx = res["data"]
-        has_table = search_record_reflect(f"proj_{project_id}", f"{model_file_id}_{sublayer_idx}_NODE_VERSION", node_index=node_idx)
-        # 若路径解析为attribute且对应node_idx已存在，则执行更新逻辑
-        if has_table:
-            update_record_reflect(f"proj_{project_id}", f"{model_file_id}_{sublayer_idx}_NODE_VERSION", {
-                "attribute": r_attr.data,
-                "version": 1,
-            }, node_index=node_idx)
-        else:
-            create_records_reflect(f"proj_{project_id}", f"{model_file_id}_{sublayer_idx}_NODE_VERSION", [{
-                "node_index": node_idx,
-                "attribute": r_attr.data,
-                "version": 1,
-            }])
+            raise NotImplemented
+        await session.commit()
+    if res["type"] in ("layer", "nodepage"):
+        await invalidate_nodepages(project_id, model_file_id)
+    if res["type"] == "node_attr":
+        await invalidate_attributes(project_id, model_file_id)
     else:
-        raise NotImplemented
-    session.commit()
-    session.remove()
+        await invalidate_model_file(project_id, model_file_id)
     return {
         "code": 200,  # 需要返回状态码用于转换器判断数据是否正确存储
         # "data": {
@@ -471,6 +646,132 @@ async def save_attribute_to_db(project_id: int, model_file_id: int, r_attr: RAtt
     }
 
 
+@router.post("/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_index}/nodes/attribute")
+async def save_node_attributes_to_db(project_id: int, model_file_id: int, sublayer_index: int, request: Request):
+    """
+    批量写入一个子层所有节点的属性，内部调用
+
+    请求体为 NDJSON(application/x-ndjson)，每行一个节点：
+
+    ```
+    {"node_index": 0, "attribute": {...}}
+    ```
+
+    所有节点在同一个事务中写入，已存在的节点执行更新；请求体边读取边解析，
+    每满 `model.attribute_batch_size` 个节点写入一批，不在内存中保留整个子层的属性
+    """
+    batch_size = config["model"].get("attribute_batch_size", 500)
+
+    def parse(line: bytes) -> dict:
+        item = json.loads(line)
+        return {"node_index": item["node_index"], "attribute": item["attribute"], "version": 1}
+
+    async def record_batches():
+        records = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    records.append(parse(line))
+                    if len(records) >= batch_size:
+                        yield records
+                        records = []
+        if buffer.strip():
+            records.append(parse(buffer))
+        if records:
+            yield records
+
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        count = await save_node_record_batches_reflect(
+            session, f"{model_file_id}_{sublayer_index}_NODE_VERSION", record_batches()
+        )
+    await invalidate_attributes(project_id, model_file_id)
+    return {
+        "code": 200,  # 需要返回状态码用于转换器判断数据是否正确存储
+        "data": {
+            "count": count,
+        }
+    }
+
+
+@router.post("/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_index}/fingerprints")
+async def save_sublayer_fingerprints(project_id: int, model_file_id: int, sublayer_index: int,
+                                     r_fingerprints: RFingerprints):
+    """
+    保存子层各节点的内容指纹，供同一模型的下一版本增量转换使用，内部调用
+    """
+    save_fingerprints(await get_uuid_from_mf(project_id, model_file_id), sublayer_index, r_fingerprints.fingerprints)
+    return {
+        "code": 200,
+    }
+
+
+@router.get("/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_index}/fingerprints/previous")
+async def get_previous_sublayer_fingerprints(project_id: int, model_file_id: int, sublayer_index: int):
+    """
+    获取同一模型中上一个转换成功的模型文件的子层节点指纹，内部调用
+
+    没有上一版本(或上一版本未保存指纹)时 data 为 null
+    """
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+        previous = await get_previous_model_file(session, mf) if mf else None
+    fingerprints = load_fingerprints(previous.uuid, sublayer_index) if previous else None
+    return {
+        "code": 200,
+        "data": {
+            "model_file_id": previous.id,
+            "fingerprints": fingerprints,
+        } if fingerprints else None,
+    }
+
+
+@router.post("/{project_id}/model-file/{model_file_id}/sublayers/{sublayer_index}/remap")
+async def remap_sublayer_nodes(project_id: int, model_file_id: int, sublayer_index: int, r_remap: RRemap):
+    """
+    增量转换时复用上一版本中未变化的节点，内部调用
+
+    节点的 geometry、纹理文件以硬链接的方式链接到当前模型文件，属性记录在数据库中直接复制，数据不经过转换器
+    """
+    output_file_root = config["model"]["slpk_root"]
+    source_uuid = await get_uuid_from_mf(project_id, r_remap.source_model_file_id)
+    target_uuid = await get_uuid_from_mf(project_id, model_file_id)
+    if source_uuid is None or target_uuid is None:
+        raise HTTPException(404, detail="no such model file.")
+    remap = [(new, old) for new, old in r_remap.remap]
+
+    def link_nodes() -> int:
+        files = 0
+        for new, old in remap:
+            files += link_tree(
+                os.path.join(output_file_root, source_uuid, "sublayers", f"{sublayer_index}", "nodes", f"{old}"),
+                os.path.join(output_file_root, target_uuid, "sublayers", f"{sublayer_index}", "nodes", f"{new}"),
+            )
+        return files
+
+    # 遍历目录与创建硬链接都是阻塞的文件系统调用，放到线程池中执行，不阻塞事件循环
+    files = await run_in_threadpool(link_nodes)
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        count = await copy_node_records_reflect(
+            session,
+            f"{r_remap.source_model_file_id}_{sublayer_index}_NODE_VERSION",
+            f"{model_file_id}_{sublayer_index}_NODE_VERSION",
+            remap,
+        )
+    await invalidate_attributes(project_id, model_file_id)
+    logger.info(f"model_file_id: {model_file_id}, sublayer: {sublayer_index}, remap {len(remap)} nodes, "
+                f"{files} files linked, {count} records copied.")
+    return {
+        "code": 200,
+        "data": {
+            "files": files,
+            "records": count,
+        }
+    }
+
+
 @router.get("/{project_id}/model-file/{model_file_id}/object/{object_id}/extended-attribute")
 async def get_object_extended_attribute():
     """
@@ -496,14 +797,13 @@ async def get_model(project_id: int, application_id: int = None, model_name: str
     - page_size:  分页大小
     - page_num:  第几页，从1开始
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    if model_name:
-        models = search_all_by_name(session, Model, model_name)
-    else:
-        models = search_all_in_db(session, Model)
-    if application_id:
-        models = list(filter(lambda m: application_id in m.app_id_list if m.app_id_list else [], models))
-    session.remove()
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        if model_name:
+            models = await search_all_by_name(session, Model, model_name)
+        else:
+            models = await search_all_in_db(session, Model)
+        if application_id:
+            models = list(filter(lambda m: application_id in m.app_id_list if m.app_id_list else [], models))
     total, res = split_page(list(models), page_size, page_num, sort_by, desc)
     return {
         "code": 200,
@@ -519,18 +819,18 @@ async def get_model_info_by_id(project_id: int, model_id: int):
     """
     根据id获取模型信息
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    res = search_one_in_db(session, Model, id=model_id)
-    if res:
-        return {
-            "code": 200,
-            "data": res
-        }
-    else:
-        return {
-            "code": 404,
-            "msg": "model not found."
-        }
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        res = await search_one_in_db(session, Model, id=model_id)
+        if res:
+            return {
+                "code": 200,
+                "data": res
+            }
+        else:
+            return {
+                "code": 404,
+                "msg": "model not found."
+            }
 
 
 @router.get("/{project_id}/model-file")
@@ -542,16 +842,15 @@ async def get_modelfile(project_id: int, modelfile_name: str = None, model_id: i
     - page_size:  分页大小
     - page_num:  第几页，从1开始
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    if model_id:
-        model = search_one_in_db(session, Model, id=model_id)
-        modelfiles = search_one_in_db_by_filter(session, ModelFile, model_id=model.id)
-    else:
-        modelfiles = search_all_in_db(session, ModelFile)
-    if modelfile_name:
-        modelfiles = filter(lambda mf: modelfile_name in mf.name, modelfiles)
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        if model_id:
+            model = await search_one_in_db(session, Model, id=model_id)
+            modelfiles = await search_one_in_db_by_filter(session, ModelFile, model_id=model.id)
+        else:
+            modelfiles = await search_all_in_db(session, ModelFile)
+        if modelfile_name:
+            modelfiles = filter(lambda mf: modelfile_name in mf.name, modelfiles)
 
-    session.remove()
     total, res = split_page(list(modelfiles), page_size, page_num, sort_by, desc)
     return {
         "code": 200,
@@ -567,18 +866,18 @@ async def get_modelfile_info_by_id(project_id: int, modelfile_id: int):
     """
     根据id获取模型信息
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    res = search_one_in_db(session, ModelFile, id=modelfile_id)
-    if res:
-        return {
-            "code": 200,
-            "data": res
-        }
-    else:
-        return {
-            "code": 404,
-            "msg": "modelfile not found."
-        }
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        res = await search_one_in_db(session, ModelFile, id=modelfile_id)
+        if res:
+            return {
+                "code": 200,
+                "data": res
+            }
+        else:
+            return {
+                "code": 404,
+                "msg": "modelfile not found."
+            }
 
 
 @router.post("/{project_id}/model-file/convert/{model_file_id}/status")
@@ -586,6 +885,9 @@ async def report_convert_status_by_converter(project_id: int, model_file_id: int
     """
     converter 上报模型转化状态
     当转化完成时，变更模型状态
+    processing 状态下 msg 可为 json 格式的上传进度(节点数、字节数、速率、预计剩余时间)，
+    success/fail 状态下可附带 metrics(各阶段的耗时、CPU 时间、字节数、节点数、峰值内存)，
+    均可通过获取转换任务状态的接口查询
     状态定义：
 
     ```
@@ -602,25 +904,37 @@ async def report_convert_status_by_converter(project_id: int, model_file_id: int
     **已完成**
     """
     # print(r_status)
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    mf = search_one_in_db(session, ModelFile, id=model_file_id)
-    if r_status.status == "processing":
-        update_one_in_db(session, mf, True, state="processing")
-    elif r_status.status == "success":
-        duration = int(r_status.msg)
-        update_one_in_db(session, mf, True, state="success", duration=duration)
-    elif r_status.status == "fail":
-        update_one_in_db(session, mf, True, state="fail")
-    elif r_status.status == "created":
-        if mf.state == "transfer":
-            update_one_in_db(session, mf, True, state="created")
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+        if r_status.status == "processing":
+            if mf.state != "processing":
+                await update_one_in_db(session, mf, True, state="processing")
+            await run_in_threadpool(get_convert_scheduler().report, project_id, model_file_id)
+            if r_status.msg:
+                try:
+                    set_convert_progress(project_id, model_file_id, json.loads(r_status.msg))
+                except ValueError:
+                    logger.warning(f"unrecognized progress: {r_status.msg}")
+        elif r_status.status == "success":
+            duration = int(r_status.msg)
+            await update_one_in_db(session, mf, True, state="success", duration=duration)
+            set_convert_progress(project_id, model_file_id)
+            await run_in_threadpool(get_convert_scheduler().finish, project_id, model_file_id, duration)
+        elif r_status.status == "fail":
+            await update_one_in_db(session, mf, True, state="fail")
+            set_convert_progress(project_id, model_file_id)
+            await run_in_threadpool(get_convert_scheduler().finish, project_id, model_file_id)
+        elif r_status.status == "created":
+            if mf.state == "transfer":
+                await update_one_in_db(session, mf, True, state="created")
+            else:
+                logging.error("Model file created only when uploaded!")
+                raise NotImplementedError
         else:
-            logging.error("Model file created only when uploaded!")
             raise NotImplementedError
-    else:
-        session.remove()
-        raise NotImplementedError
-    session.remove()
+    if r_status.metrics and r_status.status in ("success", "fail"):
+        logger.info(f"model_file_id: {model_file_id}, convert metrics: {r_status.metrics}")
+        await save_convert_metrics(project_id, model_file_id, r_status.metrics)
     return {
         "code": 200,  # 需要返回状态码用于转换器判断数据是否正确存储
         "data": {
@@ -637,61 +951,61 @@ async def set_model_transform(project_id: int, model_file_id: int, new_transform
     new_pos: 经纬度及高度
     """
     # TODO: change store extent
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    mf = search_one_in_db(session, ModelFile, id=model_file_id)
-    if not mf:
-        session.remove()
-        return {
-            "code": 404,
-            "msg": "model file not found."
-        }
-    layer = search_one_in_db(session, LayerVersion, id=mf.layer_version_id)
-    origin_model_center = np.array(layer.layer["ubm"]["model_center"])
-    new_model_center = np.array([
-        new_transform.position.longitude,
-        new_transform.position.latitude,
-        new_transform.position.z
-    ])
-
-    sublayer_ids = mf.sublayer_version_id
-    for sid in sublayer_ids:
-        sublayer = search_one_in_db(session, SublayerVersion, id=sid)
-        assert sublayer
-        # change sublayer fullextend and nodepage's obb
-        sublayer_info = search_one_in_db(session, SublayerInfoVersion, id=sublayer.sublayer_version_id)
-        nodepage = search_one_in_db(session, NodepageVersion, id=sublayer.nodepage_version_id)
-        assert sublayer_info
-        assert nodepage
-        sublayer_info_data = deepcopy(sublayer_info.sublayer)
-        origin_extent = sublayer_info_data.get("fullExtent")
-        extent_center = np.array([
-            (origin_extent["xmin"] + origin_extent["xmax"]) / 2,
-            (origin_extent["ymin"] + origin_extent["ymax"]) / 2,
-            (origin_extent["zmin"] + origin_extent["zmax"]) / 2,
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        mf = await search_one_in_db(session, ModelFile, id=model_file_id)
+        if not mf:
+            return {
+                "code": 404,
+                "msg": "model file not found."
+            }
+        layer = await search_one_in_db(session, LayerVersion, id=mf.layer_version_id)
+        origin_model_center = np.array(layer.layer["ubm"]["model_center"])
+        new_model_center = np.array([
+            new_transform.position.longitude,
+            new_transform.position.latitude,
+            new_transform.position.z
         ])
-        new_extent = deepcopy(origin_extent)
-        delta_extent_center = extent_center - origin_model_center
-        new_extent_center = new_model_center + delta_extent_center
-        new_extent["xmin"] = new_extent_center[0] + origin_extent["xmin"] - extent_center[0]
-        new_extent["ymin"] = new_extent_center[1] + origin_extent["ymin"] - extent_center[1]
-        new_extent["xmax"] = new_extent_center[0] + origin_extent["xmax"] - extent_center[0]
-        new_extent["ymax"] = new_extent_center[1] + origin_extent["ymax"] - extent_center[1]
-        new_extent["zmin"] = new_extent_center[2] + origin_extent["zmin"] - extent_center[2]
-        new_extent["zmax"] = new_extent_center[2] + origin_extent["zmax"] - extent_center[2]
-        sublayer_info_data["fullExtent"] = new_extent
-        update_one_in_db(session, sublayer_info, False, sublayer=sublayer_info_data)
-
-        nodepage_data = deepcopy(nodepage.nodepage.get("nodes"))
-        for node in nodepage_data:
-            node_pos = np.array(node["obb"]["center"]) - origin_model_center + new_model_center
-            node["obb"]["center"] = list(node_pos)
-        update_one_in_db(session, nodepage, False, nodepage={"nodes": nodepage_data})
-    new_layer = deepcopy(layer.layer)
-    new_layer["ubm"]["model_center"] = list(new_model_center)
-    print(new_layer["ubm"])
-    update_one_in_db(session, layer, False, layer=new_layer)
-    session.commit()
-    session.remove()
+
+        sublayer_ids = mf.sublayer_version_id
+        for sid in sublayer_ids:
+            sublayer = await search_one_in_db(session, SublayerVersion, id=sid)
+            assert sublayer
+            # change sublayer fullextend and nodepage's obb
+            sublayer_info = await search_one_in_db(session, SublayerInfoVersion, id=sublayer.sublayer_version_id)
+            nodepage = await search_one_in_db(session, NodepageVersion, id=sublayer.nodepage_version_id)
+            assert sublayer_info
+            assert nodepage
+            sublayer_info_data = deepcopy(sublayer_info.sublayer)
+            origin_extent = sublayer_info_data.get("fullExtent")
+            extent_center = np.array([
+                (origin_extent["xmin"] + origin_extent["xmax"]) / 2,
+                (origin_extent["ymin"] + origin_extent["ymax"]) / 2,
+                (origin_extent["zmin"] + origin_extent["zmax"]) / 2,
+            ])
+            new_extent = deepcopy(origin_extent)
+            delta_extent_center = extent_center - origin_model_center
+            new_extent_center = new_model_center + delta_extent_center
+            new_extent["xmin"] = new_extent_center[0] + origin_extent["xmin"] - extent_center[0]
+            new_extent["ymin"] = new_extent_center[1] + origin_extent["ymin"] - extent_center[1]
+            new_extent["xmax"] = new_extent_center[0] + origin_extent["xmax"] - extent_center[0]
+            new_extent["ymax"] = new_extent_center[1] + origin_extent["ymax"] - extent_center[1]
+            new_extent["zmin"] = new_extent_center[2] + origin_extent["zmin"] - extent_center[2]
+            new_extent["zmax"] = new_extent_center[2] + origin_extent["zmax"] - extent_center[2]
+            sublayer_info_data["fullExtent"] = new_extent
+            await update_one_in_db(session, sublayer_info, False, sublayer=sublayer_info_data)
+
+            nodepage_data = deepcopy(nodepage.nodepage.get("nodes"))
+            for node in nodepage_data:
+                node_pos = np.array(node["obb"]["center"]) - origin_model_center + new_model_center
+                node["obb"]["center"] = list(node_pos)
+            await update_one_in_db(session, nodepage, False, nodepage={"nodes": nodepage_data})
+        new_layer = deepcopy(layer.layer)
+        new_layer["ubm"]["model_center"] = list(new_model_center)
+        print(new_layer["ubm"])
+        await update_one_in_db(session, layer, False, layer=new_layer)
+        await session.commit()
+    await invalidate_nodepages(project_id, model_file_id)
+    await invalidate_model_file(project_id, model_file_id)
     return {
         "code": 200,
     }
@@ -1,23 +1,22 @@
 from config import logger
 import os
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Path, Response
+from fastapi import APIRouter, Depends, HTTPException, Path, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, HttpUrl
-from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy import (
-    text,
-    create_engine,
-    MetaData,
-    Table
-)
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
 
 from utils.common import split_page
-from db_model.common import SessionDispatcher, search_record_reflect, update_one_in_db, \
-    create_record_in_db, update_record_reflect, search_all_by_id_list, search_one_in_db
-from db_model.slpk_model import ModelFile, LayerVersion, MetaVersion, \
-    SublayerVersion, SublayerInfoVersion, NodepageVersion, SublayerMetaVersion, MaterialAttributeVersion
+from utils.compressed_variant import bytes_response, file_response, json_response
+from db_model.common import SessionDispatcher
+from db_model.async_common import update_one_in_db, create_record_in_db, search_all_by_id_list, search_one_in_db
+from db_model.slpk_model import ModelFile, SublayerInfoVersion, MaterialAttributeVersion
 from db_manager.model_manager import get_uuid_from_mf
+from db_manager.attribute_cache import get_attribute_buffer
+from db_manager.batch_fetch import BatchItem, iter_batch, validate_items
+from db_manager.model_file_cache import get_model_file, get_sublayer as get_resolved_sublayer, \
+    invalidate_model_file
+from db_manager.nodepage_cache import get_nodepage as get_cached_nodepage, nodepage_size
 from dependence import get_authorization_header
 from config import config
 
@@ -36,20 +35,28 @@ class RMaterialAttributeVersion(BaseModel):
     old_version_list: List[int] = None
 
 
+class RBatchItem(BaseModel):
+    sublayer: int
+    node: int
+    resource: str
+
+
+class RBatch(BaseModel):
+    items: List[RBatchItem]
+
+
 # 模型分发相关 api (slpk server)
 # TODO: 点云、斜摄的api支持
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer")
-async def get_scene_server(model_file_id: int, project_id: int, response: Response):
+async def get_scene_server(model_file_id: int, project_id: int, request: Request):
     """
     获取一个转换后的slpk模型文件server
 
     *已完成，未测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    slpk_scenelayer = session.query(LayerVersion).filter_by(id=slpk_model.layer_version_id).first()
-    if not slpk_scenelayer:
+    slpk_model = await get_model_file(project_id, model_file_id)
+    if not slpk_model or slpk_model.layer is None:
         raise HTTPException(
             status_code=404,
             detail=f"No server identified by id: {model_file_id}"
@@ -62,33 +69,26 @@ async def get_scene_server(model_file_id: int, project_id: int, response: Respon
     server["currentVersion"] = " "
     server["serviceVersion"] = " "
     server["supportedBuildings"] = ["REST"]
-    server["layers"] = [slpk_scenelayer.layer]
-    session.close()
-    response.headers["content-encoding"] = "gzip"
-    session.remove()
-    return server
+    server["layers"] = [slpk_model.layer]
+    return await json_response(request, server)
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/0")
-async def get_scene_layer(model_file_id: int, project_id: int, response: Response):
+async def get_scene_layer(model_file_id: int, project_id: int, request: Request):
     """
     获取一个转换后的slpk模型文件主层的3dSceneLayer.json
 
     **已完成，未测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    slpk_scenelayer = session.query(LayerVersion).filter_by(id=slpk_model.layer_version_id).first()
-    if not slpk_scenelayer:
+    slpk_model = await get_model_file(project_id, model_file_id)
+    if not slpk_model or slpk_model.layer is None:
         raise HTTPException(
             status_code=404,
             detail=f"No scene layer identified by id: {model_file_id}"
         )
 
-    response.headers["content-encoding"] = "gzip"
-    session.remove()
-    return slpk_scenelayer.layer
+    return await json_response(request, slpk_model.layer)
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/MaterialAttribute")
@@ -104,27 +104,25 @@ async def get_material_attribute(model_file_id: int, project_id: int, response:
     **已完成，通过简单测试**
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    id_list = slpk_model.material_attribute_version_id_list
-    if not id_list:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No MaterialAttribute in ModelFile identified: {model_file_id}"
-        )
-    if material_attribute_id and material_attribute_id in id_list:
-        slpk_attribute: MaterialAttributeVersion = session.query(MaterialAttributeVersion). \
-            filter(id=material_attribute_id).first()
-        if not slpk_attribute:
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        slpk_model = await search_one_in_db(session, ModelFile, id=model_file_id)
+        id_list = slpk_model.material_attribute_version_id_list if slpk_model else None
+        if not id_list:
             raise HTTPException(
                 status_code=404,
-                detail=f"No material attribute identified by MaterialAttribute id: {model_file_id}"
+                detail=f"No MaterialAttribute in ModelFile identified: {model_file_id}"
             )
-        response.headers["content-encoding"] = "gzip"
-        session.remove()
-        return slpk_attribute.attribute
-
-    material_attributes = search_all_by_id_list(session, MaterialAttributeVersion, id_list)
+        if material_attribute_id and material_attribute_id in id_list:
+            slpk_attribute: MaterialAttributeVersion = await search_one_in_db(
+                session, MaterialAttributeVersion, id=material_attribute_id)
+            if not slpk_attribute:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No material attribute identified by MaterialAttribute id: {model_file_id}"
+                )
+            return slpk_attribute.attribute
+
+        material_attributes = await search_all_by_id_list(session, MaterialAttributeVersion, id_list)
     total, res = split_page(list(material_attributes), page_size, page_num, sort_by, desc)
     return {
         "code": 200,
@@ -150,91 +148,85 @@ async def create_material_attribute(model_file_id: int, project_id: int,
     *已完成，未测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model: ModelFile = search_one_in_db(session, ModelFile, id=model_file_id)
-    id_list = list(slpk_model.material_attribute_version_id_list) if slpk_model.material_attribute_version_id_list else []
-    if material_attribute_id:
-        materialAttribute: MaterialAttributeVersion = session.query(MaterialAttributeVersion). \
-            filter_by(id=material_attribute_id).first()
-        if materialAttribute:
-            if material_attribute_id in id_list:
-                # 若指定ID已存在对应属性表，且已绑定到模型文件，则执行更新逻辑
-                new_record = {}
-                default = RMaterialAttributeVersion.dict(RMaterialAttributeVersion())
-                for k, v in r_materialAttribute:
-                    if k and v != default[k]:
-                        new_record[k] = v
-                update_one_in_db(session, materialAttribute, autocommit=True, **new_record)
-                print(materialAttribute.id)
-                session.remove()
-                return {
-                    "code": 200,
-                    "detail": f"An existing  material attribute identified by "
-                              f"`{materialAttribute.id}` updated successfully.",
-                    "data": materialAttribute
-                }
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        slpk_model: ModelFile = await search_one_in_db(session, ModelFile, id=model_file_id)
+        id_list = list(slpk_model.material_attribute_version_id_list or [])
+        if material_attribute_id:
+            materialAttribute: MaterialAttributeVersion = await search_one_in_db(
+                session, MaterialAttributeVersion, id=material_attribute_id)
+            if materialAttribute:
+                if material_attribute_id in id_list:
+                    # 若指定ID已存在对应属性表，且已绑定到模型文件，则执行更新逻辑
+                    new_record = {}
+                    default = RMaterialAttributeVersion.dict(RMaterialAttributeVersion())
+                    for k, v in r_materialAttribute:
+                        if k and v != default[k]:
+                            new_record[k] = v
+                    await update_one_in_db(session, materialAttribute, autocommit=True, **new_record)
+                    print(materialAttribute.id)
+                    return {
+                        "code": 200,
+                        "detail": f"An existing  material attribute identified by "
+                                  f"`{materialAttribute.id}` updated successfully.",
+                        "data": materialAttribute
+                    }
+                else:
+                    # 若指定ID已存在对应属性表，且未绑定到模型文件，则为模型文件绑定该材质属性
+                    id_list.append(material_attribute_id)
+                    slpk_model.material_attribute_version_id_list = tuple(id_list)
+                    return {
+                        "code": 200,
+                        "detail": f"An existing  material attribute identified by "
+                                  f"`{materialAttribute.id}` bound with model file `{model_file_id}` successfully.",
+                        "data": {
+                            "model_file_id": model_file_id,
+                            "materialAttribute": materialAttribute
+                        }
+                    }
             else:
-                # 若指定ID已存在对应属性表，且未绑定到模型文件，则为模型文件绑定该材质属性
-                id_list.append(material_attribute_id)
+                # 若ModelFile无对应材质属性信息，则根据RMaterialAttribute创建MaterialAttributeVersion
+                id_list.append(material_attribute_id) if material_attribute_id not in id_list else None
                 slpk_model.material_attribute_version_id_list = tuple(id_list)
+                materialAttribute = await create_record_in_db(
+                    session,
+                    MaterialAttributeVersion,
+                    autocommit=True,
+                    id=material_attribute_id,
+                    version=r_materialAttribute.version,
+                    attribute=r_materialAttribute.attribute,
+                    old_version_list=r_materialAttribute.old_version_list
+                )
                 return {
                     "code": 200,
-                    "detail": f"An existing  material attribute identified by "
-                              f"`{materialAttribute.id}` bound with model file `{model_file_id}` successfully.",
-                    "data": {
-                        "model_file_id": model_file_id,
-                        "materialAttribute": materialAttribute
-                    }
+                    "data": materialAttribute
                 }
         else:
-            # 若ModelFile无对应材质属性信息，则根据RMaterialAttribute创建MaterialAttributeVersion
-            id_list.append(material_attribute_id) if material_attribute_id not in id_list else None
-            slpk_model.material_attribute_version_id_list = tuple(id_list)
-            materialAttribute = create_record_in_db(
+            # 若未指定MaterialAttributeVersion的ID，则自增ID创建Mat表
+            materialAttribute = await create_record_in_db(
                 session,
                 MaterialAttributeVersion,
                 autocommit=True,
-                id=material_attribute_id,
                 version=r_materialAttribute.version,
                 attribute=r_materialAttribute.attribute,
                 old_version_list=r_materialAttribute.old_version_list
             )
-            session.remove()
             return {
                 "code": 200,
                 "data": materialAttribute
             }
-    else:
-        # 若未指定MaterialAttributeVersion的ID，则自增ID创建Mat表
-        materialAttribute = create_record_in_db(
-            session,
-            MaterialAttributeVersion,
-            autocommit=True,
-            version=r_materialAttribute.version,
-            attribute=r_materialAttribute.attribute,
-            old_version_list=r_materialAttribute.old_version_list
-        )
-        session.remove()
-        return {
-            "code": 200,
-            "data": materialAttribute
-        }
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/{layer_index}/sublayers/{sublayer_index}")
-async def get_sublayer(model_file_id: int, sublayer_index: int, project_id: int, response: Response):
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    sublayer_id_list = slpk_model.sublayer_version_id
-    sublayer = session.query(SublayerVersion). \
-        filter(SublayerVersion.id.in_(sublayer_id_list)).filter_by(sublayer_index=sublayer_index).first()
-    if sublayer:
-        session.remove()
-        sublayer_info = session.query(SublayerInfoVersion).filter_by(id=sublayer.sublayer_version_id).first()
-        response.headers["content-encoding"] = "gzip"
-        return sublayer_info.sublayer
-
-    session.remove()
+async def get_sublayer(model_file_id: int, sublayer_index: int, project_id: int, request: Request):
+    sublayer = await get_resolved_sublayer(project_id, model_file_id, sublayer_index)
+    if sublayer and sublayer.sublayer is not None:
+        sublayer_json = sublayer.sublayer
+        if "nodePages" in sublayer_json:
+            # 分页大小以服务端配置为准
+            node_pages = dict(sublayer_json["nodePages"], nodesPerPage=nodepage_size())
+            sublayer_json = dict(sublayer_json, nodePages=node_pages)
+        return await json_response(request, sublayer_json)
+
     raise HTTPException(
         status_code=404,
         detail=f"Sublayer indexed {sublayer_index} in model {model_file_id} Not Found"
@@ -243,26 +235,17 @@ async def get_sublayer(model_file_id: int, sublayer_index: int, project_id: int,
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/{layer_index}/sublayers/{sublayer_index}/ClassAttribute")
 async def get_class_attribute(model_file_id: int, sublayer_index: int, project_id: int,
-                              response: Response):
+                              request: Request):
     """
     获取一个转换后的slpk模型文件子层的类属性信息
 
     *已完成，通过简单测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    sublayer_id_list = slpk_model.sublayer_version_id
-    sublayer = session.query(SublayerVersion). \
-        filter(SublayerVersion.id.in_(sublayer_id_list)).filter_by(sublayer_index=sublayer_index).first()
-    sublayer_info: SublayerInfoVersion = session.query(SublayerInfoVersion).filter_by(
-        id=sublayer.sublayer_version_id).first()
-    if sublayer_info and sublayer_info.sublayer_attribute:
-        session.remove()
-        response.headers["content-encoding"] = "gzip"
-        return sublayer_info.sublayer_attribute
-
-    session.remove()
+    sublayer = await get_resolved_sublayer(project_id, model_file_id, sublayer_index)
+    if sublayer and sublayer.sublayer_attribute:
+        return await json_response(request, sublayer.sublayer_attribute)
+
     raise HTTPException(
         status_code=404,
         detail=f"Sublayer attribute indexed {sublayer_index} in model {model_file_id} Not Found"
@@ -279,25 +262,21 @@ async def update_class_attribute(model_file_id: int, sublayer_index: int, projec
     *已完成，通过简单测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    sublayer_id_list = slpk_model.sublayer_version_id
-    sublayer = session.query(SublayerVersion). \
-        filter(SublayerVersion.id.in_(sublayer_id_list)).filter_by(sublayer_index=sublayer_index).first()
-    sublayer_info: SublayerInfoVersion = session.query(SublayerInfoVersion).filter_by(
-        id=sublayer.sublayer_version_id).first()
+    sublayer = await get_resolved_sublayer(project_id, model_file_id, sublayer_index)
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        sublayer_info: SublayerInfoVersion = await search_one_in_db(
+            session, SublayerInfoVersion, id=sublayer.sublayer_version_id) if sublayer else None
+        if sublayer_info:
+            sublayer_info.sublayer_attribute = _sublayerAttribute
+            session.add(sublayer_info)
+            await session.commit()
+            print(sublayer_info.sublayer_attribute)
     if sublayer_info:
-        sublayer_info.sublayer_attribute = _sublayerAttribute
-        session.add(sublayer_info)
-        session.commit()
-        print(sublayer_info.sublayer_attribute)
-        session.remove()
-
+        await invalidate_model_file(project_id, model_file_id)
         return {
             "code": 200,
             "data": sublayer_info.sublayer_attribute
         }
-    session.remove()
     raise HTTPException(
         status_code=404,
         detail=f"Sublayer attribute indexed {sublayer_index} in model {model_file_id} Not Found"
@@ -307,29 +286,14 @@ async def update_class_attribute(model_file_id: int, sublayer_index: int, projec
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/"
             "{layer_index}/sublayers/{sublayer_index}/nodepages/{nodepage_index}")
 async def get_nodepage(model_file_id: int, layer_index: int, sublayer_index: int, nodepage_index: int, project_id: int,
-                       response: Response):
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    sublayer_id_list = slpk_model.sublayer_version_id
-    sublayer = session.query(SublayerVersion). \
-        filter(SublayerVersion.id.in_(sublayer_id_list)).filter_by(sublayer_index=sublayer_index).first()
-
-    if sublayer:
-        nodes_range = [nodepage_index * 64, (nodepage_index + 1) * 64]
-        integrated_nodepage = session.query(NodepageVersion).filter_by(id=sublayer.nodepage_version_id).first()
-        nodepage_json_data = integrated_nodepage.nodepage
-        # 此处遍历可优化
-        # for item in nodepage_json_data["nodes"]:
-        #     for i in range(nodes_range[0], nodes_range[1]):
-        #         if i == item["index"]:
-        #             nodes.append(item)
-        #             break
-        nodes = nodepage_json_data["nodes"][nodes_range[0]:nodes_range[1]]
-        response.headers["content-encoding"] = "gzip"
-        session.remove()
-        return {"nodes": nodes}
-
-    session.remove()
+                       request: Request):
+    """
+    按页返回子层的节点，每页节点数由 `config["model"]["nodepage_size"]` 配置，已切分的页缓存在内存中
+    """
+    nodes = await get_cached_nodepage(project_id, model_file_id, sublayer_index, nodepage_index)
+    if nodes is not None:
+        return await json_response(request, {"nodes": nodes})
+
     raise HTTPException(
         status_code=404,
         detail="Nodepage Not Found"
@@ -339,78 +303,69 @@ async def get_nodepage(model_file_id: int, layer_index: int, sublayer_index: int
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/"
             "{layer_index}/sublayers/{sublayer_index}/nodes/{node_index}/geometries/{geometry_index}")
 async def get_node_geometry(model_file_id: int, layer_index: int, sublayer_index: int, node_index: int,
-                            geometry_index: int, project_id: int, response: Response):
+                            geometry_index: int, project_id: int, request: Request):
     """
-    有改动，待测试
+    按 Accept-Encoding 返回预压缩文件，支持 ETag/Last-Modified 条件请求及 Range
     """
-    slpk_uuid = get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    slpk_uuid = await get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    if slpk_uuid is None:
+        raise HTTPException(status_code=404, detail=f"No model file identified by id: {model_file_id}")
     slpk_root = config["model"]["slpk_root"]
     geometry_path = os.path.join(slpk_root, slpk_uuid, "sublayers", f"{sublayer_index}",
                                  "nodes", f"{node_index}", "geometries", f"{geometry_index}.bin")
-    response.headers["content-encoding"] = "gzip"
-    return FileResponse(geometry_path, filename=f"{geometry_index}.bin")
+    return await file_response(request, geometry_path)
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/"
             "{layer_index}/sublayers/{sublayer_index}/nodes/{node_index}/textures/0_0_1")
 async def get_node_texture(model_file_id: int, layer_index: int, sublayer_index: int, node_index: int,
-                           project_id: int, response: Response):
+                           project_id: int, request: Request):
     """
-    有改动，待测试
+    按 Accept-Encoding 返回预压缩文件，支持 ETag/Last-Modified 条件请求及 Range
     """
-    slpk_uuid = get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    slpk_uuid = await get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    if slpk_uuid is None:
+        raise HTTPException(status_code=404, detail=f"No model file identified by id: {model_file_id}")
     slpk_root = config["model"]["slpk_root"]
     texture_path = os.path.join(slpk_root, slpk_uuid, "sublayers", f"{sublayer_index}",
                                 "nodes", f"{node_index}", "textures", "0_0_1.bin.dds")
-    response.headers["content-encoding"] = "gzip"
-    return FileResponse(texture_path, filename=f"0_0_1.bin.dds")
+    return await file_response(request, texture_path)
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/"
             "{layer_index}/sublayers/{sublayer_index}/nodes/{node_index}/attributes/{attributes_key}/0")
 async def get_node_attribute(model_file_id: int, layer_index: int, sublayer_index: int, node_index: int,
-                             attributes_key: str, project_id: int, response: Response):
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    model_file = search_one_in_db(session, ModelFile, id=model_file_id)
-    # TODO: FIXME 可被注入，但是使用反射会对性能造成很大影响，需重新考虑实现
-    sql = f"SELECT attribute FROM \"{model_file.id}_{sublayer_index}_NODE_VERSION\" WHERE node_index = {node_index}"
-    attribute = session.execute(text(sql)).fetchall()[0]["attribute"]
-    # attribute = search_record_reflect(
-    #     f"proj_{project_id}",
-    #     f"{model_file.id}_{sublayer_index}_NODE_VERSION",
-    #     node_index=node_index
-    # )["attribute"]
+                             attributes_key: str, project_id: int, request: Request):
+    """
+    返回节点单个字段的属性二进制，节点的各字段在首次请求时一次性编码并缓存
+    """
     attribute_id = int(attributes_key.split("_", 1)[1])
-    values: List[str] = attribute["value"][attribute_id]
-    byte_counts: List[int] = attribute["size_bytes"][attribute_id]
-    count = len(byte_counts)
-    binary_response: List[bytes] = []
-    if attribute_id != 0:
-        size = sum(byte_counts)
-        binary_response.append(count.to_bytes(4, "little", signed=False))
-        binary_response.append(size.to_bytes(4, "little", signed=False))
-        for byte_count in byte_counts:
-            binary_byte_count = byte_count.to_bytes(4, "little", signed=False)
-            binary_response.append(binary_byte_count)
-        for value in values:
-            if value is not None:
-                binary_response.append(value.encode())
-            binary_response.append(0x00.to_bytes(1, "little", signed=False))
-    elif attribute_id == 0:
-        binary_response.append(count.to_bytes(4, "little", signed=False))
-        values: List[int]
-        for value in values:
-            binary_response.append(value.to_bytes(4, "little", signed=False))
-    response.headers["content-encoding"] = "gzip"
-    content_length = 0
-    for i in binary_response:
-        content_length += i.__len__()
-    response.headers["content-length"] = f"{content_length}"
-    session.remove()
-    return StreamingResponse(
-        binary_response.__iter__(),
-        media_type="application/octet-stream"
-    )
+    buffer = await get_attribute_buffer(project_id, model_file_id, sublayer_index, node_index, attribute_id)
+    if buffer is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Attribute {attributes_key} of node {node_index} in sublayer {sublayer_index} Not Found"
+        )
+    return await bytes_response(request, buffer, "application/octet-stream")
+
+
+@router.post("/{project_id}/slpk/{model_file_id}/SceneServer/layers/{layer_index}/nodes/batch")
+async def get_nodes_batch(model_file_id: int, layer_index: int, project_id: int, r_batch: RBatch):
+    """
+    批量获取节点的 geometry、纹理及属性，返回按长度分帧的二进制流，格式见 db_manager/batch_fetch.py
+
+    resource 与单个资源接口的路径后缀一致：`geometries/1`、`textures/0_0_1`、`attributes/f_0/0`
+    """
+    items = [BatchItem(item.sublayer, item.node, item.resource) for item in r_batch.items]
+    try:
+        validate_items(items)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    slpk_uuid = await get_uuid_from_mf(project_id=project_id, model_file_id=model_file_id)
+    if slpk_uuid is None:
+        raise HTTPException(status_code=404, detail=f"No model file identified by id: {model_file_id}")
+    return StreamingResponse(iter_batch(project_id, model_file_id, slpk_uuid, items),
+                             media_type="application/octet-stream")
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/"
@@ -423,14 +378,12 @@ async def get_custom_attribute(model_file_id: int, sublayer_index: int, node_ind
     *已完成，未测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    model_file = search_one_in_db(session, ModelFile, id=model_file_id)
-    sql = f"SELECT custom_attribute FROM " \
-          f"\"{model_file.id}_{sublayer_index}_NODE_VERSION\"" \
-          f" WHERE node_index = {node_index} "
-    custom_attribute = session.execute(text(sql)).fetchall()[0]["custom_attribute"]
-    response.headers["content-encoding"] = "gzip"
-    session.remove()
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        model_file = await search_one_in_db(session, ModelFile, id=model_file_id)
+        sql = f"SELECT custom_attribute FROM " \
+              f"\"{model_file.id}_{sublayer_index}_NODE_VERSION\"" \
+              f" WHERE node_index = {node_index} "
+        custom_attribute = (await session.execute(text(sql))).all()[0].custom_attribute
     return {
         "code": 200,
         "data": custom_attribute
@@ -449,23 +402,23 @@ async def update_custom_attribute(model_file_id: int, sublayer_index: int, node_
     *已完成，通过简单测试*
 
     """
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    model_file = search_one_in_db(session, ModelFile, id=model_file_id)
-    select_sql = f"SELECT custom_attribute FROM " \
-                 f"\"{model_file.id}_{sublayer_index}_NODE_VERSION\"" \
-                 f" WHERE node_index = {node_index}"
-    custom_attribute = session.execute(text(select_sql)).fetchall()[0]["custom_attribute"]
-    update_sql_prefix = f"UPDATE \"{model_file.id}_{sublayer_index}_NODE_VERSION\" SET custom_attribute = "
-    update_sql_postfix = f"WHERE node_index = {node_index}"
-    for k, v in _customAttribute.items():
-        if v and k in custom_attribute:
-            print(f"{k},{v}")
-            # 目前只能更新基本数据类型，且全部转换为string
-            update_sql = update_sql_prefix + f"(jsonb_set(custom_attribute,'{{{k}}}','\"{v}\"'))" + update_sql_postfix
-            session.execute(text(update_sql))
-    session.commit()
+    async with SessionDispatcher().get_async_session(f"proj_{project_id}") as session:
+        model_file = await search_one_in_db(session, ModelFile, id=model_file_id)
+        select_sql = f"SELECT custom_attribute FROM " \
+                     f"\"{model_file.id}_{sublayer_index}_NODE_VERSION\"" \
+                     f" WHERE node_index = {node_index}"
+        custom_attribute = (await session.execute(text(select_sql))).all()[0].custom_attribute
+        update_sql_prefix = f"UPDATE \"{model_file.id}_{sublayer_index}_NODE_VERSION\" SET custom_attribute = "
+        update_sql_postfix = f"WHERE node_index = {node_index}"
+        for k, v in _customAttribute.items():
+            if v and k in custom_attribute:
+                print(f"{k},{v}")
+                # 目前只能更新基本数据类型，且全部转换为string
+                update_sql = update_sql_prefix + f"(jsonb_set(custom_attribute,'{{{k}}}','\"{v}\"'))" + \
+                    update_sql_postfix
+                await session.execute(text(update_sql))
+        await session.commit()
     print(custom_attribute)
-    session.remove()
     return {
         "code": 200,
         "data": custom_attribute
@@ -474,23 +427,22 @@ async def update_custom_attribute(model_file_id: int, sublayer_index: int, node_
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/{layer_index}/sublayers/{sublayer_index}/metadata")
 async def get_sublayer_meta(model_file_id: int, layer_index: int, sublayer_index: int, project_id: int,
-                            response: Response):
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    sublayer_id_list = slpk_model.sublayer_version_id
-    sublayer = session.query(SublayerVersion). \
-        filter(SublayerVersion.id.in_(sublayer_id_list)).filter_by(sublayer_index=sublayer_index).first()
-    sublayer_meta = session.query(SublayerMetaVersion).filter_by(id=sublayer.sublayer_meta_version_id).first()
-    response.headers["content-encoding"] = "gzip"
-    session.remove()
-    return sublayer_meta.meta
+                            request: Request):
+    sublayer = await get_resolved_sublayer(project_id, model_file_id, sublayer_index)
+    if not sublayer or sublayer.meta is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Sublayer metadata indexed {sublayer_index} in model {model_file_id} Not Found"
+        )
+    return await json_response(request, sublayer.meta)
 
 
 @router.get("/{project_id}/slpk/{model_file_id}/SceneServer/layers/{layer_index}/metadata")
-async def get_scene_layer_meta(model_file_id: int, layer_index: int, project_id: int, response: Response):
-    session = SessionDispatcher().get_session(f"proj_{project_id}")
-    slpk_model = search_one_in_db(session, ModelFile, id=model_file_id)
-    metadata = session.query(MetaVersion).filter_by(id=slpk_model.meta_version_id).first()
-    response.headers["content-encoding"] = "gzip"
-    session.remove()
-    return metadata.meta
+async def get_scene_layer_meta(model_file_id: int, layer_index: int, project_id: int, request: Request):
+    slpk_model = await get_model_file(project_id, model_file_id)
+    if not slpk_model or slpk_model.meta is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Metadata of model {model_file_id} Not Found"
+        )
+    return await json_response(request, slpk_model.meta)
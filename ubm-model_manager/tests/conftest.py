@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+from types import ModuleType, SimpleNamespace
+
+import pytest
+
+# 模块以 model manager 根目录为工作目录导入(`from config import config`)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# config.py 随部署环境下发，不在仓库中；缺失时注册一份测试用配置，不连接数据库与消息队列
+try:
+    import config  # noqa: F401
+except ImportError:
+    from loguru import logger
+
+    module = ModuleType("config")
+    module.logger = logger
+    module.config = {
+        "pg": {"user": "postgres", "password": "postgres", "host": "127.0.0.1", "port": 5432, "db_name": "dtbim"},
+        "celery": {"broker": "memory://", "backend": "cache+memory://"},
+        "model": {"slpk_root": tempfile.mkdtemp(prefix="slpk_")},
+        "scheduler": {},
+    }
+    sys.modules["config"] = module
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    """
+    替换 LRUCache 使用的 time.monotonic，用于测试过期
+    """
+    from utils import cache
+
+    fake = Clock()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=fake))
+    return fake
+
+
+@pytest.fixture
+def slpk_root(tmp_path, monkeypatch) -> str:
+    """
+    将 `config["model"]["slpk_root"]` 指向临时目录
+    """
+    from config import config
+
+    monkeypatch.setitem(config["model"], "slpk_root", str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def versions(monkeypatch, clock) -> dict:
+    """
+    以字典代替数据库中的 cache_version 表，{(project_id, model_file_id, 缓存名): 版本号}；
+    直接修改字典相当于其他 worker 进程的写入
+    """
+    from db_manager import cache_version
+    from utils.cache import LRUCache
+
+    store = {}
+
+    async def load_version(project_id, model_file_id, name):
+        return store.get((project_id, model_file_id, name), 0)
+
+    async def increment_version(project_id, model_file_id, name):
+        key = (project_id, model_file_id, name)
+        store[key] = store.get(key, 0) + 1
+        return store[key]
+
+    monkeypatch.setattr(cache_version, "load_version", load_version)
+    monkeypatch.setattr(cache_version, "increment_version", increment_version)
+    monkeypatch.setattr(cache_version, "_cache", LRUCache(64, 1))
+    return store
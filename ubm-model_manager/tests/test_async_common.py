@@ -0,0 +1,179 @@
+"""
+异步数据访问的集成测试，需要可连接的 PostgreSQL(`config["pg"]`)，连接不上时跳过；
+测试在独立的表中进行，结束后删除
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, URL, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from db_model import async_common
+from db_model.common import ModelBase, define_node_table
+
+pytest.importorskip("asyncpg")
+
+RecordBase = declarative_base(cls=ModelBase)
+
+
+class AsyncCommonRecord(RecordBase):
+    __tablename__ = f"async_common_record_{os.getpid()}"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    state = Column(String)
+
+
+SOURCE_TABLE = f"{os.getpid()}_0_NODE_VERSION"
+TARGET_TABLE = f"{os.getpid()}_1_NODE_VERSION"
+
+
+def database_url() -> URL:
+    from config import config
+
+    pg = config["pg"]
+    return URL.create("postgresql+asyncpg", pg["user"], pg["password"], pg["host"], pg["port"], pg["db_name"])
+
+
+def run(test):
+    """
+    在新的事件循环中以独立的连接执行 test(session)
+    """
+    async def main():
+        engine = create_async_engine(database_url(), poolclass=NullPool)
+        try:
+            async with sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)() as session:
+                return await test(session)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    meta = MetaData()
+    for name in (SOURCE_TABLE, TARGET_TABLE):
+        define_node_table(meta, name)
+
+    async def create(session):
+        async with session.bind.begin() as conn:
+            await conn.run_sync(RecordBase.metadata.create_all)
+            await conn.run_sync(meta.create_all)
+
+    async def drop(session):
+        async with session.bind.begin() as conn:
+            await conn.run_sync(meta.drop_all)
+            await conn.run_sync(RecordBase.metadata.drop_all)
+
+    try:
+        run(create)
+    except (OSError, asyncio.TimeoutError) as e:
+        pytest.skip(f"postgres not reachable: {e}")
+    async_common._reflected_tables.clear()
+    yield
+    run(drop)
+
+
+def test_create_search_update(tables):
+    async def test(session):
+        record = await async_common.create_record_in_db(session, AsyncCommonRecord, True, name="a", state="created")
+        # 提交后仍可读取数据库生成的字段
+        assert record.id and record.create_time
+        await async_common.create_records_in_db(session, AsyncCommonRecord, True, ["name"], [["ab"], ["c"]])
+        assert (await async_common.search_one_in_db(session, AsyncCommonRecord, name="c")).name == "c"
+        assert await async_common.search_one_in_db(session, AsyncCommonRecord, name="x") is None
+        assert len(await async_common.search_one_in_db_by_filter(session, AsyncCommonRecord, state=None)) == 2
+        assert len(await async_common.search_all_in_db(session, AsyncCommonRecord)) == 3
+        assert {r.name for r in await async_common.search_all_by_name(session, AsyncCommonRecord, "a")} == {"a", "ab"}
+        assert [r.name for r in await async_common.search_all_by_id_list(session, AsyncCommonRecord, [record.id])] == \
+            ["a"]
+        # 值为空的字段不更新
+        await async_common.update_one_in_db(session, record, True, state="waiting", name=None)
+        result = await session.execute(
+            select(AsyncCommonRecord.name, AsyncCommonRecord.state).filter_by(id=record.id)
+        )
+        assert result.one() == ("a", "waiting")
+
+    run(test)
+
+
+def test_create_without_commit_rolls_back(tables):
+    async def test(session):
+        record = await async_common.create_record_in_db(session, AsyncCommonRecord, False, name="a")
+        assert record.id
+        await session.rollback()
+        assert await async_common.search_all_in_db(session, AsyncCommonRecord) == []
+
+    run(test)
+
+
+def node(node_index: int, version: int = 1, attribute: dict = None) -> dict:
+    return {"node_index": node_index, "version": version, "attribute": attribute or {"node": node_index}}
+
+
+def test_save_node_record_batches(tables):
+    async def batches():
+        yield [node(0), node(1)]
+        yield []
+        # 同一批中重复的 node_index 以最后一条为准，后面批次覆盖前面的写入
+        yield [node(1, 2), node(1, 3), node(2)]
+
+    async def test(session):
+        assert await async_common.save_node_record_batches_reflect(session, SOURCE_TABLE, batches()) == 4
+        rows = (await session.execute(text(
+            f'SELECT node_index, version, attribute FROM "{SOURCE_TABLE}" ORDER BY node_index'
+        ))).all()
+        assert [tuple(row) for row in rows] == [(0, 1, {"node": 0}), (1, 3, {"node": 1}), (2, 1, {"node": 2})]
+
+    run(test)
+
+
+def test_reflect_helpers(tables, monkeypatch):
+    async def test(session):
+        # 按库名取 engine 的辅助函数使用测试的连接
+        monkeypatch.setattr(async_common, "SessionDispatcher",
+                            lambda: SimpleNamespace(get_async_engine=lambda db_name: session.bind))
+        await async_common.create_records_reflect("proj_1", SOURCE_TABLE, [node(0), node(1)])
+        assert (await async_common.search_record_reflect("proj_1", SOURCE_TABLE, node_index=1)).attribute == \
+            {"node": 1}
+        assert len(await async_common.search_record_reflect("proj_1", SOURCE_TABLE, search_one=False)) == 2
+        # 值为空或表中不存在的字段不更新
+        await async_common.update_record_reflect("proj_1", SOURCE_TABLE, {"version": 2, "category_id": None,
+                                                                         "unknown": 1}, node_index=1)
+        rows = await async_common.search_record_reflect("proj_1", SOURCE_TABLE, search_one=False)
+        assert sorted((row.node_index, row.version, row.category_id) for row in rows) == [(0, 1, None), (1, 2, None)]
+        async with session.bind.connect() as conn:
+            # reflect 结果按 (数据库, 表名) 缓存
+            table = await async_common.reflect_table(conn, SOURCE_TABLE)
+            assert await async_common.reflect_table(conn, SOURCE_TABLE) is table
+
+    run(test)
+
+
+def test_copy_node_records(tables):
+    async def setup(session):
+        async def batches():
+            yield [node(0), node(1), node(2)]
+
+        await async_common.save_node_record_batches_reflect(session, SOURCE_TABLE, batches())
+
+        async def target():
+            yield [node(5, 9, {"stale": True})]
+
+        await async_common.save_node_record_batches_reflect(session, TARGET_TABLE, target())
+
+    async def test(session):
+        assert await async_common.copy_node_records_reflect(session, SOURCE_TABLE, TARGET_TABLE, []) == 0
+        assert await async_common.copy_node_records_reflect(session, SOURCE_TABLE, TARGET_TABLE, [(5, 2), (6, 0)]) == 2
+        rows = (await session.execute(text(
+            f'SELECT node_index, version, attribute FROM "{TARGET_TABLE}" ORDER BY node_index'
+        ))).all()
+        assert [tuple(row) for row in rows] == [(5, 1, {"node": 2}), (6, 1, {"node": 0})]
+
+    run(setup)
+    run(test)
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from db_manager import attribute_cache
+from utils.attribute_codec import encode_attributes
+from utils.cache import LRUCache
+
+PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX = 1, 2, 0
+
+
+def make_attribute(node_index: int, name: str = "Wall") -> dict:
+    values = [f"{name}-{node_index}-{i}" for i in range(3)]
+    return {
+        "value": [[node_index * 10 + i for i in range(3)], values],
+        "size_bytes": [[4] * 3, [len(value.encode()) + 1 for value in values]],
+    }
+
+
+@pytest.fixture
+def store(monkeypatch, clock, versions):
+    """
+    以字典代替数据库，记录每次加载的节点
+    """
+    attributes = {node_index: make_attribute(node_index) for node_index in range(4)}
+    loads = []
+
+    async def load_attribute(project_id, model_file_id, sublayer_index, node_index):
+        loads.append([node_index])
+        return attributes.get(node_index)
+
+    async def load_attributes(project_id, model_file_id, sublayer_index, node_indexes):
+        loads.append(list(node_indexes))
+        return {node_index: attributes[node_index] for node_index in node_indexes if node_index in attributes}
+
+    monkeypatch.setattr(attribute_cache, "load_attribute", load_attribute)
+    monkeypatch.setattr(attribute_cache, "load_attributes", load_attributes)
+    monkeypatch.setattr(attribute_cache, "_cache", LRUCache(256, 300))
+    return attributes, loads
+
+
+def get_buffer(node_index: int, attribute_id: int):
+    return asyncio.run(
+        attribute_cache.get_attribute_buffer(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX, node_index, attribute_id)
+    )
+
+
+def test_all_fields_cached_after_one_load(store):
+    attributes, loads = store
+    expected = encode_attributes(attributes[1])
+    assert get_buffer(1, 1) == expected[1]
+    assert get_buffer(1, 0) == expected[0]
+    assert loads == [[1]]
+
+
+def test_missing_node_or_field(store):
+    assert get_buffer(9, 0) is None
+    assert get_buffer(1, 5) is None
+
+
+def test_invalidate_model_file_bumps_version(store):
+    attributes, loads = store
+    get_buffer(1, 1)
+    attributes[1] = make_attribute(1, "Door")
+    asyncio.run(attribute_cache.invalidate_attributes(PROJECT_ID, MODEL_FILE_ID))
+    assert get_buffer(1, 1) == encode_attributes(attributes[1])[1]
+    assert len(loads) == 2
+
+
+def test_ttl_expiry_reloads(store, clock):
+    _, loads = store
+    get_buffer(1, 1)
+    clock.advance(301)
+    get_buffer(1, 1)
+    assert len(loads) == 2
+
+
+def test_batch_loads_missing_nodes_in_one_query(store):
+    attributes, loads = store
+    get_buffer(0, 1)
+    fields = [(0, 1), (1, 0), (1, 1), (2, 1), (9, 0)]
+    result = asyncio.run(attribute_cache.get_attribute_buffers(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX, fields))
+
+    assert loads == [[0], [1, 2, 9]]
+    assert result[(0, 1)] == encode_attributes(attributes[0])[1]
+    assert result[(1, 0)] == encode_attributes(attributes[1])[0]
+    assert result[(2, 1)] == encode_attributes(attributes[2])[1]
+    assert result[(9, 0)] is None
+
+
+def test_invalidate_from_other_worker(store, versions, clock):
+    attributes, loads = store
+    get_buffer(1, 1)
+    attributes[1] = make_attribute(1, "Door")
+    versions[(PROJECT_ID, MODEL_FILE_ID, attribute_cache.CACHE_NAME)] = 1
+    assert get_buffer(1, 1) == encode_attributes(make_attribute(1))[1]
+    clock.advance(2)
+    assert get_buffer(1, 1) == encode_attributes(attributes[1])[1]
+    assert len(loads) == 2
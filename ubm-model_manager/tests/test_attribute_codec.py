@@ -0,0 +1,73 @@
+"""
+属性编码的一致性测试
+
+converter 写入 SLPK 的属性与这里按需生成的属性必须逐字节一致。两个服务各有一份实现，
+两边的测试使用同一组固定的编码结果(GOLDEN)；同时检出了 converter(同级目录或 `model_converter` 子模块)时，
+再用随机数据直接比较两份实现的结果。
+"""
+import importlib.util
+import os
+import random
+
+import pytest
+
+from tests.conftest import ROOT
+from utils.attribute_codec import encode_attribute, encode_attributes, decode_attribute
+
+# 与 converter 的 tests/test_attribute_codec.py 相同
+GOLDEN = [
+    (0, [1, 2, 4294967295], [4, 4, 4], "030000000100000002000000ffffffff"),
+    (1, ["Wall", None, "基本墙"], [5, 1, 10],
+     "030000001000000005000000010000000a00000057616c6c0000e59fbae69cace5a29900"),
+    (1, [], [], "0000000000000000"),
+]
+
+CONVERTER_CODEC_PATHS = [
+    os.path.join(ROOT, "model_converter", "src", "utils", "attribute_codec.py"),
+    os.path.join(os.path.dirname(ROOT), "ubm-model_converter", "utils", "attribute_codec.py"),
+]
+
+
+def random_attribute(rnd: random.Random, count: int) -> dict:
+    ids = [rnd.randrange(1 << 32) for _ in range(count)]
+    names = [None if rnd.random() < 0.1 else rnd.choice(["Wall", "基本墙", "门-单扇"]) + str(i) for i in range(count)]
+    return {
+        "value": [ids, names],
+        "size_bytes": [[4] * count, [len((name or "").encode()) + 1 for name in names]],
+    }
+
+
+@pytest.mark.parametrize("attribute_id,values,byte_counts,expected", GOLDEN)
+def test_encode_attribute_golden(attribute_id, values, byte_counts, expected):
+    assert encode_attribute(attribute_id, values, byte_counts).hex() == expected
+
+
+@pytest.mark.parametrize("attribute_id,values,byte_counts,expected", GOLDEN)
+def test_decode_attribute_golden(attribute_id, values, byte_counts, expected):
+    decoded, decoded_counts = decode_attribute(attribute_id, bytes.fromhex(expected))
+    if attribute_id == 0:
+        assert decoded == values and decoded_counts is None
+    else:
+        assert decoded == ["" if value is None else value for value in values]
+        assert decoded_counts == byte_counts
+
+
+def test_round_trip():
+    attribute = random_attribute(random.Random(0), 500)
+    for attribute_id, data in enumerate(encode_attributes(attribute)):
+        decoded, _ = decode_attribute(attribute_id, data)
+        assert decoded == [value if value is not None else "" for value in attribute["value"][attribute_id]]
+
+
+def test_parity_with_converter():
+    path = next((path for path in CONVERTER_CODEC_PATHS if os.path.isfile(path)), None)
+    if path is None:
+        pytest.skip("converter source not checked out")
+    spec = importlib.util.spec_from_file_location("converter_attribute_codec", path)
+    converter_codec = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(converter_codec)
+
+    rnd = random.Random(1)
+    for count in (0, 1, 100, 2000):
+        attribute = random_attribute(rnd, count)
+        assert converter_codec.encode_attributes(attribute) == encode_attributes(attribute)
@@ -0,0 +1,141 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
+import pytest
+
+from db_manager import batch_fetch
+from db_manager.batch_fetch import FRAME_HEADER, MISSING, BatchItem
+
+PROJECT_ID, MODEL_FILE_ID, SLPK_UUID = 1, 2, "uuid-2"
+
+
+def parse_frames(body: bytes) -> Dict[int, Optional[bytes]]:
+    """
+    按客户端的方式解析分帧的响应
+    """
+    frames, offset = {}, 0
+    while offset < len(body):
+        index, length = FRAME_HEADER.unpack_from(body, offset)
+        offset += FRAME_HEADER.size
+        if length == MISSING:
+            frames[index] = None
+            continue
+        frames[index] = body[offset: offset + length]
+        offset += length
+    assert offset == len(body)
+    return frames
+
+
+@pytest.fixture
+def node_files(slpk_root) -> dict:
+    files = {
+        (0, 1, "geometries/1"): os.path.join("sublayers", "0", "nodes", "1", "geometries", "1.bin"),
+        (0, 1, "textures/0_0_1"): os.path.join("sublayers", "0", "nodes", "1", "textures", "0_0_1.bin.dds"),
+        (1, 3, "geometries/0"): os.path.join("sublayers", "1", "nodes", "3", "geometries", "0.bin"),
+    }
+    for key, path in files.items():
+        path = os.path.join(slpk_root, SLPK_UUID, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(repr(key).encode())
+    return files
+
+
+@pytest.fixture
+def attribute_queries(monkeypatch) -> list:
+    """
+    以字典代替属性缓存，记录每次查询
+    """
+    attributes = {(0, 1, 0): b"f0", (0, 1, 2): b"f2", (1, 3, 0): b"n3"}
+    queries = []
+
+    async def get_attribute_buffers(project_id, model_file_id, sublayer_index, fields):
+        queries.append((sublayer_index, list(fields)))
+        return {field: attributes.get((sublayer_index,) + field) for field in fields}
+
+    monkeypatch.setattr(batch_fetch, "get_attribute_buffers", get_attribute_buffers)
+    return queries
+
+
+def fetch(items) -> bytes:
+    async def collect():
+        return b"".join([chunk async for chunk in batch_fetch.iter_batch(PROJECT_ID, MODEL_FILE_ID, SLPK_UUID, items)])
+
+    return asyncio.run(collect())
+
+
+def test_frames_restore_request_order(node_files, attribute_queries):
+    items = [
+        BatchItem(1, 3, "geometries/0"),
+        BatchItem(0, 1, "attributes/f_2/0"),
+        BatchItem(0, 1, "geometries/1"),
+        BatchItem(1, 3, "attributes/f_0/0"),
+        BatchItem(0, 1, "textures/0_0_1"),
+        BatchItem(0, 1, "attributes/f_0/0"),
+    ]
+    frames = parse_frames(fetch(items))
+    assert sorted(frames) == list(range(len(items)))
+    assert frames[0] == repr((1, 3, "geometries/0")).encode()
+    assert frames[1] == b"f2"
+    assert frames[2] == repr((0, 1, "geometries/1")).encode()
+    assert frames[3] == b"n3"
+    assert frames[4] == repr((0, 1, "textures/0_0_1")).encode()
+    assert frames[5] == b"f0"
+    # 每个子层一次属性查询
+    assert attribute_queries == [(0, [(1, 2), (1, 0)]), (1, [(3, 0)])]
+
+
+def test_missing_resources(node_files, attribute_queries):
+    items = [BatchItem(0, 9, "geometries/1"), BatchItem(0, 9, "attributes/f_0/0"), BatchItem(0, 1, "geometries/1")]
+    frames = parse_frames(fetch(items))
+    assert frames == {0: None, 1: None, 2: repr((0, 1, "geometries/1")).encode()}
+
+
+def test_empty_frame_is_not_missing():
+    assert parse_frames(batch_fetch.frame(3, b"") + batch_fetch.frame(4, None)) == {3: b"", 4: None}
+
+
+def test_files_only_batch_skips_attribute_queries(node_files, attribute_queries):
+    frames = parse_frames(fetch([BatchItem(0, 1, "textures/0_0_1")]))
+    assert list(frames) == [0]
+    assert attribute_queries == []
+
+
+@pytest.mark.parametrize("resource", ["geometries/x", "textures/0_0_2", "attributes/f_0/1", "../geometries/1"])
+def test_validate_rejects_unsupported_resource(resource):
+    with pytest.raises(ValueError):
+        batch_fetch.validate_items([BatchItem(0, 1, resource)])
+
+
+def test_validate_limits_item_count(monkeypatch):
+    from config import config
+
+    monkeypatch.setitem(config["model"], "batch_max_items", 2)
+    batch_fetch.validate_items([BatchItem(0, i, "geometries/0") for i in range(2)])
+    with pytest.raises(ValueError):
+        batch_fetch.validate_items([BatchItem(0, i, "geometries/0") for i in range(3)])
+
+
+def test_batch_endpoint(node_files, attribute_queries, monkeypatch):
+    slpk_server = pytest.importorskip("router.slpk_server")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    async def get_uuid_from_mf(project_id, model_file_id):
+        return SLPK_UUID if model_file_id == MODEL_FILE_ID else None
+
+    monkeypatch.setattr(slpk_server, "get_uuid_from_mf", get_uuid_from_mf)
+    app = FastAPI()
+    app.include_router(slpk_server.router)
+    client = TestClient(app)
+    url = f"/project/{PROJECT_ID}/slpk/{{}}/SceneServer/layers/0/nodes/batch"
+    items = [{"sublayer": 0, "node": 1, "resource": "geometries/1"},
+             {"sublayer": 0, "node": 1, "resource": "attributes/f_0/0"}]
+
+    response = client.post(url.format(MODEL_FILE_ID), json={"items": items})
+    assert response.status_code == 200
+    assert parse_frames(response.content) == {0: repr((0, 1, "geometries/1")).encode(), 1: b"f0"}
+    assert client.post(url.format(99), json={"items": items}).status_code == 404
+    bad = [{"sublayer": 0, "node": 1, "resource": "metadata"}]
+    assert client.post(url.format(MODEL_FILE_ID), json={"items": bad}).status_code == 422
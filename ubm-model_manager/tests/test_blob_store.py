@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+import pytest
+
+from utils import blob_store
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_put_blob_is_content_addressed(slpk_root):
+    digest = blob_store.put_blob(b"geometry")
+    assert digest == hashlib.sha256(b"geometry").hexdigest()
+    assert blob_store.blob_path(digest) == os.path.join(slpk_root, "blobs", digest[:2], digest)
+    assert read(blob_store.blob_path(digest)) == b"geometry"
+    # 重复保存不改变已有的 blob
+    assert blob_store.put_blob(b"geometry", digest) == digest
+    assert os.listdir(os.path.dirname(blob_store.blob_path(digest))) == [digest]
+
+
+def test_put_blob_checks_hash(slpk_root):
+    with pytest.raises(ValueError):
+        blob_store.put_blob(b"geometry", hashlib.sha256(b"other").hexdigest())
+    assert not os.path.exists(os.path.join(slpk_root, "blobs"))
+
+
+def test_missing_blobs(slpk_root):
+    known = blob_store.put_blob(b"known")
+    unknown = hashlib.sha256(b"unknown").hexdigest()
+    assert blob_store.missing_blobs([unknown, known, unknown, "../../etc/passwd"]) == [unknown, "../../etc/passwd"]
+    assert not blob_store.has_blob(known.upper())
+
+
+def test_link_blob(slpk_root):
+    digest = blob_store.put_blob(b"geometry")
+    target = os.path.join(slpk_root, "uuid", "sublayers", "0", "nodes", "1", "geometries", "1.bin")
+    blob_store.link_blob(digest, target)
+    assert read(target) == b"geometry"
+    assert os.path.samefile(target, blob_store.blob_path(digest))
+    assert os.listdir(os.path.dirname(target)) == ["1.bin"]
+
+
+def test_link_blob_over_linked_path_keeps_source(slpk_root):
+    old, new = blob_store.put_blob(b"old"), blob_store.put_blob(b"new")
+    target = os.path.join(slpk_root, "uuid", "1.bin")
+    blob_store.link_blob(old, target)
+    # 覆盖硬链接时替换目录项，不写入原 blob
+    blob_store.link_blob(new, target)
+    assert read(target) == b"new"
+    assert read(blob_store.blob_path(old)) == b"old"
+
+
+def test_link_file_falls_back_to_copy(slpk_root, monkeypatch):
+    digest = blob_store.put_blob(b"geometry")
+    target = os.path.join(slpk_root, "uuid", "1.bin")
+
+    def link(source, target):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(blob_store.os, "link", link)
+    blob_store.link_blob(digest, target)
+    assert read(target) == b"geometry"
+    assert not os.path.samefile(target, blob_store.blob_path(digest))
+
+
+def test_link_tree(slpk_root):
+    source = os.path.join(slpk_root, "previous")
+    for name in ("nodes/0/geometries/1.bin", "nodes/1/textures/0.dds"):
+        os.makedirs(os.path.dirname(os.path.join(source, name)), exist_ok=True)
+        with open(os.path.join(source, name), "wb") as f:
+            f.write(name.encode())
+    target = os.path.join(slpk_root, "current")
+    assert blob_store.link_tree(source, target) == 2
+    assert read(os.path.join(target, "nodes/1/textures/0.dds")) == b"nodes/1/textures/0.dds"
@@ -0,0 +1,38 @@
+import asyncio
+
+from db_manager import cache_version
+
+PROJECT_ID, MODEL_FILE_ID = 1, 2
+
+
+def get_version(name: str = "nodepage") -> int:
+    return asyncio.run(cache_version.get_version(PROJECT_ID, MODEL_FILE_ID, name))
+
+
+def bump_version(name: str = "nodepage") -> int:
+    return asyncio.run(cache_version.bump_version(PROJECT_ID, MODEL_FILE_ID, name))
+
+
+def test_version_starts_at_zero(versions):
+    assert get_version() == 0
+
+
+def test_bump_takes_effect_immediately(versions):
+    get_version()
+    assert bump_version() == 1
+    assert get_version() == 1
+    assert get_version("attribute") == 0
+
+
+def test_other_worker_seen_after_ttl(versions, clock):
+    get_version()
+    versions[(PROJECT_ID, MODEL_FILE_ID, "nodepage")] = 3
+    assert get_version() == 0
+    clock.advance(2)
+    assert get_version() == 3
+
+
+def test_stale_read_does_not_go_back(versions):
+    assert bump_version() == 1
+    cache_version._remember((PROJECT_ID, MODEL_FILE_ID, "nodepage"), 0)
+    assert get_version() == 1
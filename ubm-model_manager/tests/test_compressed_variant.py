@@ -0,0 +1,147 @@
+import asyncio
+import gzip
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from utils import compressed_variant
+from utils.cache import LRUCache
+
+COMPRESSIBLE = b"{\"index\": 0}" * 1000
+
+
+@pytest.fixture(autouse=True)
+def variant_cache(monkeypatch):
+    # 不依赖是否安装了 brotli
+    monkeypatch.setattr(compressed_variant, "brotli", None)
+    monkeypatch.setattr(compressed_variant, "_cache", LRUCache(16))
+
+
+def make_request(accept_encoding: str = None, if_none_match: str = None) -> Request:
+    headers = []
+    if accept_encoding is not None:
+        headers.append((b"accept-encoding", accept_encoding.encode()))
+    if if_none_match is not None:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def bytes_response(body: bytes, **headers):
+    return asyncio.run(compressed_variant.bytes_response(make_request(**headers), body, "application/json"))
+
+
+@pytest.mark.parametrize("header, encoding", [
+    ("gzip", "gzip"),
+    ("br, gzip;q=0.5", "gzip"),
+    ("*", "gzip"),
+    ("gzip;q=0", None),
+    ("br", None),
+    ("identity", None),
+    ("", None),
+])
+def test_choose_encoding(header, encoding):
+    assert compressed_variant.choose_encoding(make_request(header)) == encoding
+
+
+def test_choose_brotli_first(monkeypatch):
+    monkeypatch.setattr(compressed_variant, "brotli", object())
+    assert compressed_variant.choose_encoding(make_request("gzip, br")) == "br"
+
+
+def test_bytes_response_gzip():
+    response = bytes_response(COMPRESSIBLE, accept_encoding="gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == COMPRESSIBLE
+    identity = bytes_response(COMPRESSIBLE)
+    assert identity.body == COMPRESSIBLE
+    assert "content-encoding" not in identity.headers
+    # 各编码使用不同的 ETag
+    assert identity.headers["etag"] != response.headers["etag"]
+
+
+def test_bytes_response_compresses_once(monkeypatch):
+    calls = []
+    compress = compressed_variant.compress
+
+    def counting_compress(data, encoding):
+        calls.append(encoding)
+        return compress(data, encoding)
+
+    monkeypatch.setattr(compressed_variant, "compress", counting_compress)
+    first = bytes_response(COMPRESSIBLE, accept_encoding="gzip")
+    second = bytes_response(COMPRESSIBLE, accept_encoding="gzip")
+    assert calls == ["gzip"]
+    assert first.body == second.body
+
+
+def test_bytes_response_skips_small_and_incompressible():
+    small = bytes_response(b"{}", accept_encoding="gzip")
+    assert "content-encoding" not in small.headers
+    incompressible = os.urandom(4096)
+    response = bytes_response(incompressible, accept_encoding="gzip")
+    assert "content-encoding" not in response.headers
+    assert response.body == incompressible
+
+
+def test_bytes_response_not_modified():
+    etag = bytes_response(COMPRESSIBLE, accept_encoding="gzip").headers["etag"]
+    assert bytes_response(COMPRESSIBLE, accept_encoding="gzip", if_none_match=etag).status_code == 304
+    # 原始数据的 ETag 不同
+    assert bytes_response(COMPRESSIBLE, if_none_match=etag).status_code == 200
+    assert bytes_response(COMPRESSIBLE + b" ", accept_encoding="gzip", if_none_match=etag).status_code == 200
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    path = str(tmp_path / "0.dds")
+    with open(path, "wb") as f:
+        f.write(COMPRESSIBLE)
+    return path
+
+
+@pytest.fixture
+def client(path) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return await compressed_variant.file_response(request, path)
+
+    return TestClient(app)
+
+
+def test_file_response_uses_variant(client, path):
+    response = client.get("/file", headers={"accept-encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == COMPRESSIBLE
+    with open(path + ".gz", "rb") as f:
+        assert gzip.decompress(f.read()) == COMPRESSIBLE
+    assert os.stat(path + ".gz").st_mtime_ns == os.stat(path).st_mtime_ns
+    identity = client.get("/file", headers={"accept-encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert identity.headers["etag"] != response.headers["etag"]
+
+
+def test_file_variant_regenerated_after_replace(path):
+    variant_path = compressed_variant.file_variant(path, "gzip")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(COMPRESSIBLE * 2)
+    os.utime(tmp_path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    os.replace(tmp_path, path)
+    assert compressed_variant.file_variant(path, "gzip") == variant_path
+    with open(variant_path, "rb") as f:
+        assert gzip.decompress(f.read()) == COMPRESSIBLE * 2
+
+
+def test_file_variant_skips_incompressible(tmp_path):
+    path = str(tmp_path / "1.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(4096))
+    assert compressed_variant.file_variant(path, "gzip") is None
+    # 再次请求时根据已生成的文件判断
+    assert compressed_variant.file_variant(path, "gzip") is None
+    assert compressed_variant.file_variant(str(tmp_path / "missing.bin"), "gzip") is None
@@ -0,0 +1,206 @@
+"""
+调度规则的单元测试：直接操作 QueueState，不经过数据库事务
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from db_manager.convert_scheduler import ConvertScheduler, QueueState, LARGE, PENDING, RUNNING, SMALL
+
+MB = 1 << 20
+
+
+class FakeCelery:
+    def __init__(self):
+        self.sent = []
+        self.revoked = []
+        self.broker_down = False
+        self.control = SimpleNamespace(revoke=lambda task_id, terminate: self.revoked.append(task_id))
+
+    def send_task(self, name, args, queue):
+        if self.broker_down:
+            raise ConnectionError("broker unreachable")
+        self.sent.append((args[2], queue))
+        return SimpleNamespace(id=f"task-{len(self.sent)}")
+
+
+@pytest.fixture
+def celery():
+    return FakeCelery()
+
+
+@pytest.fixture
+def scheduler(celery):
+    scheduler = ConvertScheduler(celery)
+    scheduler.large_file_size = 100 * MB
+    scheduler.slots = {SMALL: 1, LARGE: 1}
+    scheduler.preempt = False
+    scheduler.seconds_per_mb = 1.0
+    scheduler.running_timeout = 60
+    scheduler.max_reclaims = 1
+    return scheduler
+
+
+def submit(scheduler, state, model_file_id: int, size_mb: int, project_id: int = 1, now: float = 0):
+    scheduler._submit(state, project_id, model_file_id, f"uuid-{model_file_id}", size_mb * MB, now)
+    scheduler._dispatch(state, now)
+
+
+def test_finish_releases_slot(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    submit(scheduler, state, 2, 10)
+    assert celery.sent == [(1, "convert_small")]
+    assert [task.model_file_id for task in state.pending[SMALL]] == [2]
+
+    scheduler._finish(state, 1, 1, None)
+    scheduler._dispatch(state, 10)
+    assert celery.sent == [(1, "convert_small"), (2, "convert_small")]
+    assert list(state.running) == [(1, 2)]
+    # 同一事务中加入又结束的任务不写入数据库
+    assert [task.model_file_id for task in state.added] == [2]
+
+
+def test_finish_unknown_task_is_ignored(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    scheduler._finish(state, 1, 99, None)
+    assert list(state.running) == [(1, 1)]
+
+
+def test_finish_updates_rate(scheduler):
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    scheduler._finish(state, 1, 1, 30)
+    assert scheduler.seconds_per_mb == pytest.approx(0.8 * 1.0 + 0.2 * 3.0)
+
+
+def test_cancel_pending_task(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    submit(scheduler, state, 2, 10)
+    assert scheduler._cancel(state, 1, 2)
+    assert state.pending[SMALL] == []
+    # 同一事务中加入又取消的任务不写入数据库
+    assert [task.model_file_id for task in state.added] == [1]
+    assert not scheduler._cancel(state, 1, 99)
+
+
+def test_cancel_running_task_frees_slot(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    submit(scheduler, state, 2, 10)
+    state.added.clear()
+    assert scheduler._cancel(state, 1, 1)
+    assert celery.revoked == ["task-1"]
+    assert state.usage[1] == pytest.approx(0)
+    assert [task.model_file_id for task in state.removed] == [1]
+    scheduler._dispatch(state, 10)
+    assert celery.sent == [(1, "convert_small"), (2, "convert_small")]
+
+
+def test_resubmit_replaces_pending_task(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    submit(scheduler, state, 2, 10)
+    # 重新上传后文件变大，替换等待中的任务而不是被忽略
+    scheduler._cancel(state, 1, 2, running=False)
+    submit(scheduler, state, 2, 200)
+    assert state.pending[SMALL] == []
+    assert state.running[(1, 2)].size == 200 * MB
+    assert celery.sent == [(1, "convert_small"), (2, "convert_large")]
+    # 运行中的任务不会因再次提交而被取消
+    assert not scheduler._cancel(state, 1, 1, running=False)
+    assert list(state.running) == [(1, 1), (1, 2)]
+
+
+def test_large_task_borrows_idle_small_slot(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 200)
+    submit(scheduler, state, 2, 200)
+    assert celery.sent == [(1, "convert_large"), (2, "convert_small")]
+    assert state.running[(1, 2)].borrowed
+
+
+def test_preempt_borrowed_large_task(scheduler, celery):
+    scheduler.preempt = True
+    state = QueueState()
+    submit(scheduler, state, 1, 200)
+    submit(scheduler, state, 2, 200)
+    submit(scheduler, state, 3, 10)
+    assert celery.revoked == ["task-2"]
+    assert celery.sent[-1] == (3, "convert_small")
+    assert [task.model_file_id for task in state.pending[LARGE]] == [2]
+    assert state.pending[LARGE][0].state == PENDING
+
+
+def test_fair_share_between_projects(scheduler, celery):
+    state = QueueState()
+    for model_file_id, project_id in ((1, 1), (2, 1), (3, 2)):
+        scheduler._submit(state, project_id, model_file_id, f"uuid-{model_file_id}", 10 * MB, model_file_id)
+    scheduler._dispatch(state, 3)
+    assert celery.sent == [(1, "convert_small")]
+
+    # 项目 1 已分发的耗时更多，项目 2 的任务虽然提交得晚也先分发
+    scheduler._finish(state, 1, 1, None)
+    scheduler._dispatch(state, 10)
+    assert celery.sent[-1] == (3, "convert_small")
+
+
+def test_broker_failure_keeps_task_pending(scheduler, celery):
+    celery.broker_down = True
+    state = QueueState()
+    submit(scheduler, state, 1, 10)
+    assert not state.running
+    assert state.pending[SMALL][0].state == PENDING
+
+    celery.broker_down = False
+    scheduler._dispatch(state, 10)
+    assert list(state.running) == [(1, 1)]
+
+
+def test_reclaim_requeues_lost_task(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10, now=0)
+    usage = state.usage[1]
+
+    scheduler._reclaim(state, 60)
+    assert list(state.running) == [(1, 1)]
+
+    scheduler._reclaim(state, 61)
+    assert celery.revoked == ["task-1"]
+    task = state.pending[SMALL][0]
+    assert (task.state, task.reclaimed, task.task_id) == (PENDING, 1, None)
+    assert state.usage[1] == pytest.approx(usage - task.cost)
+
+    scheduler._dispatch(state, 61)
+    assert task.state == RUNNING and task.task_id == "task-2"
+
+
+def test_report_postpones_reclaim(scheduler):
+    state = QueueState()
+    submit(scheduler, state, 1, 10, now=0)
+    state.running[(1, 1)].report_time = 50
+    scheduler._reclaim(state, 100)
+    assert list(state.running) == [(1, 1)]
+
+
+def test_reclaim_gives_up_after_max_reclaims(scheduler, celery):
+    state = QueueState()
+    submit(scheduler, state, 1, 10, now=0)
+    scheduler._reclaim(state, 100)
+    scheduler._dispatch(state, 100)
+    scheduler._reclaim(state, 200)
+    assert not state.running and not state.pending[SMALL]
+    assert [task.model_file_id for task in state.failed] == [1]
+    assert celery.revoked == ["task-1", "task-2"]
+
+
+def test_state_splits_loaded_tasks(scheduler):
+    state = QueueState()
+    submit(scheduler, state, 1, 10, now=0)
+    submit(scheduler, state, 2, 10, now=1)
+    reloaded = QueueState(state.added, state.usage)
+    assert list(reloaded.running) == [(1, 1)]
+    assert [task.model_file_id for task in reloaded.pending[SMALL]] == [2]
+    assert scheduler._position(reloaded, 1, 2)["position"] == 1
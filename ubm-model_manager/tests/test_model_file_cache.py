@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from db_manager import model_file_cache
+from db_manager.model_file_cache import ResolvedModelFile, ResolvedSublayer
+from utils.cache import LRUCache
+
+PROJECT_ID, MODEL_FILE_ID = 1, 2
+
+
+def make_model_file(model_file_id: int, name: str = "layer") -> ResolvedModelFile:
+    sublayer = ResolvedSublayer(10, 11, {"id": 0}, None, 12, {"meta": 0}, 13)
+    return ResolvedModelFile(model_file_id, f"uuid-{model_file_id}", 1, {"name": name}, 2, {}, {0: sublayer})
+
+
+@pytest.fixture
+def store(monkeypatch, clock, versions):
+    """
+    以字典代替数据库，记录每次加载
+    """
+    model_files = {MODEL_FILE_ID: make_model_file(MODEL_FILE_ID)}
+    loads = []
+
+    async def load_model_file(project_id, model_file_id):
+        loads.append(model_file_id)
+        await asyncio.sleep(0)
+        return model_files.get(model_file_id)
+
+    monkeypatch.setattr(model_file_cache, "load_model_file", load_model_file)
+    monkeypatch.setattr(model_file_cache, "_cache", LRUCache(16, 300))
+    monkeypatch.setattr(model_file_cache, "_load_locks", {})
+    return model_files, loads
+
+
+def get_model_file(model_file_id: int = MODEL_FILE_ID):
+    return asyncio.run(model_file_cache.get_model_file(PROJECT_ID, model_file_id))
+
+
+def test_cached_after_first_load(store):
+    model_files, loads = store
+    assert get_model_file() is model_files[MODEL_FILE_ID]
+    assert get_model_file() is model_files[MODEL_FILE_ID]
+    assert loads == [MODEL_FILE_ID]
+
+
+def test_missing_model_file_is_not_cached(store):
+    _, loads = store
+    assert get_model_file(3) is None
+    assert get_model_file(3) is None
+    assert loads == [3, 3]
+
+
+def test_concurrent_misses_load_once(store):
+    _, loads = store
+
+    async def get_many():
+        return await asyncio.gather(*(model_file_cache.get_model_file(PROJECT_ID, MODEL_FILE_ID) for _ in range(5)))
+
+    assert len(set(map(id, asyncio.run(get_many())))) == 1
+    assert loads == [MODEL_FILE_ID]
+
+
+def test_invalidate_bumps_version(store):
+    model_files, loads = store
+    get_model_file()
+    model_files[MODEL_FILE_ID] = make_model_file(MODEL_FILE_ID, "renamed")
+    assert get_model_file().layer == {"name": "layer"}
+
+    asyncio.run(model_file_cache.invalidate_model_file(PROJECT_ID, MODEL_FILE_ID))
+    assert get_model_file().layer == {"name": "renamed"}
+    assert len(loads) == 2
+
+
+def test_invalidate_from_other_worker(store, versions, clock):
+    model_files, loads = store
+    get_model_file()
+    model_files[MODEL_FILE_ID] = make_model_file(MODEL_FILE_ID, "renamed")
+    versions[(PROJECT_ID, MODEL_FILE_ID, model_file_cache.CACHE_NAME)] = 1
+    # 进程内的版本号过期前仍读到旧数据
+    assert get_model_file().layer == {"name": "layer"}
+    clock.advance(2)
+    assert get_model_file().layer == {"name": "renamed"}
+    assert len(loads) == 2
+
+
+def test_ttl_expiry_reloads(store, clock):
+    _, loads = store
+    get_model_file()
+    clock.advance(301)
+    get_model_file()
+    assert len(loads) == 2
+
+
+def test_get_sublayer(store):
+    assert asyncio.run(model_file_cache.get_sublayer(PROJECT_ID, MODEL_FILE_ID, 0)).nodepage_version_id == 13
+    assert asyncio.run(model_file_cache.get_sublayer(PROJECT_ID, MODEL_FILE_ID, 1)) is None
+    assert asyncio.run(model_file_cache.get_sublayer(PROJECT_ID, 3, 0)) is None
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from db_manager import nodepage_cache
+from utils.cache import LRUCache
+
+PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX = 1, 2, 0
+
+
+@pytest.fixture
+def store(monkeypatch, clock, versions):
+    """
+    以字典代替数据库，记录每次加载
+    """
+    nodes = {(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX): [{"index": i} for i in range(10)]}
+    loads = []
+
+    async def load_nodepage(project_id, model_file_id, sublayer_index):
+        loads.append((project_id, model_file_id, sublayer_index))
+        await asyncio.sleep(0)
+        sublayer = nodes.get((project_id, model_file_id, sublayer_index))
+        return None if sublayer is None else list(sublayer)
+
+    monkeypatch.setattr(nodepage_cache, "load_nodepage", load_nodepage)
+    monkeypatch.setattr(nodepage_cache, "nodepage_size", lambda: 4)
+    monkeypatch.setattr(nodepage_cache, "_cache", LRUCache(64, 300))
+    monkeypatch.setattr(nodepage_cache, "_load_locks", {})
+    return nodes, loads
+
+
+def get_page(page: int, model_file_id: int = MODEL_FILE_ID):
+    return asyncio.run(nodepage_cache.get_nodepage(PROJECT_ID, model_file_id, SUBLAYER_INDEX, page))
+
+
+def test_all_pages_cached_after_one_load(store):
+    _, loads = store
+    assert get_page(0) == [{"index": i} for i in range(4)]
+    assert get_page(2) == [{"index": 8}, {"index": 9}]
+    assert get_page(1) == [{"index": i} for i in range(4, 8)]
+    assert len(loads) == 1
+
+
+def test_page_out_of_range_is_empty(store):
+    _, loads = store
+    assert get_page(5) == []
+    assert get_page(6) == []
+    assert get_page(-1) == []
+    assert get_page(2) == [{"index": 8}, {"index": 9}]
+    assert len(loads) == 1
+
+
+def test_empty_sublayer_is_cached(store):
+    nodes, loads = store
+    nodes[(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX)] = []
+    assert get_page(0) == []
+    assert get_page(0) == []
+    assert len(loads) == 1
+
+
+def test_missing_sublayer_is_not_cached(store):
+    _, loads = store
+    assert get_page(0, model_file_id=3) is None
+    assert get_page(0, model_file_id=3) is None
+    assert len(loads) == 2
+
+
+def test_concurrent_misses_load_once(store):
+    _, loads = store
+
+    async def get_pages():
+        return await asyncio.gather(*(
+            nodepage_cache.get_nodepage(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX, page) for page in (0, 1, 2, 0)
+        ))
+
+    pages = asyncio.run(get_pages())
+    assert [len(page) for page in pages] == [4, 4, 2, 4]
+    assert len(loads) == 1
+
+
+def test_invalidate_bumps_version(store):
+    nodes, loads = store
+    get_page(0)
+    nodes[(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX)] = [{"index": i, "moved": True} for i in range(10)]
+    assert get_page(0)[0] == {"index": 0}
+
+    asyncio.run(nodepage_cache.invalidate_nodepages(PROJECT_ID, MODEL_FILE_ID))
+    assert get_page(0)[0] == {"index": 0, "moved": True}
+    assert len(loads) == 2
+
+
+def test_invalidate_from_other_worker(store, versions, clock):
+    nodes, loads = store
+    get_page(0)
+    nodes[(PROJECT_ID, MODEL_FILE_ID, SUBLAYER_INDEX)] = [{"index": i, "moved": True} for i in range(10)]
+    versions[(PROJECT_ID, MODEL_FILE_ID, nodepage_cache.CACHE_NAME)] = 1
+    clock.advance(2)
+    assert get_page(0)[0] == {"index": 0, "moved": True}
+    assert len(loads) == 2
+
+
+def test_invalidate_other_model_file_keeps_cache(store):
+    _, loads = store
+    get_page(0)
+    asyncio.run(nodepage_cache.invalidate_nodepages(PROJECT_ID, MODEL_FILE_ID + 1))
+    get_page(0)
+    assert len(loads) == 1
+
+
+def test_ttl_expiry_reloads(store, clock):
+    _, loads = store
+    get_page(0)
+    clock.advance(299)
+    get_page(0)
+    assert len(loads) == 1
+    clock.advance(2)
+    get_page(0)
+    assert len(loads) == 2
@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+import pytest
+
+from utils import staging
+from utils.blob_store import blob_path, put_blob
+
+NAME = "uuid-1_0"
+
+
+def write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def target_root(slpk_root) -> str:
+    return os.path.join(slpk_root, "uuid-1")
+
+
+def stage(path: str, data: bytes):
+    write(os.path.join(staging.staging_dir(NAME), "files", path), data)
+
+
+def test_commit_moves_files_and_links_blobs(target_root):
+    digest = put_blob(b"geometry")
+    stage("nodes/1/textures/0.dds", b"texture")
+    entries = [
+        {"path": "nodes/1/geometries/1.bin", "sha256": digest},
+        {"path": "nodes/1/textures/0.dds"},
+    ]
+    assert staging.commit_staging(NAME, entries, target_root) == []
+    assert os.path.samefile(os.path.join(target_root, "nodes/1/geometries/1.bin"), blob_path(digest))
+    assert read(os.path.join(target_root, "nodes/1/textures/0.dds")) == b"texture"
+    assert not os.path.exists(staging.staging_dir(NAME))
+    # 重复提交时文件已被移动，不视为缺失
+    assert staging.commit_staging(NAME, entries, target_root) == []
+
+
+def test_commit_reports_missing_and_keeps_staging(target_root):
+    stage("nodes/1/textures/0.dds", b"texture")
+    entries = [
+        {"path": "nodes/1/geometries/1.bin", "sha256": hashlib.sha256(b"geometry").hexdigest()},
+        {"path": "nodes/2/geometries/1.bin", "sha256": "not-a-hash"},
+        {"path": "nodes/1/textures/0.dds"},
+        {"path": "nodes/2/textures/0.dds"},
+    ]
+    missing = staging.commit_staging(NAME, entries, target_root)
+    assert missing == ["nodes/1/geometries/1.bin", "nodes/2/geometries/1.bin", "nodes/2/textures/0.dds"]
+    assert os.path.isdir(staging.staging_dir(NAME))
+    # 补齐后再次提交，提交成功并删除暂存区
+    put_blob(b"geometry")
+    put_blob(b"other")
+    stage("nodes/2/textures/0.dds", b"texture")
+    entries[1]["sha256"] = hashlib.sha256(b"other").hexdigest()
+    assert staging.commit_staging(NAME, entries, target_root) == []
+    assert not os.path.exists(staging.staging_dir(NAME))
+
+
+@pytest.mark.parametrize("path", ["../uuid-2/1.bin", "/etc/passwd"])
+def test_commit_rejects_paths_outside_root(target_root, path):
+    with pytest.raises(ValueError):
+        staging.commit_staging(NAME, [{"path": path}], target_root)
+
+
+def test_staging_name():
+    assert staging.is_valid_staging_name(NAME)
+    assert not staging.is_valid_staging_name("../uuid")
+    assert not staging.is_valid_staging_name("")
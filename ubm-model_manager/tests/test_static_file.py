@@ -0,0 +1,139 @@
+import os
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from utils import static_file
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def path(slpk_root) -> str:
+    path = os.path.join(slpk_root, "uuid", "nodes", "1", "geometries", "1.bin")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(DATA)
+    return path
+
+
+@pytest.fixture
+def client(path) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/file")
+    @app.head("/file")
+    def get_file(request: Request):
+        return static_file.static_file_response(request, path)
+
+    @app.get("/missing")
+    def get_missing(request: Request):
+        return static_file.static_file_response(request, path + ".missing")
+
+    return TestClient(app)
+
+
+def test_full_response(client, path):
+    response = client.get("/file")
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"] == static_file.make_etag(os.stat(path))
+    assert response.headers["content-length"] == str(len(DATA))
+
+
+def test_head_has_no_body(client):
+    response = client.head("/file")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == str(len(DATA))
+
+
+def test_missing_file(client):
+    assert client.get("/missing").status_code == 404
+
+
+def test_if_none_match(client):
+    etag = client.get("/file").headers["etag"]
+    assert client.get("/file", headers={"if-none-match": etag}).status_code == 304
+    assert client.get("/file", headers={"if-none-match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/file", headers={"if-none-match": "*"}).status_code == 304
+    assert client.get("/file", headers={"if-none-match": '"other"'}).status_code == 200
+
+
+def test_if_modified_since(client, path):
+    mtime = os.stat(path).st_mtime
+    assert client.get("/file", headers={"if-modified-since": formatdate(mtime + 1, usegmt=True)}).status_code == 304
+    assert client.get("/file", headers={"if-modified-since": formatdate(mtime - 10, usegmt=True)}).status_code == 200
+    assert client.get("/file", headers={"if-modified-since": "yesterday"}).status_code == 200
+    # If-None-Match 优先
+    response = client.get("/file", headers={
+        "if-none-match": '"other"', "if-modified-since": formatdate(mtime + 1, usegmt=True),
+    })
+    assert response.status_code == 200
+
+
+def test_etag_changes_when_replaced(client, path):
+    etag = client.get("/file").headers["etag"]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(DATA)
+    os.replace(tmp_path, path)
+    assert client.get("/file", headers={"if-none-match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-9", 0, 10),
+    ("bytes=1000-", 1000, 1024),
+    ("bytes=-24", 1000, 1024),
+    ("bytes=1000-5000", 1000, 1024),
+    ("bytes=-5000", 0, 1024),
+])
+def test_range(client, header, start, end):
+    response = client.get("/file", headers={"range": header})
+    assert response.status_code == 206
+    assert response.content == DATA[start:end]
+    assert response.headers["content-range"] == f"bytes {start}-{end - 1}/{len(DATA)}"
+    assert response.headers["content-length"] == str(end - start)
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=10-5", "bytes=-0"])
+def test_unsatisfiable_range(client, header):
+    response = client.get("/file", headers={"range": header})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-1", "bytes=-"])
+def test_unsupported_range_returns_full_content(client, header):
+    response = client.get("/file", headers={"range": header})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+def test_if_range(client):
+    etag = client.get("/file").headers["etag"]
+    response = client.get("/file", headers={"range": "bytes=0-9", "if-range": etag})
+    assert response.status_code == 206
+    response = client.get("/file", headers={"range": "bytes=0-9", "if-range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+def test_chunked_read(client, monkeypatch):
+    monkeypatch.setattr(static_file.FileRangeResponse, "chunk_size", 100)
+    response = client.get("/file", headers={"range": "bytes=50-749"})
+    assert response.content == DATA[50:750]
+
+
+def test_accel_redirect(client, path, slpk_root, monkeypatch):
+    from config import config
+
+    monkeypatch.setitem(config["model"], "accel_redirect", "/protected-slpk/")
+    response = client.get("/file", headers={"range": "bytes=0-9"})
+    # nginx 根据 Range 自行截取
+    assert response.status_code == 200
+    assert response.headers["x-accel-redirect"] == "/protected-slpk/uuid/nodes/1/geometries/1.bin"
+    assert "content-range" not in response.headers
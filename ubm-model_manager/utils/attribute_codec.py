@@ -0,0 +1,70 @@
+"""
+I3S 节点属性二进制的编解码
+
+每个属性字段(`attributes/f_N/0`)编码为：
+
+- 字段 0(构件 id)：`count: uint32`，随后 count 个 `uint32`
+- 其他字段(字符串)：`count: uint32`、`总字节数: uint32`、count 个 `uint32` 字节数，随后各个值，每个值以 `\\0` 结尾
+
+整列一次编码：数值与字节数数组通过 `struct.pack` 一次打包，字符串先用 `\\0` 拼接再一次性编码，
+不再逐个值调用 `int.to_bytes` 与 `str.encode`。耗时比较见 `tests/test_attribute_codec.py`。
+
+converter 中有一份相同的实现(`utils/attribute_codec.py`)，两个服务分别部署，互不依赖；
+两边的测试使用同一组固定的编码结果(GOLDEN)，修改编码时需同时修改两份实现与测试。
+"""
+import struct
+from typing import List, Optional, Tuple
+
+
+def encode_ids(ids: List[int], count: int = None) -> bytes:
+    """
+    :param count: 写入头部的数量，默认为 ids 的长度
+    """
+    return struct.pack(f"<I{len(ids)}I", len(ids) if count is None else count, *ids)
+
+
+def encode_strings(values: List[Optional[str]], byte_counts: List[int]) -> bytes:
+    """
+    :param values: 各构件的属性值，None 编码为空字符串
+    :param byte_counts: 各值的字节数，原样写入头部
+    """
+    header = struct.pack(f"<II{len(byte_counts)}I", len(byte_counts), sum(byte_counts), *byte_counts)
+    if not values:
+        return header
+    if None in values:
+        values = ["" if value is None else value for value in values]
+    return header + ("\0".join(values) + "\0").encode()
+
+
+def encode_attribute(attribute_id: int, values: list, byte_counts: List[int]) -> bytes:
+    """
+    编码一个属性字段
+    """
+    if attribute_id == 0:
+        return encode_ids(values, len(byte_counts))
+    return encode_strings(values, byte_counts)
+
+
+def encode_attributes(attribute: dict) -> List[bytes]:
+    """
+    编码节点的所有属性字段
+    :param attribute: 节点属性，`{"value": [[...], ...], "size_bytes": [[...], ...]}`
+    """
+    return [
+        encode_attribute(attribute_id, values, byte_counts)
+        for attribute_id, (values, byte_counts) in enumerate(zip(attribute["value"], attribute["size_bytes"]))
+    ]
+
+
+def decode_attribute(attribute_id: int, data: bytes) -> Tuple[list, Optional[List[int]]]:
+    """
+    解码一个属性字段，用于测试；None 与空字符串编码相同，解码为空字符串
+    :return: (values, byte_counts)，字段 0 没有 byte_counts，返回 None
+    """
+    count, = struct.unpack_from("<I", data)
+    if attribute_id == 0:
+        return list(struct.unpack_from(f"<{count}I", data, 4)), None
+    byte_counts = list(struct.unpack_from(f"<{count}I", data, 8))
+    body = bytes(data[8 + 4 * count:])
+    values = body.decode().split("\0")[:count] if count else []
+    return values, byte_counts
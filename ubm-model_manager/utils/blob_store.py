@@ -0,0 +1,91 @@
+"""
+按内容寻址的二进制存储，以及模型文件之间的文件链接
+
+geometry 等二进制数据按 sha256 保存在 `slpk_root/blobs/<hash[:2]>/<hash>` 下，只保存一份；
+各节点的路径(如 `<uuid>/sublayers/0/nodes/1/geometries/1.bin`)通过硬链接指向对应的 blob，
+读取接口仍按原路径访问。文件系统不支持硬链接时退化为拷贝。
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Iterable, List
+
+from config import config, logger
+
+
+def blob_root() -> str:
+    return os.path.join(config["model"]["slpk_root"], "blobs")
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(blob_root(), sha256[:2], sha256)
+
+
+def is_valid_hash(sha256: str) -> bool:
+    return len(sha256) == 64 and all(c in "0123456789abcdef" for c in sha256)
+
+
+def has_blob(sha256: str) -> bool:
+    return is_valid_hash(sha256) and os.path.isfile(blob_path(sha256))
+
+
+def missing_blobs(hashes: Iterable[str]) -> List[str]:
+    """
+    :return: 尚未保存的 hash，保持传入顺序并去重
+    """
+    return [h for h in dict.fromkeys(hashes) if not has_blob(h)]
+
+
+def put_blob(data: bytes, sha256: str = None) -> str:
+    """
+    保存 blob，传入 sha256 时校验内容
+    :return: 内容的 sha256
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if sha256 and sha256 != digest:
+        raise ValueError(f"sha256 mismatch, expect {sha256}, got {digest}")
+    path = blob_path(digest)
+    if not os.path.isfile(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，并发写入同一 blob 是安全的
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def link_blob(sha256: str, target: str):
+    """
+    将 target 指向已保存的 blob，target 已存在时覆盖
+    """
+    link_file(blob_path(sha256), target)
+
+
+def link_file(source: str, target: str):
+    """
+    以硬链接的方式将 source 链接到 target，target 已存在时覆盖，不支持硬链接时拷贝
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.link"
+    try:
+        os.link(source, tmp_path)
+    except OSError as e:
+        logger.debug(f"fail to link `{source}`, fallback to copy: {e}")
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def link_tree(source: str, target: str) -> int:
+    """
+    将 source 目录下的所有文件链接到 target 下的相同位置
+    :return: 链接的文件数
+    """
+    count = 0
+    for root, _, files in os.walk(source):
+        for f in files:
+            path = os.path.join(root, f)
+            link_file(path, os.path.join(target, os.path.relpath(path, source)))
+            count += 1
+    return count
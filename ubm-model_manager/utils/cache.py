@@ -0,0 +1,68 @@
+"""
+进程内的 LRU 缓存
+
+多个 worker 进程各自持有缓存，写入时只能清除本进程的缓存，可设置过期时间限制其他进程读到旧数据的时长；
+需要在所有进程中失效的缓存，在 key 中加入 `db_manager/cache_version.py` 的版本号。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    def __init__(self, capacity: int, ttl: Optional[float] = None):
+        """
+        :param capacity: 最大条目数，为 0 时不缓存
+        :param ttl: 过期时间，单位秒，None 表示不过期
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or (self.ttl is not None and time.monotonic() - item[1] > self.ttl):
+                if item is not None:
+                    del self.data[key]
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.data[key] = (value, time.monotonic())
+            self.data.move_to_end(key)
+            while len(self.data) > self.capacity:
+                self.data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        清除满足条件的条目
+        :return: 清除的条目数
+        """
+        with self.lock:
+            keys = [key for key in self.data if predicate(key)]
+            for key in keys:
+                del self.data[key]
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.data), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,207 @@
+"""
+SceneServer 资源的预压缩变体
+
+每个资源只压缩一次，之后按请求的 Accept-Encoding 直接返回已压缩的数据，不在每次请求时消耗 CPU：
+
+- JSON 与内存中的二进制(layer、sublayer、metadata、nodepage、属性二进制)：以内容的 hash 作为版本，
+  各编码的压缩结果与原始数据一起缓存在 LRU 中；内容变化时 hash 随之变化，不需要额外的失效逻辑。
+  ETag 同样由 hash 生成，各编码使用不同的 ETag
+- 文件(geometry、纹理)：首次请求时在同目录下生成 `<文件名>.gz`/`<文件名>.br`，修改时间与原文件保持一致，
+  原文件被替换后修改时间不再相同，下次请求时重新生成
+
+压缩后体积没有明显减小的资源(如 draco 压缩后的 geometry)直接返回原始数据。
+brotli 为可选依赖，未安装时只提供 gzip。
+
+相关配置(`config["compression"]`)：
+
+- `gzip_level`: 默认 6
+- `brotli_quality`: 默认 5
+- `min_size`: 小于该字节数的资源不压缩，默认 1024
+- `min_ratio`: 压缩后与原始大小的比值超过该值时不使用压缩结果，默认 0.9
+- `cache_size`: 缓存的资源数，默认 4096
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional
+
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+
+from config import config, logger
+from utils.cache import LRUCache
+from utils.static_file import etag_matches, static_file_response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 服务端的编码优先顺序
+ENCODINGS = ("br", "gzip")
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+_cache: Optional[LRUCache] = None
+
+
+def compression_config() -> dict:
+    return config.get("compression", {})
+
+
+def get_variant_cache() -> LRUCache:
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(compression_config().get("cache_size", 4096))
+    return _cache
+
+
+def supported_encodings() -> List[str]:
+    return [encoding for encoding in ENCODINGS if encoding != "br" or brotli is not None]
+
+
+def choose_encoding(request: Request) -> Optional[str]:
+    """
+    :return: 客户端接受(q > 0)且服务端支持的编码，按服务端的优先顺序选择；都不接受时返回 None
+    """
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    for encoding in supported_encodings():
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=compression_config().get("gzip_level", 6), mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=compression_config().get("brotli_quality", 5))
+    raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def worth_compressing(size: int, compressed_size: int) -> bool:
+    return compressed_size < size * compression_config().get("min_ratio", 0.9)
+
+
+class Variants:
+    """
+    一个资源的原始数据及各编码的压缩结果
+    """
+    __slots__ = ("identity", "digest", "encoded")
+
+    def __init__(self, identity: bytes, digest: str):
+        self.identity = identity
+        self.digest = digest
+        # 压缩结果，没有明显减小时为 None
+        self.encoded: Dict[str, Optional[bytes]] = {}
+
+    def get(self, encoding: Optional[str]) -> Optional[bytes]:
+        """
+        :return: 该编码的数据，不压缩时返回 None
+        """
+        if encoding is None or len(self.identity) < compression_config().get("min_size", 1024):
+            return None
+        if encoding not in self.encoded:
+            data = compress(self.identity, encoding)
+            self.encoded[encoding] = data if worth_compressing(len(self.identity), len(data)) else None
+        return self.encoded[encoding]
+
+    def etag(self, encoding: Optional[str]) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+
+def get_variants(body: bytes) -> Variants:
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    cache = get_variant_cache()
+    variants = cache.get(digest)
+    if variants is None:
+        variants = Variants(body, digest)
+        cache.put(digest, variants)
+    return variants
+
+
+async def bytes_response(request: Request, body: bytes, media_type: str) -> Response:
+    """
+    返回内存中的资源，按 Accept-Encoding 选择已缓存的压缩变体
+    """
+    variants = get_variants(body)
+    encoding = choose_encoding(request)
+    if encoding and encoding not in variants.encoded:
+        await run_in_threadpool(variants.get, encoding)
+    data = variants.get(encoding)
+    if data is None:
+        data, encoding = variants.identity, None
+    headers = {"etag": variants.etag(encoding), "vary": "Accept-Encoding"}
+    if encoding:
+        headers["content-encoding"] = encoding
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, headers["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+async def json_response(request: Request, data) -> Response:
+    body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    return await bytes_response(request, body, "application/json")
+
+
+def file_variant(path: str, encoding: str) -> Optional[str]:
+    """
+    :return: 文件该编码的预压缩文件，不存在时生成；原文件不存在或压缩后没有明显减小时返回 None
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if st.st_size < compression_config().get("min_size", 1024):
+        return None
+    variant_path = path + SUFFIXES[encoding]
+    try:
+        variant_st = os.stat(variant_path)
+    except FileNotFoundError:
+        variant_st = None
+    if variant_st is None or variant_st.st_mtime_ns != st.st_mtime_ns:
+        with open(path, "rb") as f:
+            data = compress(f.read(), encoding)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # 与原文件的修改时间一致，原文件被替换后据此判断变体已失效
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, variant_path)
+        except OSError as e:
+            logger.warning(f"fail to write compressed variant `{variant_path}`: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        compressed_size = len(data)
+    else:
+        compressed_size = variant_st.st_size
+    return variant_path if worth_compressing(st.st_size, compressed_size) else None
+
+
+async def file_response(request: Request, path: str, media_type: str = "application/octet-stream") -> Response:
+    """
+    返回文件，按 Accept-Encoding 选择预压缩文件，条件请求与 Range 见 utils/static_file.py
+    """
+    encoding = choose_encoding(request)
+    variant_path = await run_in_threadpool(file_variant, path, encoding) if encoding else None
+    if variant_path:
+        return static_file_response(
+            request, variant_path, media_type, headers={"content-encoding": encoding, "vary": "Accept-Encoding"}
+        )
+    return static_file_response(request, path, media_type, headers={"vary": "Accept-Encoding"})
@@ -0,0 +1,79 @@
+"""
+共享存储模式下转换结果的暂存与提交
+
+converter 与 model manager 挂载同一文件系统时，converter 不再通过 `/bin` 接口上传二进制数据，而是：
+
+- geometry 按 sha256 直接写入 blob 存储(`slpk_root/blobs/<hash[:2]>/<hash>`)
+- 纹理等其他文件写入暂存区 `slpk_root/staging/<name>/files/<path>`
+- 全部写完后调用一次提交接口，传入清单(路径及 geometry 的 sha256)
+
+提交时 geometry 路径链接到对应的 blob，暂存文件通过 `os.replace` 原子地移动到 `slpk_root/<uuid>/<path>`，
+暂存区与目标位于同一文件系统，读取方不会看到写了一半的文件。提交可以重复执行：已移动的文件不会重复处理。
+
+目录布局需与 converter 的 `utils/shared_storage.py` 保持一致。
+"""
+import os
+import re
+import shutil
+from typing import List, Optional
+
+from config import config, logger
+from utils.blob_store import has_blob, is_valid_hash, link_blob
+
+STAGING_DIR = "staging"
+STAGING_NAME_PATTERN = re.compile(r"^[0-9A-Za-z_-]+$")
+
+
+def staging_dir(name: str) -> str:
+    return os.path.join(config["model"]["slpk_root"], STAGING_DIR, name)
+
+
+def is_valid_staging_name(name: str) -> bool:
+    return bool(STAGING_NAME_PATTERN.match(name))
+
+
+def resolve(root: str, path: str) -> Optional[str]:
+    """
+    :return: path 在 root 下的绝对路径，超出 root 时返回 None
+    """
+    target = os.path.normpath(os.path.join(root, path))
+    if os.path.commonpath([os.path.normpath(root), target]) != os.path.normpath(root):
+        return None
+    return target
+
+
+def commit_staging(name: str, entries: List[dict], target_root: str) -> List[str]:
+    """
+    提交暂存区中的文件
+    :param name: 暂存区名称
+    :param entries: 清单，`{"path": 相对 slpk 根目录的路径, "sha256": geometry 的 hash(可选)}`
+    :param target_root: slpk 根目录，即 `slpk_root/<uuid>`
+    :return: 缺少数据(blob 或暂存文件不存在)的路径；全部提交成功时删除暂存区
+    """
+    files_root = os.path.join(staging_dir(name), "files")
+    missing = []
+    for entry in entries:
+        path, sha256 = entry["path"], entry.get("sha256")
+        target = resolve(target_root, path)
+        if target is None:
+            raise ValueError(f"Unacceptable path: {path}")
+        if sha256:
+            if not is_valid_hash(sha256) or not has_blob(sha256):
+                missing.append(path)
+                continue
+            link_blob(sha256, target)
+            continue
+        source = resolve(files_root, path)
+        if source is None:
+            raise ValueError(f"Unacceptable path: {path}")
+        if os.path.isfile(source):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+        elif not os.path.isfile(target):
+            # 重复提交时文件已被移动，目标不存在才视为缺失
+            missing.append(path)
+    if missing:
+        logger.warning(f"staging `{name}`: {len(missing)} files missing, keep staging dir.")
+    else:
+        shutil.rmtree(staging_dir(name), ignore_errors=True)
+    return missing
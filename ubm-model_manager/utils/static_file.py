@@ -0,0 +1,174 @@
+"""
+静态二进制文件(geometry、纹理)的分发
+
+- 强校验 ETag(`"<inode>-<size>-<mtime_ns>"`，与 nginx 相同的做法)与 Last-Modified；
+  slpk 目录下的文件都通过临时文件 + `os.replace`/硬链接写入，内容变化时 inode 必然变化，可以作为强校验值
+- 条件请求：If-None-Match(优先)/If-Modified-Since 命中时返回 304
+- Range：支持单个区间(`bytes=a-b`、`bytes=a-`、`bytes=-n`)及 If-Range，多区间时返回完整内容，
+  超出范围返回 416
+- 零拷贝发送：
+  - 配置了 `config["model"]["accel_redirect"]`(如 `/protected-slpk/`，对应 slpk_root)时，
+    返回 `X-Accel-Redirect` 由 nginx 通过 sendfile 发送文件
+  - ASGI 服务器支持 `http.response.zerocopysend` 扩展时，交由服务器调用 sendfile
+  - 否则在线程池中分块读取发送
+"""
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Receive, Scope, Send
+
+from config import config
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def make_etag(st: os.stat_result) -> str:
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    If-None-Match 使用弱比较，忽略 `W/` 前缀
+    """
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in header.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    :return: [start, end) 区间；不支持的格式(如多区间)返回 None，表示返回完整内容
+    :raise ValueError: 区间不可满足
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:  # 最后 n 个字节
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size
+    start = int(start)
+    end = min(int(end) + 1, size) if end else size
+    if start >= size or start >= end:
+        raise ValueError(header)
+    return start, end
+
+
+def range_applies(request: Request, etag: str, last_modified: str) -> bool:
+    """
+    If-Range 与当前版本不一致时忽略 Range
+    """
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    return if_range.strip() in (etag, last_modified)
+
+
+class FileRangeResponse(Response):
+    chunk_size = 256 << 10
+
+    def __init__(self, path: str, offset: int, length: int, status_code: int, headers: dict, media_type: str,
+                 send_body: bool = True):
+        headers["content-length"] = str(length)
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.send_body = send_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        f = await run_in_threadpool(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.offset,
+                    "count": self.length,
+                })
+                return
+            await run_in_threadpool(f.seek, self.offset)
+            remaining = self.length
+            while remaining:
+                chunk = await run_in_threadpool(f.read, min(self.chunk_size, remaining))
+                if not chunk:  # 文件在发送过程中被截断
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await run_in_threadpool(f.close)
+
+
+def static_file_response(request: Request, path: str, media_type: str = "application/octet-stream",
+                         headers: dict = None) -> Response:
+    """
+    :param path: 文件的绝对路径
+    :param headers: 额外的响应头
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return Response(status_code=404)
+    etag = make_etag(st)
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    headers = dict(headers or {})
+    headers.update({
+        "etag": etag,
+        "last-modified": last_modified,
+        "accept-ranges": "bytes",
+        "cache-control": config["model"].get("static_cache_control", "public, max-age=0, must-revalidate"),
+    })
+    if not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = st.st_size
+    offset, length, status_code = 0, size, 200
+    range_header = request.headers.get("range")
+    if range_header and range_applies(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range:
+            offset, end = byte_range
+            length, status_code = end - offset, 206
+            headers["content-range"] = f"bytes {offset}-{end - 1}/{size}"
+
+    accel_redirect = config["model"].get("accel_redirect")
+    if accel_redirect:
+        # nginx 根据 Range 自行截取，这里只返回完整文件的位置
+        headers.pop("content-range", None)
+        relative_path = os.path.relpath(path, config["model"]["slpk_root"]).replace(os.sep, "/")
+        headers["x-accel-redirect"] = accel_redirect.rstrip("/") + "/" + relative_path
+        return Response(status_code=200, headers=headers, media_type=media_type)
+    return FileRangeResponse(path, offset, length, status_code, headers, media_type,
+                             send_body=request.method != "HEAD")
@@ -142,7 +142,7 @@ async def test_model_get(config_model_manager, data):
 
     await polling()
     for index in range(num):
-        await get_whole_model_test(url, project_id, model_file_ids[index])
+        await get_whole_model_test(url, project_id, model_file_ids[index], batch_size=256)
     print_long_info("GET MODEL TEST END")
 
 
@@ -1,5 +1,6 @@
 import asyncio
 import math
+import struct
 
 import aiohttp
 import requests
@@ -135,13 +136,57 @@ async def convert_model_file_test(url, project_id, model_file_id):
                 raise NotImplemented
 
 
-async def get_whole_model_test(url, project_id, model_file_id):
+def parse_batch_stream(data: bytes) -> dict:
+    """
+    Parse the length-prefixed stream returned by the batch endpoint
+
+    :param data: response body, frames of `index: uint32, length: int32` followed by `length` bytes
+    :return: {index in request: resource bytes, None if the resource does not exist}
+    """
+    resources = dict()
+    offset = 0
+    while offset < len(data):
+        index, length = struct.unpack_from("<Ii", data, offset)
+        offset += 8
+        if length < 0:
+            resources[index] = None
+        else:
+            resources[index] = data[offset:offset + length]
+            offset += length
+    return resources
+
+
+async def get_nodes_batch_test(url, project_id, model_file_id, items: list) -> list:
+    """
+    Get several node resources in one request
+
+    :param url: Model Manger's URL
+    :param items: list of (sublayer_index, node_index, resource), resource like `geometries/1`,
+        `textures/0_0_1` or `attributes/f_0/0`
+    :return: resource bytes in request order, None if the resource does not exist
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+                f"{url}/project/{project_id}/slpk/{model_file_id}/SceneServer/layers/0/nodes/batch",
+                json={"items": [{"sublayer": sublayer_index, "node": node_index, "resource": resource}
+                                for sublayer_index, node_index, resource in items]}) as response:
+            if response.status == 200:
+                resources = parse_batch_stream(await response.read())
+            else:
+                raise NotImplemented
+    if len(resources) != len(items):
+        raise NotImplemented
+    return [resources[index] for index in range(len(items))]
+
+
+async def get_whole_model_test(url, project_id, model_file_id, batch_size: int = 0):
     """
     Imitate the frontend to post requests to get whole slpk model by sequence traversal
 
     :param url: Model Manger's URL
     :param project_id:
     :param model_file_id:
+    :param batch_size: if greater than 0, get node resources by the batch endpoint, `batch_size` resources per request
     :return:
     """
 
@@ -224,6 +269,12 @@ async def get_whole_model_test(url, project_id, model_file_id):
                     else:
                         raise NotImplemented
 
+    async def get_nodes_batch(project_id: int, model_file_id: int, items: list):
+        for start in range(0, len(items), batch_size):
+            resources = await get_nodes_batch_test(url, project_id, model_file_id, items[start:start + batch_size])
+            if None in resources:
+                raise NotImplemented
+
     layer_json = await get_layer(project_id, model_file_id)
 
     print_long_info("LAYER JSON START")
@@ -262,12 +313,18 @@ async def get_whole_model_test(url, project_id, model_file_id):
             print(f"\n{nodepage_json}\n")
             print_long_info(f"SUBLAYER {sublayer_index} NODEPAGE {nodepages_list.index(nodepage_json)} JSON END")
 
+            batch_items = list()
             for node_json in nodepage_json["nodes"]:
                 node_index = node_json["index"]
                 if node_index == 0 and "parentIndex" not in node_json:
                     pass
+                elif batch_size > 0:
+                    batch_items.append((sublayer_index, node_index - 1, "geometries/1"))
+                    batch_items.extend((sublayer_index, node_index - 1, f"attributes/{key}/0") for key in keys)
                 else:
                     await get_node(project_id, model_file_id, sublayer_index, node_index - 1, keys)
+            if batch_items:
+                await get_nodes_batch(project_id, model_file_id, batch_items)
 
 
 async def create_material_attribute_test(url, project_id, model_file_id, material_attribute):